@@ -0,0 +1,511 @@
+"""Асинхронный вариант ETL на asyncpg и AsyncElasticsearch (ETL_RUNNER=asyncio).
+
+Цепочка та же, что и в синхронном ETL: AsyncPGExtractor -> AsyncBatchTransform -> AsyncESLoader,
+но каждое звено - асинхронный генератор батчей с checkpoint. Выгрузка, преобразование и загрузка
+работают одновременно и связаны очередями ограниченной длины, потоки всех алиасов обновляются
+параллельно в одном event loop.
+
+Поддерживается только режим keyset (в двухфазном варианте для фильмов), checkpoint те же, что
+у синхронного ETL, поэтому между вариантами можно переключаться без повторного перелива.
+Переименования персон и жанров всегда приводят к повторной загрузке фильмов целиком.
+Первый перелив и перестроение индексов выполняются синхронным ESLoader.
+"""
+import asyncio
+import re
+import time
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable
+
+import asyncpg
+import backoff
+import orjson
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.helpers import async_streaming_bulk
+
+from batching import AdaptiveBatchSize
+from create_indexes import INDEXES
+from dead_letters import DeadLetterFile
+from extract import (
+    FILMS_CHANGED_IDS_QUERY,
+    FILMS_ENRICH_QUERY,
+    GENRES_KEYSET_QUERY,
+    MAX_UUID,
+    MIN_KEYSET_KEY,
+    MIN_UUID,
+    PERSONS_KEYSET_QUERY,
+)
+from hashes import DocumentHashes
+from invalidation import ChangePublisher
+from load import ESLoader, ETL_ALIASES, MAX_RETRY_DELAY, RETRYABLE_STATUSES, es_backoff
+from logger import logger
+from metrics import hooks
+from models import EnvSettings, PaginationMode
+from notify import get_change_waiter
+from reindex import start_rebuilds
+from state import BaseStorage
+from transform import SerializedBatch, serialize_documents, timed_serialize_rows, transform_executor
+
+settings = EnvSettings()
+
+ASYNCPG_CONNECTION = {
+    "database": settings.pg_db_name,
+    "user": settings.pg_db_user,
+    "password": settings.pg_db_password,
+    "host": settings.pg_db_host,
+    "port": int(settings.pg_db_port),
+}
+
+# Поток выгрузки, из которого загружается каждый алиас.
+ALIAS_STREAMS = {"movies": "films", "persons": "persons", "genres": "genres"}
+
+DONE = object()
+
+
+def to_asyncpg_query(query: str) -> tuple[str, list[str]]:
+    """Заменяет именованные параметры psycopg2 %(name)s на позиционные $n asyncpg."""
+
+    names = []
+
+    def placeholder(match: re.Match) -> str:
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    return re.sub(r"%\((\w+)\)s", placeholder, query), names
+
+
+class RecordRow:
+    """Доступ к полям asyncpg.Record как к атрибутам, как у строк NamedTupleCursor."""
+
+    __slots__ = ("record",)
+
+    def __init__(self, record: asyncpg.Record):
+        self.record = record
+
+    def __getattr__(self, name: str):
+        return self.record[name]
+
+
+async def queued(batches: AsyncIterator, maxsize: int) -> AsyncIterator:
+    """Выполняет batches в отдельной задаче и отдаёт их результаты через очередь не длиннее maxsize."""
+
+    queue = asyncio.Queue(maxsize)
+
+    async def produce():
+        try:
+            async for item in batches:
+                await queue.put(item)
+            await queue.put(DONE)
+        except Exception as exc:
+            await queue.put(exc)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (item := await queue.get()) is not DONE:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
+
+
+class AsyncPGExtractor:
+    """Выгрузка потоков из postgres через asyncpg в режиме keyset."""
+
+    def __init__(
+        self,
+        state: BaseStorage,
+        batch_size: int = settings.etl_batch_size,
+        adaptive_batch_size: bool = settings.etl_adaptive_batch_size,
+    ):
+        self.state = state
+        self.batch_sizes = {
+            stream: AdaptiveBatchSize(
+                stream,
+                initial=batch_size,
+                min_size=settings.etl_batch_size_min,
+                max_size=settings.etl_batch_size_max,
+                target_bytes=settings.etl_es_bulk_chunk_bytes,
+                target_latency=settings.etl_batch_target_latency,
+                adaptive=adaptive_batch_size,
+            )
+            for stream in ("films", "persons", "genres")
+        }
+        self.connection = None
+
+    @staticmethod
+    async def init_connection(connection: asyncpg.Connection) -> None:
+        # uuid и jsonb приходят в том же виде, что и из psycopg2: строки и разобранный json.
+        await connection.set_type_codec("uuid", encoder=str, decoder=str, schema="pg_catalog", format="text")
+        await connection.set_type_codec(
+            "jsonb", encoder=lambda value: orjson.dumps(value).decode(), decoder=orjson.loads, schema="pg_catalog"
+        )
+
+    @backoff.on_exception(exception=(OSError, asyncpg.PostgresConnectionError), wait_gen=backoff.expo, logger=logger)
+    async def connect(self) -> None:
+        logger.info("Соединение с postgres (asyncpg)...")
+        self.connection = await asyncpg.connect(**ASYNCPG_CONNECTION)
+        await self.init_connection(self.connection)
+
+    @backoff.on_exception(
+        exception=(OSError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError),
+        wait_gen=backoff.expo,
+        logger=logger,
+    )
+    async def fetch(self, query: str, params: dict) -> list[asyncpg.Record]:
+        if self.connection is None or self.connection.is_closed():
+            await self.connect()
+        sql, names = to_asyncpg_query(query)
+        return await self.connection.fetch(sql, *(params[name] for name in names))
+
+    async def keyset_batches(
+        self,
+        query: str,
+        stream: str,
+        key_fields: tuple[str, str] = ("modified", "id"),
+        params: dict | None = None,
+        window_field: str | None = None,
+    ) -> AsyncIterator[tuple[list[asyncpg.Record], dict]]:
+        checkpoint_name = f"{stream}_last_key"
+        last_key = self.state.retrieve_state().get(checkpoint_name, MIN_KEYSET_KEY)
+        modified_field, id_field = key_fields
+
+        while True:
+            limit = self.batch_sizes[stream].value
+            batch = await self.fetch(
+                query,
+                {"modified": datetime.fromisoformat(last_key[0]), "id": last_key[1], "limit": limit, **(params or {})},
+            )
+            if not batch:
+                logger.info(f"Данные потока {stream} не изменялись с {last_key[0]}")
+                break
+
+            last_key = [batch[-1][modified_field].isoformat(), str(batch[-1][id_field])]
+            yield batch, {checkpoint_name: last_key}
+
+            if (batch[-1][window_field] if window_field else len(batch)) < limit:
+                break
+
+    async def films_related_since(self) -> str:
+        """То же, что PGExtractor.films_related_since: время первого перелива сохраняется сразу."""
+
+        state = self.state.retrieve_state()
+        if state.get("films_related_since"):
+            return state["films_related_since"]
+        if "films_last_key" in state:
+            return MIN_KEYSET_KEY[0]
+        related_since = (await self.fetch("SELECT now() AS now;", {}))[0]["now"].isoformat()
+        self.state.save_state({"films_related_since": related_since})
+        self.state.flush()
+        return related_since
+
+    async def films_batches(self) -> AsyncIterator[tuple[list[asyncpg.Record], dict]]:
+        related_since = await self.films_related_since()
+        async for changed_films_batch, checkpoint in self.keyset_batches(
+            FILMS_CHANGED_IDS_QUERY,
+            stream="films",
+            key_fields=("key_modified", "id"),
+            params={"id_from": MIN_UUID, "id_to": MAX_UUID, "related_since": datetime.fromisoformat(related_since)},
+            window_field="window_rows",
+        ):
+            films_ids = [changed_film["id"] for changed_film in changed_films_batch]
+            films_batch = await self.fetch(FILMS_ENRICH_QUERY, {"ids": films_ids})
+            yield films_batch, checkpoint | {"films_related_since": related_since}
+
+    async def batches(self, stream: str) -> AsyncIterator[tuple[list[asyncpg.Record], dict]]:
+        """Батчи потока stream; время выгрузки каждого передаётся в размер батча потока и в hooks."""
+
+        if stream == "films":
+            batches = self.films_batches()
+        elif stream == "persons":
+            batches = self.keyset_batches(PERSONS_KEYSET_QUERY, stream="persons")
+        else:
+            batches = self.keyset_batches(GENRES_KEYSET_QUERY, stream="genres")
+
+        started = time.perf_counter()
+        async for batch, checkpoint in batches:
+            elapsed = time.perf_counter() - started
+            self.batch_sizes[stream].observe_extract(len(batch), elapsed)
+            hooks.extract(stream, len(batch), elapsed)
+            yield batch, checkpoint
+            started = time.perf_counter()
+
+
+class AsyncBatchTransform:
+    """Сборка и сериализация документов из строк asyncpg, при workers > 0 - в пуле процессов."""
+
+    def __init__(
+        self,
+        extractor: AsyncPGExtractor,
+        validate: bool = settings.etl_validate_documents,
+        workers: int = settings.etl_transform_workers,
+    ):
+        self.extractor = extractor
+        self.validate = validate
+        self.workers = workers
+
+    async def transform_batches(
+        self, stream: str, batches: AsyncIterator[tuple[list[asyncpg.Record], dict]]
+    ) -> AsyncIterator[tuple[SerializedBatch, dict]]:
+        loop = asyncio.get_running_loop()
+        async for records, checkpoint in batches:
+            if self.workers:
+                fields = tuple(records[0].keys()) if records else ()
+                values = [tuple(record.values()) for record in records]
+                documents, elapsed = await loop.run_in_executor(
+                    transform_executor(self.workers), timed_serialize_rows, stream, fields, values, self.validate
+                )
+            else:
+                started = time.perf_counter()
+                documents = serialize_documents(stream, [RecordRow(record) for record in records], self.validate)
+                elapsed = time.perf_counter() - started
+            hooks.transform(stream, len(documents), elapsed)
+            yield documents, checkpoint
+
+
+class BulkOverloadedError(Exception):
+    """Elastic продолжает отклонять документы из-за перегрузки после всех повторов helper."""
+
+
+class AsyncESLoader:
+    """Загрузка батчей в elastic через async_streaming_bulk с сохранением checkpoint после подтверждения."""
+
+    def __init__(
+        self,
+        transformer: AsyncBatchTransform,
+        state: BaseStorage,
+        queue_size: int = settings.etl_async_queue_size,
+        chunk_bytes: int = settings.etl_es_bulk_chunk_bytes,
+        indexes: dict[str, str] | None = None,
+        skip_unchanged: bool = settings.etl_skip_unchanged,
+        publish_changes: bool = settings.etl_publish_changes,
+    ):
+        self.transformer = transformer
+        self.state = state
+        self.queue_size = queue_size
+        self.chunk_bytes = chunk_bytes
+        self.indexes = {alias: alias for alias in INDEXES} | (indexes or {})
+        self.aliases = {index: alias for alias, index in self.indexes.items()}
+        # Публикация синхронная, как и сохранение хешей и состояния: один XADD на подтверждённые документы.
+        self.change_publisher = ChangePublisher.from_settings(settings) if publish_changes else None
+        self.document_hashes = DocumentHashes(settings.etl_hashes_path) if skip_unchanged else None
+        self.dead_letters = DeadLetterFile(settings.etl_dead_letter_path)
+        self.elastic_connection = AsyncElasticsearch(
+            hosts=settings.es_url, retry_on_timeout=False, max_retries=1, http_compress=settings.etl_es_http_compress
+        )
+
+    async def bulk_to_elastic(
+        self,
+        index: str,
+        documents_batches: AsyncIterator[tuple[SerializedBatch, dict]],
+        batch_size: AdaptiveBatchSize | None = None,
+    ) -> None:
+        """Загружает поток батчей в elastic, сохраняя checkpoint батча после подтверждения всех его документов.
+
+        Документы, отклонённые с 429, helper отправляет повторно после остальных документов чанка,
+        поэтому результаты сопоставляются с отправленными документами по id, а не по порядку.
+        Если elastic отклоняет документ из-за перегрузки и после повторов, загрузка прерывается
+        BulkOverloadedError до его checkpoint: документ не попадает в dead letter и отправится снова.
+        """
+
+        stream = batch_size.stream if batch_size else index
+        # (количество документов до конца батча включительно, checkpoint батча)
+        pending_checkpoints = deque()
+        # Отправленные документы в порядке отправки: (id, хеш, _source).
+        sent = deque()
+        results = {}
+        skipped = 0
+        total = 0
+
+        async def actions() -> AsyncIterator[dict]:
+            nonlocal skipped, total
+            sent_count = 0
+            async for documents_batch, checkpoint in documents_batches:
+                for doc_id, source in documents_batch:
+                    total += 1
+                    doc_hash = None
+                    if self.document_hashes:
+                        doc_hash = self.document_hashes.hash(source)
+                        if self.document_hashes.is_unchanged(index, doc_id, doc_hash):
+                            skipped += 1
+                            continue
+                    sent_count += 1
+                    sent.append((doc_id, doc_hash, source))
+                    yield {"_index": index, "_id": doc_id, "_source": source}
+                pending_checkpoints.append((sent_count, checkpoint))
+
+        acknowledged = 0
+        saved = 0
+
+        async def save_acknowledged_checkpoints() -> tuple[int, int]:
+            """Сохраняет checkpoint батчей, все документы которых подтверждены; возвращает число
+            и объём подтверждённых с прошлого вызова документов."""
+
+            nonlocal acknowledged, saved
+            acknowledged_hashes, failed, changed_ids = {}, [], []
+            docs, docs_bytes = 0, 0
+            overloaded = None
+            while sent and results.get(sent[0][0]):
+                doc_id, doc_hash, source = sent.popleft()
+                item = results[doc_id].popleft()
+                if not results[doc_id]:
+                    del results[doc_id]
+                if item["index"]["status"] in RETRYABLE_STATUSES:
+                    overloaded = item
+                    break
+                docs += 1
+                docs_bytes += len(source)
+                if not 200 <= item["index"]["status"] < 300:
+                    failed.append((item, source))
+                    continue
+                if doc_hash:
+                    acknowledged_hashes[doc_id] = doc_hash
+                if self.change_publisher:
+                    changed_ids.append(doc_id)
+            acknowledged += docs
+
+            if failed:
+                logger.error(f"Elastic отклонил {len(failed)} документов, они записаны в {self.dead_letters.file_path}")
+                hooks.dead_letter(stream, len(failed))
+                self.dead_letters.write([item for item, _ in failed], [source for _, source in failed])
+            if acknowledged_hashes:
+                self.document_hashes.save(index, acknowledged_hashes)
+            if changed_ids:
+                await self.publish_searchable(index, changed_ids)
+            while pending_checkpoints and pending_checkpoints[0][0] <= acknowledged:
+                batch_end, checkpoint = pending_checkpoints.popleft()
+                self.state.save_state(checkpoint)
+                hooks.checkpoint(stream, checkpoint)
+                if batch_end > saved:
+                    logger.info(f"Записан batch длиной: {batch_end - saved}")
+                saved = batch_end
+            if overloaded:
+                raise BulkOverloadedError(f"Elastic перегружен, документ отклонён: {overloaded['index']}")
+            return docs, docs_bytes
+
+        async for _, item in async_streaming_bulk(
+            self.elastic_connection,
+            actions(),
+            chunk_size=self.chunk_bytes,
+            max_chunk_bytes=self.chunk_bytes,
+            raise_on_error=False,
+            max_retries=settings.etl_async_bulk_max_retries,
+            initial_backoff=1,
+            max_backoff=60,
+        ):
+            results.setdefault(item["index"]["_id"], deque()).append(item)
+            docs, docs_bytes = await save_acknowledged_checkpoints()
+            # Время bulk-запросов helper не сообщает, поэтому размер батча подстраивается
+            # только по объёму документов и времени выгрузки.
+            if batch_size:
+                batch_size.observe_load(docs, docs_bytes)
+            if docs:
+                hooks.load(stream, docs, docs_bytes)
+        await save_acknowledged_checkpoints()
+        self.state.flush()
+        hooks.pass_finished(stream)
+
+        if total:
+            logger.info(
+                f"Индекс {index}: пропущено неизменённых документов {skipped} из {total} ({skipped / total:.1%})"
+            )
+
+    async def publish_searchable(self, index: str, ids: list[str]) -> None:
+        """Публикует изменения документов индекса, когда они уже видны поиску (см. ESLoader.publish_searchable)."""
+
+        if self.state.retrieve_state().get("initial_load_index_settings"):
+            return
+        await self.elastic_connection.indices.refresh(index=index)
+        self.change_publisher.publish(self.aliases.get(index, index), ids)
+
+    @es_backoff
+    async def load_index(self, alias: str) -> None:
+        """Загружает в elastic поток алиаса: выгрузка, преобразование и загрузка идут одновременно."""
+
+        stream = ALIAS_STREAMS[alias]
+        extractor = self.transformer.extractor
+        rows_batches = queued(extractor.batches(stream), self.queue_size)
+        documents_batches = queued(self.transformer.transform_batches(stream, rows_batches), self.queue_size)
+        await self.bulk_to_elastic(self.indexes[alias], documents_batches, extractor.batch_sizes[stream])
+
+
+class AsyncStream:
+    """Загружает один алиас каждый раз, когда в его данных появляются изменения (асинхронный StreamThread).
+
+    Ошибка загрузки не останавливает остальные алиасы: она записывается в лог, а загрузка алиаса
+    повторяется с нарастающей паузой.
+    """
+
+    def __init__(self, alias: str, es_loader: AsyncESLoader, on_first_pass: Callable[[str], Awaitable[None]]):
+        self.alias = alias
+        self.es_loader = es_loader
+        self.on_first_pass = on_first_pass
+        self.changed = asyncio.Event()
+        self.changed.set()
+
+    async def run(self) -> None:
+        first_pass = True
+        attempt = 0
+        while True:
+            await self.changed.wait()
+            self.changed.clear()
+            try:
+                await self.es_loader.load_index(self.alias)
+            except Exception as exc:
+                attempt += 1
+                logger.exception(f"Ошибка загрузки потока {self.alias}: {exc}")
+                await asyncio.sleep(min(2**attempt, MAX_RETRY_DELAY))
+                self.changed.set()
+                continue
+            attempt = 0
+            if first_pass:
+                first_pass = False
+                await self.on_first_pass(self.alias)
+
+
+async def run_async_etl(storage: BaseStorage) -> None:
+    """Асинхронный вариант основного цикла ETL: алиасы с изменениями загружаются одновременно.
+
+    Перестроение индексов и настройки первого перелива выполняет синхронный ESLoader.
+    """
+
+    if settings.etl_pagination_mode != PaginationMode.keyset:
+        logger.warning(
+            f"ETL_PAGINATION_MODE={settings.etl_pagination_mode.value} не поддерживается асинхронным ETL, "
+            "выгрузка идёт в режиме keyset"
+        )
+    admin_loader = ESLoader(transformer=None, state=storage, skip_unchanged=False)
+    start_rebuilds(admin_loader.elastic_connection)
+    initial_load = admin_loader.initial_load_required()
+    if initial_load:
+        admin_loader.start_initial_load()
+    pending_first_pass = set(ETL_ALIASES)
+
+    async def on_first_pass(alias: str) -> None:
+        """Первый перелив завершается, когда все алиасы закончили свой первый проход."""
+
+        nonlocal initial_load
+        pending_first_pass.discard(alias)
+        if initial_load and not pending_first_pass:
+            await asyncio.to_thread(admin_loader.finish_initial_load)
+            initial_load = False
+
+    streams = {}
+    for alias in ETL_ALIASES:
+        extractor = AsyncPGExtractor(state=storage)
+        await extractor.connect()
+        loader = AsyncESLoader(transformer=AsyncBatchTransform(extractor=extractor), state=storage)
+        streams[alias] = AsyncStream(alias, loader, on_first_pass)
+    # Ссылки на задачи держатся здесь: event loop хранит только слабые ссылки.
+    tasks = [asyncio.create_task(stream.run(), name=f"stream-{alias}") for alias, stream in streams.items()]
+
+    change_waiter = get_change_waiter(settings)
+    while True:
+        for alias in await asyncio.to_thread(change_waiter.wait_for_changes):
+            streams[alias].changed.set()
+        for task in tasks:
+            # AsyncStream.run завершается, только если упал on_first_pass: ошибка останавливает ETL.
+            if task.done():
+                task.result()
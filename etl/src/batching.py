@@ -0,0 +1,85 @@
+from threading import Lock
+
+from logger import logger
+
+# Вес нового наблюдения в скользящих средних.
+SMOOTHING = 0.3
+
+
+class AdaptiveBatchSize:
+    """Размер батча выгрузки одного потока, подстраиваемый под наблюдаемую нагрузку.
+
+    По скользящим средним размера документа, времени выгрузки строки из postgres и времени
+    индексации документа в elastic выбирается размер, при котором батч занимает около
+    target_bytes и выгружается и индексируется не дольше target_latency. За один шаг размер
+    меняется не больше чем вдвое. Если elastic отклоняет документы из-за перегрузки (429),
+    размер сразу уменьшается вдвое.
+    """
+
+    def __init__(
+        self,
+        stream: str,
+        initial: int,
+        min_size: int,
+        max_size: int,
+        target_bytes: int,
+        target_latency: float,
+        adaptive: bool = True,
+    ):
+        self.stream = stream
+        self.size = initial
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_bytes = target_bytes
+        self.target_latency = target_latency
+        self.adaptive = adaptive
+        self.doc_bytes = None
+        self.doc_load_seconds = None
+        self.row_extract_seconds = None
+        self.lock = Lock()
+
+    @property
+    def value(self) -> int:
+        return self.size
+
+    @staticmethod
+    def smooth(average: float | None, observed: float) -> float:
+        if average is None:
+            return observed
+        return average + SMOOTHING * (observed - average)
+
+    def observe_extract(self, rows: int, seconds: float) -> None:
+        if not self.adaptive or not rows:
+            return
+        with self.lock:
+            self.row_extract_seconds = self.smooth(self.row_extract_seconds, seconds / rows)
+            self.adjust()
+
+    def observe_load(self, docs: int, payload_bytes: int, seconds: float | None = None, rejected: int = 0) -> None:
+        if not self.adaptive or not docs:
+            return
+        with self.lock:
+            if rejected:
+                self.resize(self.size // 2)
+                return
+            self.doc_bytes = self.smooth(self.doc_bytes, payload_bytes / docs)
+            if seconds is not None:
+                self.doc_load_seconds = self.smooth(self.doc_load_seconds, seconds / docs)
+            self.adjust()
+
+    def adjust(self) -> None:
+        limits = []
+        if self.doc_bytes:
+            limits.append(self.target_bytes / self.doc_bytes)
+        if self.doc_load_seconds:
+            limits.append(self.target_latency / self.doc_load_seconds)
+        if self.row_extract_seconds:
+            limits.append(self.target_latency / self.row_extract_seconds)
+        if limits:
+            self.resize(min(max(min(limits), self.size / 2), self.size * 2))
+
+    def resize(self, size: float) -> None:
+        size = max(self.min_size, min(self.max_size, int(size)))
+        if size != self.size:
+            logger.debug(f"Размер батча потока {self.stream}: {self.size} -> {size}")
+            self.size = size
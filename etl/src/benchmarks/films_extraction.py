@@ -0,0 +1,96 @@
+"""Сравнение стратегий выгрузки изменившихся фильмов на заполненной базе.
+
+Запуск из etl/src (или в контейнере etl):
+    python -m benchmarks.films_extraction --touch-persons 1 --repeat 3
+
+Сценарий full - первый перелив всех фильмов, incremental - выгрузка после изменения
+--touch-persons случайных персон (их modified выставляется в now()).
+"""
+import argparse
+import tempfile
+import time
+from datetime import datetime
+
+import pytz
+
+from extract import MIN_KEYSET_KEY, PGExtractor
+from models import PaginationMode
+from state import JsonFileStorage
+
+STRATEGIES = {
+    "offset_join": {"pagination_mode": PaginationMode.offset, "films_two_phase": False},
+    "keyset_join": {"pagination_mode": PaginationMode.keyset, "films_two_phase": False},
+    "keyset_two_phase": {"pagination_mode": PaginationMode.keyset, "films_two_phase": True},
+}
+
+
+def extract_all_films(strategy: dict, since: datetime, related_since: datetime, batch_size: int) -> tuple[int, float]:
+    """Выгружает все фильмы, изменившиеся после since, возвращает их количество и время в секундах."""
+
+    with tempfile.NamedTemporaryFile(suffix=".json") as state_file:
+        storage = JsonFileStorage(state_file.name)
+        storage.save_state(
+            {
+                "films_last_extracting_time": since.isoformat(),
+                "films_last_key": [since.isoformat(), MIN_KEYSET_KEY[1]],
+                # Как при первом переливе: изменения персон и жанров до замера не выгружают фильмы повторно.
+                "films_related_since": related_since.isoformat(),
+            }
+        )
+        extractor = PGExtractor(
+            state=storage, batch_size=batch_size, adaptive_batch_size=False, streaming=False, **strategy
+        )
+
+        started = time.perf_counter()
+        films_count = sum(len(films_batch) for films_batch, _ in extractor.get_modified_films_batch())
+        elapsed = time.perf_counter() - started
+
+        extractor.cursor.connection.close()
+
+    return films_count, elapsed
+
+
+def touch_persons(count: int) -> datetime:
+    """Обновляет modified у count случайных персон и возвращает момент до обновления."""
+
+    extractor = PGExtractor(state=JsonFileStorage(), batch_size=1, adaptive_batch_size=False)
+    connection = extractor.cursor.connection
+    extractor.cursor.execute("SELECT now() - interval '1 millisecond' AS since;")
+    since = extractor.cursor.fetchone().since
+    extractor.cursor.execute(
+        """
+        UPDATE content.person SET modified = now()
+        WHERE id IN (SELECT id FROM content.person ORDER BY random() LIMIT %s);
+        """,
+        (count,),
+    )
+    connection.commit()
+    connection.close()
+    return since
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--touch-persons", type=int, default=1)
+    args = parser.parse_args()
+
+    # Сценарий -> (since, с какого момента учитываются изменения персон и жанров). При первом переливе
+    # фильмы выгружаются по своим изменениям, изменения персон и жанров до него не учитываются.
+    scenarios = {"full": (datetime.min.replace(tzinfo=pytz.utc), datetime.max.replace(tzinfo=pytz.utc))}
+    if args.touch_persons:
+        since = touch_persons(args.touch_persons)
+        scenarios["incremental"] = (since, since)
+
+    print(f"{'scenario':<12} {'strategy':<18} {'films':>8} {'best, s':>10}")
+    for scenario, (since, related_since) in scenarios.items():
+        for name, strategy in STRATEGIES.items():
+            runs = [extract_all_films(strategy, since, related_since, args.batch_size) for _ in range(args.repeat)]
+            films_count = runs[0][0]
+            best = min(elapsed for _, elapsed in runs)
+            print(f"{scenario:<12} {name:<18} {films_count:>8} {best:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
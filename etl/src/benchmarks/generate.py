@@ -0,0 +1,208 @@
+"""Генератор синтетических данных фильмотеки для нагрузочных замеров ETL.
+
+Запуск из etl/src (или в контейнере etl):
+    python -m benchmarks.generate --films 100k --seed 0 --truncate
+
+Заполняет content.film_work, person, genre, genre_film_work и person_film_work через COPY.
+Размер задаётся числом фильмов (10k, 100k, 1m или любое число), персон по умолчанию вдвое
+больше. Состав съёмочной группы похож на настоящий: актёров в среднем около десяти с длинным
+хвостом больших составов, 1-3 режиссёра и 1-5 сценаристов. Популярность персон и жанров
+распределена по закону Ципфа, поэтому переименование самой популярной персоны или жанра
+затрагивает тысячи фильмов. При одинаковом seed данные совпадают.
+"""
+import argparse
+import io
+import math
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+import psycopg2
+import pytz
+
+from extract import POSTGRES_CONNECTION
+
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+# fmt: off
+GENRES = (
+    "Drama", "Comedy", "Action", "Thriller", "Romance", "Crime", "Horror", "Adventure", "Documentary",
+    "Family", "Mystery", "Fantasy", "Sci-Fi", "Animation", "Biography", "History", "Music", "War",
+    "Sport", "Western", "Musical", "Short", "Reality-TV", "News", "Talk-Show", "Game-Show", "Film-Noir",
+)
+FIRST_NAMES = (
+    "James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "William", "Elizabeth",
+    "David", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Charles", "Karen",
+    "Ivan", "Olga", "Sergey", "Anna", "Dmitry", "Elena", "Pierre", "Marie", "Hans", "Yuki",
+)
+LAST_NAMES = (
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Wilson", "Anderson", "Taylor", "Moore", "Jackson", "Martin", "Lee", "Thompson",
+    "Ivanov", "Petrova", "Sidorov", "Dubois", "Schmidt", "Tanaka", "Rossi", "Kowalski", "Novak", "Silva",
+)
+WORDS = (
+    "star", "war", "night", "love", "dark", "city", "last", "return", "secret", "king", "dream", "man",
+    "girl", "house", "road", "fire", "lost", "black", "blood", "time", "world", "heart", "shadow", "game",
+    "river", "storm", "empire", "ghost", "island", "summer", "winter", "journey", "hope", "silent", "wild",
+)
+# fmt: on
+
+# Вероятности числа режиссёров (1, 2, 3) и сценаристов (1..5) в фильме.
+DIRECTORS_WEIGHTS = (85, 12, 3)
+WRITERS_WEIGHTS = (40, 30, 15, 10, 5)
+# Число актёров: логнормальное распределение с медианой около 9, не больше MAX_ACTORS.
+ACTORS_MU = math.log(9)
+ACTORS_SIGMA = 0.6
+MAX_ACTORS = 100
+# Показатели распределения Ципфа для популярности персон и жанров: самая популярная персона
+# снимается в 5-20% фильмов (чем больше база, тем меньше), самый популярный жанр - в трети фильмов.
+PERSONS_ZIPF_EXPONENT = 0.7
+GENRES_ZIPF_EXPONENT = 1.0
+# Сколько фильмов или персон собирается в один COPY.
+COPY_CHUNK_ROWS = 20_000
+
+
+def parse_size(value: str) -> int:
+    return SIZES.get(value.lower()) or int(value)
+
+
+def zipf_weights(count: int, exponent: float) -> list[float]:
+    """Накопленные веса для random.choices: вес элемента ранга r пропорционален 1 / r ** exponent."""
+
+    return list(accumulate(1 / (rank**exponent) for rank in range(1, count + 1)))
+
+
+class DataGenerator:
+    """Детерминированно порождает строки таблиц content в формате COPY (text)."""
+
+    def __init__(self, films: int, persons: int, seed: int = 0):
+        self.rnd = random.Random(seed)
+        self.films = films
+        self.persons = persons
+        self.now = datetime(2022, 9, 1, tzinfo=pytz.utc)
+        self.genre_ids = [self.uuid() for _ in GENRES]
+        self.person_ids = [self.uuid() for _ in range(persons)]
+        self.genre_weights = zipf_weights(len(GENRES), GENRES_ZIPF_EXPONENT)
+        self.person_weights = zipf_weights(persons, PERSONS_ZIPF_EXPONENT)
+
+    def uuid(self) -> str:
+        return str(uuid.UUID(int=self.rnd.getrandbits(128), version=4))
+
+    def timestamp(self) -> str:
+        return (self.now - timedelta(seconds=self.rnd.randrange(365 * 24 * 3600))).isoformat()
+
+    def words(self, count: int) -> str:
+        return " ".join(self.rnd.choices(WORDS, k=count))
+
+    def sample_persons(self, count: int) -> list[str]:
+        """count разных персон, выбранных с учётом их популярности."""
+
+        count = min(count, self.persons)
+        chosen = {}
+        while len(chosen) < count:
+            for person_id in self.rnd.choices(self.person_ids, cum_weights=self.person_weights, k=count - len(chosen)):
+                chosen[person_id] = None
+        return list(chosen)
+
+    def genre_rows(self) -> str:
+        return "".join(
+            f"{genre_id}\t{name}\t{name} films\t{self.timestamp()}\t{self.timestamp()}\n"
+            for genre_id, name in zip(self.genre_ids, GENRES)
+        )
+
+    def person_rows(self, start: int, stop: int) -> str:
+        rows = []
+        for number in range(start, stop):
+            person_id = self.person_ids[number]
+            full_name = f"{self.rnd.choice(FIRST_NAMES)} {self.rnd.choice(LAST_NAMES)} {number}"
+            rows.append(f"{person_id}\t{full_name}\t{self.timestamp()}\t{self.timestamp()}\n")
+        return "".join(rows)
+
+    def film_chunk(self, films: int) -> tuple[str, str, str]:
+        """Строки film_work, genre_film_work и person_film_work для films новых фильмов."""
+
+        film_rows, genre_rows, person_rows = [], [], []
+        for _ in range(films):
+            film_id = self.uuid()
+            created = self.timestamp()
+            film_type = "movie" if self.rnd.random() < 0.9 else "tv_show"
+            rating = round(self.rnd.uniform(1, 10), 1)
+            film_rows.append(
+                f"{film_id}\t{self.words(3).title()}\t{self.words(40)}\t\\N\t{rating}\t{film_type}\t"
+                f"{created}\t{created}\t\\N\t\\N\n"
+            )
+
+            genres_count = self.rnd.choices((1, 2, 3), weights=(50, 35, 15))[0]
+            film_genres = set(self.rnd.choices(self.genre_ids, cum_weights=self.genre_weights, k=genres_count))
+            for genre_id in film_genres:
+                genre_rows.append(f"{self.uuid()}\t{genre_id}\t{film_id}\t{created}\n")
+
+            actors = min(MAX_ACTORS, max(1, round(self.rnd.lognormvariate(ACTORS_MU, ACTORS_SIGMA))))
+            directors = self.rnd.choices((1, 2, 3), weights=DIRECTORS_WEIGHTS)[0]
+            writers = self.rnd.choices((1, 2, 3, 4, 5), weights=WRITERS_WEIGHTS)[0]
+            # Один человек может быть в фильме и режиссёром, и сценаристом, но не дважды в одной роли.
+            for role, count in (("actor", actors), ("director", directors), ("writer", writers)):
+                for person_id in self.sample_persons(count):
+                    person_rows.append(f"{self.uuid()}\t{film_id}\t{person_id}\t{role}\t{created}\n")
+
+        return "".join(film_rows), "".join(genre_rows), "".join(person_rows)
+
+
+def copy_rows(cursor, table: str, columns: str, rows: str) -> None:
+    cursor.copy_expert(f"COPY content.{table} ({columns}) FROM STDIN", io.StringIO(rows))
+
+
+def generate(films: int, persons: int, seed: int, truncate: bool) -> None:
+    generator = DataGenerator(films=films, persons=persons, seed=seed)
+    connection = psycopg2.connect(**POSTGRES_CONNECTION)
+    cursor = connection.cursor()
+    if truncate:
+        cursor.execute(
+            "TRUNCATE content.person_film_work, content.genre_film_work, content.film_work, "
+            "content.person, content.genre;"
+        )
+
+    started = time.perf_counter()
+    copy_rows(cursor, "genre", "id, name, description, created, modified", generator.genre_rows())
+    for start in range(0, persons, COPY_CHUNK_ROWS):
+        person_rows = generator.person_rows(start, min(start + COPY_CHUNK_ROWS, persons))
+        copy_rows(cursor, "person", "id, full_name, created, modified", person_rows)
+    connection.commit()
+
+    roles = 0
+    for generated in range(0, films, COPY_CHUNK_ROWS):
+        film_rows, genre_rows, person_rows = generator.film_chunk(min(COPY_CHUNK_ROWS, films - generated))
+        copy_rows(
+            cursor,
+            "film_work",
+            "id, title, description, creation_date, rating, type, created, modified, certificate, file_path",
+            film_rows,
+        )
+        copy_rows(cursor, "genre_film_work", "id, genre_id, film_work_id, created", genre_rows)
+        copy_rows(cursor, "person_film_work", "id, film_work_id, person_id, role, created", person_rows)
+        roles += person_rows.count("\n")
+        connection.commit()
+        print(f"{min(generated + COPY_CHUNK_ROWS, films)} / {films} фильмов, ролей {roles}")
+
+    for table in ("film_work", "person", "genre", "person_film_work", "genre_film_work"):
+        cursor.execute(f"ANALYZE content.{table};")
+    connection.commit()
+    connection.close()
+    print(f"Сгенерировано за {time.perf_counter() - started:.1f} с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--films", type=parse_size, default="10k", help="10k, 100k, 1m или число фильмов")
+    parser.add_argument("--persons", type=int, default=None, help="по умолчанию вдвое больше фильмов")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--truncate", action="store_true", help="очистить таблицы content перед генерацией")
+    args = parser.parse_args()
+
+    generate(films=args.films, persons=args.persons or 2 * args.films, seed=args.seed, truncate=args.truncate)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Сквозной замер ETL на базе, заполненной benchmarks.generate.
+
+Запуск из etl/src (или в контейнере etl):
+    python -m benchmarks.generate --films 100k --truncate
+    python -m benchmarks.pipeline --sink elastic
+
+Сценарии выполняются по порядку с общим состоянием ETL во временном каталоге:
+full - первый перелив всех алиасов в индексы benchmark_*; incremental - изменение
+--touch-films случайных фильмов; person_rename - переименование персоны с наибольшим
+числом ролей; genre_rename - переименование самого популярного жанра. full выполняется
+всегда: остальные сценарии догружают изменения после него.
+
+Каждый сценарий запускается в отдельном процессе, чтобы пиковый RSS относился только к нему.
+Для сценария выводятся строки, выгруженные из postgres, загруженные документы, rows/sec
+и docs/sec по полному времени сценария и суммарное время этапов по метрикам ETL. Время
+этапов суммируется по батчам и параллельным bulk-запросам и может превышать время сценария.
+
+--sink null заменяет elastic заглушкой, которая подтверждает все документы без отправки:
+так измеряются выгрузка и преобразование без elastic. Переименования в документах фильмов
+(ETL_PROPAGATE_RENAMES) в этом режиме не выполняются. Неизменённые документы не пропускаются.
+"""
+import argparse
+import multiprocessing
+import resource
+import tempfile
+import time
+from typing import Callable
+
+import orjson
+import psycopg2
+
+from batching import AdaptiveBatchSize
+from create_indexes import INDEXES
+from extract import POSTGRES_CONNECTION, PGExtractor
+from load import ESLoader, ETL_ALIASES
+from metrics import ETLMetrics, hooks
+from state import BufferedJsonFileStorage
+from transform import BatchTransform
+
+BENCHMARK_INDEXES = {alias: f"benchmark_{alias}" for alias in INDEXES}
+
+
+class NullESLoader(ESLoader):
+    """ESLoader без elastic: bulk-запросы не отправляются, все документы считаются записанными."""
+
+    def send_bulk(self, chunk: list[bytes], batch_size: AdaptiveBatchSize | None = None) -> list[dict]:
+        started = time.perf_counter()
+        items = []
+        for operation in chunk:
+            action = orjson.loads(operation.split(b"\n", 1)[0])["index"]
+            items.append({"index": {"_index": action["_index"], "_id": action["_id"], "status": 201}})
+        latency = time.perf_counter() - started
+        chunk_bytes = sum(len(operation) for operation in chunk)
+        if batch_size:
+            batch_size.observe_load(len(chunk), chunk_bytes)
+        hooks.load(batch_size.stream if batch_size else "", len(chunk), chunk_bytes, latency)
+        return items
+
+    def rename_in_films(self, names: dict[str, str], fields: list[str], names_fields: dict[str, str]) -> None:
+        pass
+
+
+def touch_films(cursor, count: int, seed: int) -> int:
+    cursor.execute(
+        """
+        UPDATE content.film_work SET modified = now()
+        WHERE id IN (SELECT id FROM content.film_work ORDER BY md5(id::text || %s) LIMIT %s);
+        """,
+        (str(seed), count),
+    )
+    return cursor.rowcount
+
+
+def rename_top_person(cursor) -> int:
+    cursor.execute(
+        """
+        SELECT person_id, COUNT(DISTINCT film_work_id) AS films
+        FROM content.person_film_work
+        GROUP BY person_id
+        ORDER BY films DESC
+        LIMIT 1;
+        """
+    )
+    person_id, films = cursor.fetchone()
+    cursor.execute(
+        "UPDATE content.person SET full_name = full_name || ' Jr.', modified = now() WHERE id = %s;", (person_id,)
+    )
+    return films
+
+
+def rename_top_genre(cursor) -> int:
+    cursor.execute(
+        """
+        SELECT genre_id, COUNT(*) AS films
+        FROM content.genre_film_work
+        GROUP BY genre_id
+        ORDER BY films DESC
+        LIMIT 1;
+        """
+    )
+    genre_id, films = cursor.fetchone()
+    cursor.execute("UPDATE content.genre SET name = name || ' *', modified = now() WHERE id = %s;", (genre_id,))
+    return films
+
+
+# Подготовка сценария в postgres; возвращает число затронутых фильмов.
+SCENARIOS: dict[str, Callable] = {
+    "full": lambda cursor, args: None,
+    "incremental": lambda cursor, args: touch_films(cursor, args.touch_films, args.seed),
+    "person_rename": lambda cursor, args: rename_top_person(cursor),
+    "genre_rename": lambda cursor, args: rename_top_genre(cursor),
+}
+
+
+def prepare(scenario: str, args: argparse.Namespace) -> int | None:
+    connection = psycopg2.connect(**POSTGRES_CONNECTION)
+    with connection, connection.cursor() as cursor:
+        affected_films = SCENARIOS[scenario](cursor, args)
+    connection.close()
+    return affected_films
+
+
+def run_scenario(sink: str, state_path: str) -> dict:
+    """Догружает изменения всех алиасов и возвращает замеры сценария."""
+
+    metrics = ETLMetrics()
+    hooks.register(metrics)
+    storage = BufferedJsonFileStorage(state_path, flush_interval=1)
+    loader_class = NullESLoader if sink == "null" else ESLoader
+    es_loader = loader_class(
+        transformer=BatchTransform(extractor=PGExtractor(state=storage)),
+        state=storage,
+        indexes=BENCHMARK_INDEXES,
+        skip_unchanged=False,
+        publish_changes=False,
+    )
+
+    started = time.perf_counter()
+    initial_load = sink == "elastic" and es_loader.initial_load_required()
+    if initial_load:
+        es_loader.start_initial_load()
+    for alias in ETL_ALIASES:
+        es_loader.load_index(alias)
+    if initial_load:
+        es_loader.finish_initial_load()
+    elapsed = time.perf_counter() - started
+
+    stages = {stage: 0.0 for stage in ("extract", "transform", "load")}
+    for (_, stage), histogram in metrics.durations.items():
+        stages[stage] += histogram.sum
+    return {
+        "rows": sum(value for (name, _), value in metrics.counters.items() if name == "etl_rows_extracted_total"),
+        "docs": sum(value for (name, _), value in metrics.counters.items() if name == "etl_documents_loaded_total"),
+        "seconds": elapsed,
+        # На linux ru_maxrss в килобайтах.
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        **stages,
+    }
+
+
+def recreate_indexes() -> None:
+    client = ESLoader(transformer=None, state=None, skip_unchanged=False, publish_changes=False).elastic_connection
+    for alias, index in BENCHMARK_INDEXES.items():
+        client.indices.delete(index=index, ignore_unavailable=True)
+        client.indices.create(index=index, **INDEXES[alias])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sink", choices=("elastic", "null"), default="elastic")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--touch-films", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    scenarios = ["full"] + [scenario for scenario in args.scenarios if scenario != "full"]
+
+    if args.sink == "elastic":
+        recreate_indexes()
+
+    context = multiprocessing.get_context("spawn")
+    print(
+        f"{'scenario':<14} {'films':>8} {'rows':>9} {'docs':>9} {'time, s':>9} {'rows/s':>9} {'docs/s':>9} "
+        f"{'rss, MB':>8} {'extract':>8} {'transf.':>8} {'load':>8}"
+    )
+    with tempfile.TemporaryDirectory() as state_dir:
+        for scenario in scenarios:
+            affected_films = prepare(scenario, args)
+            with context.Pool(processes=1) as pool:
+                result = pool.apply(run_scenario, (args.sink, f"{state_dir}/state.json"))
+            seconds = result["seconds"]
+            print(
+                f"{scenario:<14} {affected_films if affected_films is not None else '-':>8} {result['rows']:>9.0f} "
+                f"{result['docs']:>9.0f} {seconds:>9.2f} {result['rows'] / seconds:>9.0f} "
+                f"{result['docs'] / seconds:>9.0f} {result['peak_rss_mb']:>8.0f} {result['extract']:>8.2f} "
+                f"{result['transform']:>8.2f} {result['load']:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Сравнение синхронного и асинхронного ETL на полном переливе одного алиаса.
+
+Запуск из etl/src (или в контейнере etl):
+    python -m benchmarks.runners --alias movies --repeat 3
+
+Каждый прогон загружает все данные алиаса во временный индекс с пустым состоянием
+и удаляет индекс после замера. Неизменённые документы не пропускаются.
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+
+from async_etl import AsyncBatchTransform, AsyncESLoader, AsyncPGExtractor
+from create_indexes import INDEXES
+from extract import PGExtractor
+from load import ESLoader
+from state import JsonFileStorage
+from transform import BatchTransform
+
+
+def load_sync(alias: str, index: str, storage: JsonFileStorage) -> None:
+    batch_transform = BatchTransform(extractor=PGExtractor(state=storage))
+    es_loader = ESLoader(
+        transformer=batch_transform, state=storage, indexes={alias: index}, skip_unchanged=False, publish_changes=False
+    )
+    es_loader.load_index(alias)
+
+
+async def load_async(alias: str, index: str, storage: JsonFileStorage) -> None:
+    extractor = AsyncPGExtractor(state=storage)
+    await extractor.connect()
+    es_loader = AsyncESLoader(
+        transformer=AsyncBatchTransform(extractor=extractor),
+        state=storage,
+        indexes={alias: index},
+        skip_unchanged=False,
+        publish_changes=False,
+    )
+    try:
+        await es_loader.load_index(alias)
+    finally:
+        await es_loader.elastic_connection.close()
+        await extractor.connection.close()
+
+
+RUNNERS = {
+    "sync": load_sync,
+    "asyncio": lambda alias, index, storage: asyncio.run(load_async(alias, index, storage)),
+}
+
+
+def run_once(runner: str, alias: str) -> tuple[int, float]:
+    """Загружает алиас во временный индекс, возвращает количество документов и время в секундах."""
+
+    index = f"benchmark_{alias}_{runner}"
+    client = ESLoader(
+        transformer=None, state=JsonFileStorage(), skip_unchanged=False, publish_changes=False
+    ).elastic_connection
+    client.indices.delete(index=index, ignore_unavailable=True)
+    client.indices.create(index=index, **INDEXES[alias])
+    try:
+        with tempfile.NamedTemporaryFile(suffix=".json") as state_file:
+            storage = JsonFileStorage(state_file.name)
+            started = time.perf_counter()
+            RUNNERS[runner](alias, index, storage)
+            elapsed = time.perf_counter() - started
+        client.indices.refresh(index=index)
+        docs_count = client.count(index=index)["count"]
+    finally:
+        client.indices.delete(index=index, ignore_unavailable=True)
+    return docs_count, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--alias", choices=list(INDEXES), default="movies")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'runner':<10} {'docs':>8} {'best, s':>10} {'docs/s':>10}")
+    for runner in RUNNERS:
+        runs = [run_once(runner, args.alias) for _ in range(args.repeat)]
+        docs_count = runs[0][0]
+        best = min(elapsed for _, elapsed in runs)
+        print(f"{runner:<10} {docs_count:>8} {best:>10.3f} {docs_count / best:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
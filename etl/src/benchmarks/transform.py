@@ -0,0 +1,115 @@
+"""Микро-бенчмарк преобразования строк фильмов в документы elastic, без postgres и elastic.
+
+Запуск из etl/src (или в контейнере etl):
+    python -m benchmarks.transform --films 20000 --repeat 3
+
+pydantic_json - прежний способ: дедупликация через множества кортежей, pydantic-модели и .json();
+строки содержат декартово произведение персон и жанров, как до ARRAY_AGG(DISTINCT ...).
+dict_orjson - текущий: словарь _source прямо из строки и orjson, вложенные списки уже без дублей.
+dict_orjson_validate - текущий в режиме отладки ETL_VALIDATE_DOCUMENTS.
+"""
+import argparse
+import random
+import time
+import uuid
+from collections import namedtuple
+
+import orjson
+
+from models import ElasticMoviesSchemaModel
+from transform import BatchTransform
+
+FilmRow = namedtuple("FilmRow", "fw_id title description rating type created modified genres actors directors writers")
+
+
+def make_rows(films: int, seed: int = 0) -> tuple[list[FilmRow], list[FilmRow]]:
+    """Строки выгрузки в прежнем (с дублями) и текущем (без дублей) виде для одних и тех же фильмов."""
+
+    rnd = random.Random(seed)
+    persons = [{"id": str(uuid.UUID(int=rnd.getrandbits(128))), "name": f"Person {i}"} for i in range(5000)]
+    genres = [{"id": str(uuid.UUID(int=rnd.getrandbits(128))), "name": f"Genre {i}"} for i in range(30)]
+    legacy_rows, rows = [], []
+    for i in range(films):
+        film_genres = sorted(rnd.sample(genres, rnd.randint(1, 3)), key=lambda item: item["id"])
+        roles = {
+            role: sorted(rnd.sample(persons, rnd.randint(low, high)), key=lambda item: item["id"])
+            for role, low, high in (("actors", 3, 15), ("directors", 1, 2), ("writers", 1, 4))
+        }
+        common = {
+            "fw_id": str(uuid.UUID(int=rnd.getrandbits(128))),
+            "title": f"Film {i}",
+            "description": "Lorem ipsum dolor sit amet " * 5,
+            "rating": round(rnd.uniform(1, 10), 1),
+            "type": "movie",
+            "created": None,
+            "modified": None,
+        }
+        rows.append(FilmRow(**common, genres=film_genres, **roles))
+        # Каждая персона повторяется по числу жанров, каждый жанр - по числу персон.
+        persons_count = sum(len(role_persons) for role_persons in roles.values())
+        legacy_rows.append(
+            FilmRow(
+                **common,
+                genres=film_genres * persons_count,
+                **{role: role_persons * len(film_genres) for role, role_persons in roles.items()},
+            )
+        )
+    return legacy_rows, rows
+
+
+def pydantic_json(film) -> str:
+    unique = {
+        field: [dict(item) for item in {tuple(person.items()) for person in getattr(film, field) or []}]
+        for field in ("actors", "writers", "directors", "genres")
+    }
+    return ElasticMoviesSchemaModel(
+        id=film.fw_id,
+        imdb_rating=film.rating,
+        genres=unique["genres"],
+        title=film.title,
+        description=film.description,
+        directors=unique["directors"],
+        actors_names=[actor["name"] for actor in unique["actors"]],
+        writers_names=[writer["name"] for writer in unique["writers"]],
+        actors=unique["actors"],
+        writers=unique["writers"],
+    ).json()
+
+
+def dict_orjson(film) -> bytes:
+    return orjson.dumps(BatchTransform.film_document(film))
+
+
+def dict_orjson_validate(film) -> bytes:
+    return orjson.dumps(ElasticMoviesSchemaModel(**BatchTransform.film_document(film)).dict())
+
+
+def best_rate(transform, rows: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for row in rows:
+            transform(row)
+        best = min(best, time.perf_counter() - started)
+    return len(rows) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--films", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    legacy_rows, rows = make_rows(args.films)
+    strategies = {
+        "pydantic_json": (pydantic_json, legacy_rows),
+        "dict_orjson": (dict_orjson, rows),
+        "dict_orjson_validate": (dict_orjson_validate, rows),
+    }
+    print(f"{'strategy':<22} {'rows/s':>10}")
+    for name, (transform, strategy_rows) in strategies.items():
+        print(f"{name:<22} {best_rate(transform, strategy_rows, args.repeat):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
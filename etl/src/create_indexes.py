@@ -5,6 +5,11 @@ from elasticsearch import Elasticsearch
 from logger import logger
 from models import EnvSettings
 
+# Версии физических индексов, на которые указывают алиасы movies, genres и persons.
+# При изменении маппинга или анализаторов версию нужно увеличить: ETL построит новый
+# индекс в фоне и атомарно переключит на него алиас.
+INDEX_VERSIONS = {"movies": 1, "genres": 1, "persons": 1}
+
 INDEXES = {
     "movies": {
         "settings": {
@@ -133,19 +138,78 @@ INDEXES = {
 }
 
 
+def versioned_index_name(alias: str) -> str:
+    """Имя физического индекса текущей версии для алиаса."""
+
+    return f"{alias}_v{INDEX_VERSIONS[alias]}"
+
+
+def alias_indexes(client: Elasticsearch, alias: str) -> list[str]:
+    """Физические индексы, на которые сейчас указывает алиас."""
+
+    if not client.indices.exists_alias(name=alias):
+        return []
+    return list(client.indices.get_alias(name=alias))
+
+
+def indexes_to_rebuild(client: Elasticsearch) -> list[str]:
+    """Алиасы, которые ещё не указывают на текущую версию индекса."""
+
+    return [alias for alias in INDEXES if alias_indexes(client, alias) != [versioned_index_name(alias)]]
+
+
+def swap_alias(client: Elasticsearch, alias: str) -> None:
+    """Атомарно переключает алиас на текущую версию индекса.
+
+    Индекс старого формата без версии, названный как алиас, удаляется в том же запросе.
+    """
+
+    index = versioned_index_name(alias)
+    old_indexes = alias_indexes(client, alias)
+    actions = [{"remove": {"index": old_index, "alias": alias}} for old_index in old_indexes]
+    if not old_indexes and client.indices.exists(index=alias):
+        actions.append({"remove_index": {"index": alias}})
+    actions.append({"add": {"index": index, "alias": alias}})
+
+    client.indices.update_aliases(actions=actions)
+    logger.info(f"Алиас {alias} переключён на {index}, прежние индексы: {old_indexes or alias}")
+
+
+def delete_previous_indexes(client: Elasticsearch, alias: str) -> None:
+    """Удаляет версии индекса старше текущей, если алиас уже указывает только на текущую."""
+
+    index = versioned_index_name(alias)
+    if alias_indexes(client, alias) != [index]:
+        return
+    previous = [
+        name
+        for name in client.indices.get(index=f"{alias}_v*", expand_wildcards="all")
+        if name.removeprefix(f"{alias}_v").isdigit() and int(name.removeprefix(f"{alias}_v")) < INDEX_VERSIONS[alias]
+    ]
+    if previous:
+        client.indices.delete(index=previous)
+        logger.info(f"Удалены прежние версии индекса {alias}: {previous}")
+
+
 def create_indexes():
     settings = EnvSettings()
     client = Elasticsearch(hosts=settings.es_url)
     while not client.ping():
         logger.error(f"Не удалось подключиться к {settings.es_url}")
         time.sleep(2)
-    for index, body in INDEXES.items():
+    for alias, body in INDEXES.items():
+        index = versioned_index_name(alias)
         if client.indices.exists(index=index):
             logger.info(f"Индекс {index} уже существует")
         else:
             logger.info(f"Создание индекса {index}")
             client.indices.create(index=index, **body)
 
+        # При первом запуске алиас сразу указывает на новый индекс, иначе его переключит ETL,
+        # когда новая версия индекса будет полностью загружена.
+        if not client.indices.exists(index=alias):
+            client.indices.update_aliases(actions=[{"add": {"index": index, "alias": alias}}])
+
 
 if __name__ == "__main__":
     create_indexes()
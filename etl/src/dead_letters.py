@@ -0,0 +1,36 @@
+from datetime import datetime
+from threading import Lock
+
+import orjson
+import pytz
+
+
+class DeadLetterFile:
+    """Документы, которые elastic отказался индексировать, с причинами отказа, в формате JSON Lines.
+
+    Такие документы не блокируют загрузку: checkpoint батча сохраняется, а документ можно
+    исправить и загрузить повторно, изменив его в postgres.
+    """
+
+    # Общая блокировка: в один файл могут писать загрузчики нескольких потоков.
+    lock = Lock()
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+    def write(self, items: list[dict], sources: list[bytes]) -> None:
+        """Записывает результаты bulk-запроса items вместе с документами sources."""
+
+        failed_at = datetime.now(pytz.utc).isoformat()
+        with self.lock, open(self.file_path, "ab") as file:
+            for item, source in zip(items, sources):
+                result = item["index"]
+                record = {
+                    "failed_at": failed_at,
+                    "index": result["_index"],
+                    "id": result["_id"],
+                    "status": result["status"],
+                    "error": result.get("error"),
+                    "document": orjson.loads(source),
+                }
+                file.write(orjson.dumps(record) + b"\n")
@@ -1,19 +1,57 @@
-from time import sleep
+import asyncio
 
-from extract import PGExtractor
-from load import ESLoader
-from state import JsonFileStorage
+from async_etl import run_async_etl
+from extract import PGExtractor, create_keyset_indexes
+from load import ESLoader, ETL_ALIASES
+from metrics import start_metrics
+from models import EnvSettings, EtlRunner, StateBackend
+from notify import get_change_waiter
+from reindex import start_rebuilds
+from state import BufferedJsonFileStorage
+from streams import ConcurrentStreams
 from transform import BatchTransform
+from workers import PartitionWorker
 
 if __name__ == "__main__":
 
-    storage = JsonFileStorage("state/state.json")
-    pg_extractor = PGExtractor(batch_size=500, state=storage)
+    settings = EnvSettings()
+    start_metrics(
+        port=settings.etl_metrics_port,
+        file_path=settings.etl_metrics_file,
+        file_interval=settings.etl_metrics_file_interval,
+    )
+    create_keyset_indexes()
+    if settings.etl_state_backend == StateBackend.postgres:
+        # Общее состояние: потоки делятся между воркерами, первый перелив и перестроение
+        # индексов в этом режиме не выполняются, их запускает отдельный процесс (reindex.py).
+        PartitionWorker(settings).run()
+
+    storage = BufferedJsonFileStorage("state/state.json", flush_interval=settings.etl_state_flush_interval)
+    if settings.etl_runner == EtlRunner.asyncio:
+        asyncio.run(run_async_etl(storage))
+
+    if settings.etl_concurrent_streams:
+        ConcurrentStreams(storage, settings).run()
+
+    pg_extractor = PGExtractor(state=storage)
     batch_transform = BatchTransform(extractor=pg_extractor)
     es_loader = ESLoader(transformer=batch_transform, state=storage)
 
+    start_rebuilds(es_loader.elastic_connection)
+
+    initial_load = es_loader.initial_load_required()
+    if initial_load:
+        es_loader.start_initial_load()
+
+    change_waiter = get_change_waiter(settings)
+    changed_aliases = ETL_ALIASES
+
     while True:
-        es_loader.load_films_batch_to_elastic()
-        es_loader.load_persons_batch_to_elastic()
-        es_loader.load_genres_batch_to_elastic()
-        sleep(60)
+        for alias in changed_aliases:
+            es_loader.load_index(alias)
+
+        if initial_load:
+            es_loader.finish_initial_load()
+            initial_load = False
+
+        changed_aliases = change_waiter.wait_for_changes()
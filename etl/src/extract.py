@@ -1,5 +1,8 @@
 import logging
+from contextlib import contextmanager
 from datetime import datetime
+from itertools import islice
+from typing import Iterator
 
 import backoff
 import psycopg2
@@ -7,8 +10,9 @@ import pytz
 from psycopg2.extensions import cursor
 from psycopg2.extras import NamedTupleCursor, RealDictRow
 
+from batching import AdaptiveBatchSize
 from logger import logger
-from models import EnvSettings
+from models import EnvSettings, PaginationMode
 from state import BaseStorage
 
 settings = EnvSettings()
@@ -21,14 +25,255 @@ POSTGRES_CONNECTION = {
     "port": settings.pg_db_port,
 }
 
+MIN_UUID = "00000000-0000-0000-0000-000000000000"
+MAX_UUID = "ffffffff-ffff-ffff-ffff-ffffffffffff"
+
+# Ключ, с которого начинается выгрузка при первом переливе в режиме keyset: (modified, id).
+MIN_KEYSET_KEY = [datetime.min.replace(tzinfo=pytz.utc).isoformat(), MIN_UUID]
+
+# Индексы, по которым ищут запросы keyset: имя -> (таблица, колонки). В postgres/init.sql они есть,
+# но init.sql выполняется только на пустом томе, поэтому ETL создаёт их и в существующей базе.
+KEYSET_INDEXES = {
+    "film_work_modified_id_idx": ("film_work", "modified, id"),
+    "person_modified_id_idx": ("person", "modified, id"),
+    "genre_modified_id_idx": ("genre", "modified, id"),
+    "person_film_work_created_idx": ("person_film_work", "created"),
+    "genre_film_work_created_idx": ("genre_film_work", "created"),
+}
+# Advisory-блокировка, под которой индексы создаёт только один из одновременно запущенных процессов ETL.
+KEYSET_INDEXES_LOCK_KEY = 8131723
+
+# Вложенные списки фильма. Join персон и жанров даёт их декартово произведение, поэтому
+# дубли убираются DISTINCT, а порядок элементов (по id) не меняется от выгрузки к выгрузке.
+FILMS_NESTED_FIELDS = """ARRAY_AGG(DISTINCT JSONB_BUILD_OBJECT('id', g.id, 'name', g.name))
+            FILTER (WHERE g.id IS NOT NULL) AS genres,
+        ARRAY_AGG(DISTINCT JSONB_BUILD_OBJECT('id', p.id, 'name', p.full_name))
+            FILTER (WHERE pfw.role = 'actor') AS actors,
+        ARRAY_AGG(DISTINCT JSONB_BUILD_OBJECT('id', p.id, 'name', p.full_name))
+            FILTER (WHERE pfw.role = 'director') AS directors,
+        ARRAY_AGG(DISTINCT JSONB_BUILD_OBJECT('id', p.id, 'name', p.full_name))
+            FILTER (WHERE pfw.role = 'writer') AS writers"""
+
+# Изменения, по которым фильм выгружается заново: (film_work_id, modified) из каждой таблицы. Каждая
+# ветка сама продвигается по своему индексу (modified, ...) от ключа checkpoint и читает не больше
+# limit строк, поэтому страница обходится без join и группировки всех изменённых фильмов. Изменения
+# персон и жанров учитываются начиная с related_since - начала первого перелива: фильмы первого
+# перелива и так выгружаются с текущими персонами и жанрами.
+FILM_WORK_SEEK = """
+        (SELECT fw.id AS film_work_id, fw.modified
+        FROM content.film_work as fw
+        WHERE (fw.modified, fw.id) > (%(modified)s::timestamptz, %(id)s::uuid)
+              AND fw.id BETWEEN %(id_from)s::uuid AND %(id_to)s::uuid
+        ORDER BY fw.modified, fw.id
+        LIMIT %(limit)s)"""
+
+PERSON_SEEK = """
+        (SELECT pfw.film_work_id, p.modified
+        FROM content.person as p
+        JOIN content.person_film_work as pfw ON pfw.person_id = p.id
+        WHERE p.modified >= GREATEST(%(modified)s::timestamptz, %(related_since)s::timestamptz)
+              AND (p.modified, pfw.film_work_id) > (%(modified)s::timestamptz, %(id)s::uuid)
+              AND pfw.film_work_id BETWEEN %(id_from)s::uuid AND %(id_to)s::uuid
+        ORDER BY p.modified, pfw.film_work_id
+        LIMIT %(limit)s)"""
+
+GENRE_SEEK = """
+        (SELECT gfw.film_work_id, g.modified
+        FROM content.genre as g
+        JOIN content.genre_film_work as gfw ON gfw.genre_id = g.id
+        WHERE g.modified >= GREATEST(%(modified)s::timestamptz, %(related_since)s::timestamptz)
+              AND (g.modified, gfw.film_work_id) > (%(modified)s::timestamptz, %(id)s::uuid)
+              AND gfw.film_work_id BETWEEN %(id_from)s::uuid AND %(id_to)s::uuid
+        ORDER BY g.modified, gfw.film_work_id
+        LIMIT %(limit)s)"""
+
+# Первые limit изменений всех веток в порядке (modified, film_work_id), сгруппированные по фильмам.
+# Ключ фильма - его последнее изменение в странице, поэтому ключ последнего фильма совпадает с ключом
+# последнего изменения. window_rows - число изменений в странице: фильмов в ней может быть меньше limit.
+CHANGED_FILMS_CTE = """changes AS ({changes}
+    ), window_changes AS (
+        SELECT film_work_id, modified
+        FROM changes
+        ORDER BY modified, film_work_id
+        LIMIT %(limit)s
+    ), changed_films AS (
+        SELECT film_work_id AS id, MAX(modified) AS key_modified, (SUM(COUNT(*)) OVER ())::int AS window_rows
+        FROM window_changes
+        GROUP BY film_work_id
+    )"""
+
+FILMS_SEEK = "\n        UNION ALL".join([FILM_WORK_SEEK, PERSON_SEEK, GENRE_SEEK])
+
+FILMS_KEYSET_QUERY = f"""
+    WITH {CHANGED_FILMS_CTE.format(changes=FILMS_SEEK)}
+    SELECT
+        fw.id as fw_id,
+        fw.title,
+        fw.description,
+        fw.rating,
+        fw.type,
+        fw.created,
+        fw.modified,
+        cf.key_modified,
+        cf.window_rows,
+        {FILMS_NESTED_FIELDS}
+    FROM changed_films as cf
+    JOIN content.film_work as fw ON fw.id = cf.id
+    LEFT JOIN content.person_film_work as pfw ON pfw.film_work_id = fw.id
+    LEFT JOIN content.person as p ON p.id = pfw.person_id
+    LEFT JOIN content.genre_film_work as gfw ON gfw.film_work_id = fw.id
+    LEFT JOIN content.genre as g ON g.id = gfw.genre_id
+    GROUP BY fw.id, cf.key_modified, cf.window_rows
+    ORDER BY cf.key_modified, fw.id;
+"""
+
+# Первая фаза двухфазной выгрузки фильмов: id изменившихся фильмов из тех же веток, что и в
+# FILMS_KEYSET_QUERY, без полного join. Диапазон id партиции (ETL_FILMS_PARTITIONS) задаётся в каждой ветке.
+FILMS_CHANGED_IDS_QUERY_TEMPLATE = f"""
+    WITH {CHANGED_FILMS_CTE}
+    SELECT id, key_modified, window_rows
+    FROM changed_films
+    ORDER BY key_modified, id;
+"""
+
+PERSON_LINK_SEEK = """
+        (SELECT pfw.film_work_id, pfw.created AS modified
+        FROM content.person_film_work as pfw
+        WHERE pfw.created >= GREATEST(%(modified)s::timestamptz, %(related_since)s::timestamptz)
+              AND (pfw.created, pfw.film_work_id) > (%(modified)s::timestamptz, %(id)s::uuid)
+              AND pfw.film_work_id BETWEEN %(id_from)s::uuid AND %(id_to)s::uuid
+        ORDER BY pfw.created, pfw.film_work_id
+        LIMIT %(limit)s)"""
+
+GENRE_LINK_SEEK = """
+        (SELECT gfw.film_work_id, gfw.created AS modified
+        FROM content.genre_film_work as gfw
+        WHERE gfw.created >= GREATEST(%(modified)s::timestamptz, %(related_since)s::timestamptz)
+              AND (gfw.created, gfw.film_work_id) > (%(modified)s::timestamptz, %(id)s::uuid)
+              AND gfw.film_work_id BETWEEN %(id_from)s::uuid AND %(id_to)s::uuid
+        ORDER BY gfw.created, gfw.film_work_id
+        LIMIT %(limit)s)"""
+
+FILMS_CHANGED_IDS_QUERY = FILMS_CHANGED_IDS_QUERY_TEMPLATE.format(changes=FILMS_SEEK)
+
+# Переименования персон и жанров переносятся в документы фильмов частичным обновлением
+# (ESLoader.propagate_renames), поэтому фильм выгружается целиком, только если изменился
+# он сам или к нему добавили персону или жанр.
+FILMS_CHANGED_IDS_WITHOUT_RENAMES_QUERY = FILMS_CHANGED_IDS_QUERY_TEMPLATE.format(
+    changes="\n        UNION ALL".join([FILM_WORK_SEEK, PERSON_LINK_SEEK, GENRE_LINK_SEEK])
+)
+
+# Вторая фаза: агрегация полных данных только по найденным фильмам.
+FILMS_ENRICH_QUERY = f"""
+    SELECT
+        fw.id as fw_id,
+        fw.title,
+        fw.description,
+        fw.rating,
+        fw.type,
+        fw.created,
+        fw.modified,
+        {FILMS_NESTED_FIELDS}
+    FROM content.film_work as fw
+    LEFT JOIN content.person_film_work as pfw ON pfw.film_work_id = fw.id
+    LEFT JOIN content.person as p ON p.id = pfw.person_id
+    LEFT JOIN content.genre_film_work as gfw ON gfw.film_work_id = fw.id
+    LEFT JOIN content.genre as g ON g.id = gfw.genre_id
+    WHERE fw.id = ANY(%(ids)s::uuid[])
+    GROUP BY fw.id;
+"""
+
+PERSONS_KEYSET_QUERY = """
+    SELECT id, full_name, modified
+    FROM content.person
+    WHERE (modified, id) > (%(modified)s::timestamptz, %(id)s::uuid)
+    ORDER BY modified, id
+    LIMIT %(limit)s;
+"""
+
+GENRES_KEYSET_QUERY = """
+    SELECT id, name, description, modified
+    FROM content.genre
+    WHERE (modified, id) > (%(modified)s::timestamptz, %(id)s::uuid)
+    ORDER BY modified, id
+    LIMIT %(limit)s;
+"""
+
+
+@backoff.on_exception(exception=psycopg2.OperationalError, wait_gen=backoff.expo, logger=logger)
+def create_keyset_indexes() -> None:
+    """Создаёт недостающие индексы KEYSET_INDEXES, не блокируя запись в таблицы (CONCURRENTLY).
+
+    Индекс, который не достроился при прошлом запуске (invalid), пересоздаётся.
+    """
+
+    connection = psycopg2.connect(**POSTGRES_CONNECTION)
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции.
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s);", (KEYSET_INDEXES_LOCK_KEY,))
+            cursor.execute(
+                """
+                SELECT c.relname
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = 'content' AND c.relname = ANY(%s) AND NOT i.indisvalid;
+                """,
+                (list(KEYSET_INDEXES),),
+            )
+            for (name,) in cursor.fetchall():
+                logger.warning(f"Индекс content.{name} не достроен, он будет создан заново")
+                cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS content.{name};")
+            for name, (table, columns) in KEYSET_INDEXES.items():
+                cursor.execute("SELECT to_regclass(%s) IS NULL;", (f"content.{name}",))
+                if cursor.fetchone()[0]:
+                    logger.info(f"Создание индекса content.{name}...")
+                    cursor.execute(
+                        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON content.{table} USING btree ({columns});"
+                    )
+    finally:
+        connection.close()
+
 
 class PGExtractor:
     """Получаем данные по фильмам из postgresql"""
 
-    def __init__(self, batch_size: int, state: BaseStorage):
-
-        self.batch_size = batch_size
+    def __init__(
+        self,
+        state: BaseStorage,
+        batch_size: int = settings.etl_batch_size,
+        adaptive_batch_size: bool = settings.etl_adaptive_batch_size,
+        pagination_mode: PaginationMode = settings.etl_pagination_mode,
+        streaming: bool = settings.etl_pg_streaming,
+        itersize: int = settings.etl_pg_itersize,
+        films_two_phase: bool = settings.etl_films_two_phase,
+        films_id_range: tuple[str, str] = (MIN_UUID, MAX_UUID),
+        films_detect_renames: bool = not settings.etl_propagate_renames,
+    ):
+
+        # Размер батча у каждого потока свой и подстраивается под нагрузку, см. AdaptiveBatchSize.
+        self.batch_sizes = {
+            stream: AdaptiveBatchSize(
+                stream,
+                initial=batch_size,
+                min_size=settings.etl_batch_size_min,
+                max_size=settings.etl_batch_size_max,
+                target_bytes=settings.etl_es_bulk_chunk_bytes,
+                target_latency=settings.etl_batch_target_latency,
+                adaptive=adaptive_batch_size,
+            )
+            for stream in ("films", "persons", "genres")
+        }
         self.state = state
+        self.pagination_mode = pagination_mode
+        self.streaming = streaming
+        self.itersize = itersize
+        self.films_two_phase = films_two_phase
+        # Диапазон id фильмов, за который отвечает экземпляр (при разделении потока между воркерами).
+        self.films_id_range = films_id_range
+        self.films_detect_renames = films_detect_renames
         self.cursor = self.pg_connection()
 
     @backoff.on_exception(
@@ -47,26 +292,205 @@ class PGExtractor:
         wait_gen=backoff.expo,
         on_backoff=pg_connection,
     )
-    def execute_query(self, query: str) -> list[RealDictRow]:
+    def execute_query(self, query: str, params: dict | None = None) -> list[RealDictRow]:
         try:
-            self.cursor.execute(query)
+            self.cursor.execute(query, params)
             return self.cursor.fetchall()
         except psycopg2.Error as exc:
             self.cursor = self.pg_connection()
             logger.exception(f"Ошибка извлечения данных из postgres: {exc}")
             raise exc
 
-    def get_modified_films_batch(self) -> tuple[list[RealDictRow], int]:
-        """Получаем фильмы, изменившиеся с момента last_extracting_time, батчами, по self.batch_size штук."""
+    @contextmanager
+    def advisory_lock(self, key: int, shared: bool = False) -> Iterator[None]:
+        """Сессионная advisory-блокировка postgres на время блока, общая для всех процессов ETL."""
 
-        films_offset = self.state.retrieve_state().get("films_offset", 0)
+        suffix = "_shared" if shared else ""
+        lock_cursor = self.cursor
+        try:
+            lock_cursor.execute(f"SELECT pg_advisory_lock{suffix}(%s);", (key,))
+        except psycopg2.Error:
+            self.cursor = self.pg_connection()
+            raise
+        try:
+            yield
+        finally:
+            try:
+                lock_cursor.execute(f"SELECT pg_advisory_unlock{suffix}(%s);", (key,))
+            except psycopg2.Error:
+                # Соединение оборвалось: postgres снял блокировку вместе с сессией.
+                pass
+
+    def stream_query(self, query: str, params: dict, cursor_name: str) -> Iterator[tuple]:
+        """Выполняем запрос на именованном (server-side) курсоре и лениво отдаём строки.
+
+        Строки подгружаются с сервера по self.itersize штук, весь запрос выполняется
+        в одной транзакции REPEATABLE READ, т.е. на одном снимке данных.
+        """
+
+        connection = self.cursor.connection
+        connection.rollback()
+        self.cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+
+        stream_cursor = connection.cursor(name=cursor_name, cursor_factory=NamedTupleCursor)
+        stream_cursor.itersize = self.itersize
+        try:
+            stream_cursor.execute(query, params)
+            yield from stream_cursor
+        finally:
+            if not connection.closed:
+                stream_cursor.close()
+                connection.commit()
+
+    def checkpoint_name(self, stream: str) -> str:
+        """Ключ в хранилище состояния, под которым сохраняется позиция выгрузки потока stream."""
+
+        if self.pagination_mode == PaginationMode.keyset:
+            return f"{stream}_last_key"
+        return f"{stream}_offset"
+
+    def get_keyset_batches(
+        self,
+        query: str,
+        stream: str,
+        key_fields: tuple[str, str] = ("modified", "id"),
+        params: dict | None = None,
+        window_field: str | None = None,
+    ):
+        """Получаем записи батчами размера self.batch_sizes[stream] в порядке (modified, id).
+
+        Вместо OFFSET каждый следующий запрос начинается с последнего прочитанного ключа,
+        который отдаётся вместе с батчем и сохраняется в состоянии как checkpoint.
+        window_field - поле с числом строк, прочитанных запросом, если после группировки их в батче меньше.
+        """
+
+        if self.streaming:
+            yield from self.get_keyset_stream_batches(query, stream, key_fields, params)
+            return
+
+        last_key = self.state.retrieve_state().get(self.checkpoint_name(stream), MIN_KEYSET_KEY)
 
         while True:
-            # При первом переливе выставляем минимальную дату, для получения всех записей.
-            films_last_extracting_time = self.state.retrieve_state().get(
-                "films_last_extracting_time", datetime.min.replace(tzinfo=pytz.utc).isoformat()
+            limit = self.batch_sizes[stream].value
+            batch = self.execute_query(
+                query, {"modified": last_key[0], "id": last_key[1], "limit": limit, **(params or {})}
             )
 
+            if not batch:
+                logger.info(f"Данные потока {stream} не изменялись с {last_key[0]}")
+                break
+
+            modified_field, id_field = key_fields
+            last_key = [getattr(batch[-1], modified_field).isoformat(), str(getattr(batch[-1], id_field))]
+
+            yield batch, {self.checkpoint_name(stream): last_key}
+
+            if (getattr(batch[-1], window_field) if window_field else len(batch)) < limit:
+                break
+
+    def get_keyset_stream_batches(
+        self, query: str, stream: str, key_fields: tuple[str, str], params: dict | None = None
+    ):
+        """Получаем записи одним запросом без LIMIT, нарезая поток строк на батчи размера self.batch_sizes[stream].
+
+        При обрыве соединения поток переоткрывается с последнего отданного ключа.
+        """
+
+        last_key = self.state.retrieve_state().get(self.checkpoint_name(stream), MIN_KEYSET_KEY)
+        modified_field, id_field = key_fields
+        rows_count = 0
+
+        while True:
+            try:
+                rows = self.stream_query(
+                    query,
+                    {"modified": last_key[0], "id": last_key[1], "limit": None, **(params or {})},
+                    cursor_name=f"etl_{stream}_stream",
+                )
+                while batch := list(islice(rows, self.batch_sizes[stream].value)):
+                    rows_count += len(batch)
+                    last_key = [getattr(batch[-1], modified_field).isoformat(), str(getattr(batch[-1], id_field))]
+                    yield batch, {self.checkpoint_name(stream): last_key}
+                break
+            except psycopg2.OperationalError as exc:
+                logger.exception(f"Обрыв потоковой выгрузки {stream} из postgres: {exc}")
+                self.cursor = self.pg_connection()
+
+        if not rows_count:
+            logger.info(f"Данные потока {stream} не изменялись с {last_key[0]}")
+
+    def films_related_since(self) -> str:
+        """С какого момента изменения персон и жанров выгружают фильмы заново.
+
+        Перед первым переливом это текущее время postgres: все фильмы и так выгружаются с текущими
+        персонами и жанрами, иначе каждый фильм выгрузился бы ещё по разу на каждую свою персону.
+        """
+
+        state = self.state.retrieve_state()
+        if state.get("films_related_since"):
+            return state["films_related_since"]
+        if self.checkpoint_name("films") in state:
+            return MIN_KEYSET_KEY[0]
+        # Сохраняется сразу: по нему перенос переименований в фильмы решает, какие из них уже учтены.
+        related_since = self.execute_query("SELECT now() AS now;")[0].now.isoformat()
+        self.state.save_state({"films_related_since": related_since})
+        self.state.flush()
+        return related_since
+
+    def get_changed_films_batches(self) -> tuple[list[RealDictRow], dict]:
+        """Двухфазная выгрузка фильмов: сначала батч id изменившихся фильмов, затем их полные данные."""
+
+        changed_ids_query = FILMS_CHANGED_IDS_QUERY
+        if not self.films_detect_renames:
+            changed_ids_query = FILMS_CHANGED_IDS_WITHOUT_RENAMES_QUERY
+
+        related_since = self.films_related_since()
+        for changed_films_batch, checkpoint in self.get_keyset_batches(
+            changed_ids_query,
+            stream="films",
+            key_fields=("key_modified", "id"),
+            params={"id_from": self.films_id_range[0], "id_to": self.films_id_range[1], "related_since": related_since},
+            window_field="window_rows",
+        ):
+            films_ids = [changed_film.id for changed_film in changed_films_batch]
+            films_batch = self.execute_query(FILMS_ENRICH_QUERY, {"ids": films_ids})
+            yield films_batch, checkpoint | {"films_related_since": related_since}
+
+    def get_modified_films_batch(self) -> tuple[list[RealDictRow], dict]:
+        """Получаем фильмы, изменившиеся с момента last_extracting_time, батчами размера self.batch_sizes["films"].
+
+        Вместе с каждым батчем отдаётся checkpoint - изменения состояния, которые нужно сохранить
+        после того, как батч загружен в elastic.
+        """
+
+        if self.pagination_mode == PaginationMode.keyset and self.films_two_phase:
+            yield from self.get_changed_films_batches()
+            return
+
+        if self.pagination_mode == PaginationMode.keyset:
+            related_since = self.films_related_since()
+            for films_batch, checkpoint in self.get_keyset_batches(
+                FILMS_KEYSET_QUERY,
+                stream="films",
+                key_fields=("key_modified", "fw_id"),
+                params={
+                    "id_from": self.films_id_range[0],
+                    "id_to": self.films_id_range[1],
+                    "related_since": related_since,
+                },
+                window_field="window_rows",
+            ):
+                yield films_batch, checkpoint | {"films_related_since": related_since}
+            return
+
+        films_offset = self.state.retrieve_state().get("films_offset", 0)
+        # При первом переливе выставляем минимальную дату, для получения всех записей.
+        films_last_extracting_time = self.state.retrieve_state().get(
+            "films_last_extracting_time", datetime.min.replace(tzinfo=pytz.utc).isoformat()
+        )
+
+        while True:
+            limit = self.batch_sizes["films"].value
             query = f"""
                 SELECT
                     fw.id as fw_id, 
@@ -76,25 +500,7 @@ class PGExtractor:
                     fw.type, 
                     fw.created, 
                     fw.modified, 
-                    ARRAY_AGG(JSON_BUILD_OBJECT(
-                        'id', g.id, 
-                        'name', g.name
-                        )) as genres,
-                    ARRAY_AGG(JSON_BUILD_OBJECT(
-                        'id', p.id, 
-                        'name', p.full_name
-                        ))
-                        FILTER (WHERE pfw.role = 'actor') AS actors,
-                    ARRAY_AGG(JSON_BUILD_OBJECT(
-                        'id', p.id, 
-                        'name', p.full_name
-                        ))
-                        FILTER (WHERE pfw.role = 'director') AS directors,
-                    ARRAY_AGG(JSON_BUILD_OBJECT(
-                        'id', p.id, 
-                        'name', p.full_name
-                        ))
-                        FILTER (WHERE pfw.role = 'writer') AS writers
+                    {FILMS_NESTED_FIELDS}
                 FROM content.film_work as fw
                 LEFT JOIN content.person_film_work as pfw ON pfw.film_work_id = fw.id
                 LEFT JOIN content.person as p ON p.id = pfw.person_id
@@ -106,7 +512,7 @@ class PGExtractor:
                 GROUP BY fw.id
                 ORDER BY fw_id
                 OFFSET {films_offset}
-                LIMIT {self.batch_size};
+                LIMIT {limit};
             """
 
             modified_films_batch = self.execute_query(query)
@@ -114,41 +520,43 @@ class PGExtractor:
             if not modified_films_batch:
                 films_last_extracting_time = datetime.utcnow().replace(tzinfo=pytz.utc).isoformat()
                 logger.info(f"Фильмы не изменялись. Дата проверки {films_last_extracting_time}")
-                self.state.save_state(
-                    {
-                        "films_last_extracting_time": films_last_extracting_time,
-                        "films_offset": 0,
-                    }
-                )
+                yield [], {
+                    "films_last_extracting_time": films_last_extracting_time,
+                    "films_offset": 0,
+                }
                 break
 
             modified_films_batch_len = len(modified_films_batch)
             films_offset += modified_films_batch_len
 
-            yield modified_films_batch, films_offset
+            yield modified_films_batch, {"films_offset": films_offset}
 
-            if modified_films_batch_len < self.batch_size:
+            if modified_films_batch_len < limit:
                 break
 
     def get_persons_batch(self):
         """Получаем актеров, данные по которым изменились с момента persons_last_extracting_time,
-        батчами, по self.batch_size штук.
+        батчами размера self.batch_sizes["persons"].
         """
 
+        if self.pagination_mode == PaginationMode.keyset:
+            yield from self.get_keyset_batches(PERSONS_KEYSET_QUERY, stream="persons")
+            return
+
         persons_offset = self.state.retrieve_state().get("persons_offset", 0)
+        # При первом переливе выставляем минимальную дату, для получения всех записей.
+        persons_last_extracting_time = self.state.retrieve_state().get(
+            "persons_last_extracting_time", datetime.min.replace(tzinfo=pytz.utc).isoformat()
+        )
 
         while True:
-            # При первом переливе выставляем минимальную дату, для получения всех записей.
-            persons_last_extracting_time = self.state.retrieve_state().get(
-                "persons_last_extracting_time", datetime.min.replace(tzinfo=pytz.utc).isoformat()
-            )
-
+            limit = self.batch_sizes["persons"].value
             query = f"""
                 SELECT id, full_name
                 FROM content.person
                 WHERE modified > '{persons_last_extracting_time}'
                 OFFSET {persons_offset}
-                LIMIT {self.batch_size};
+                LIMIT {limit};
             """
 
             modified_persons_batch = self.execute_query(query)
@@ -156,41 +564,43 @@ class PGExtractor:
             if not modified_persons_batch:
                 persons_last_extracting_time = datetime.utcnow().replace(tzinfo=pytz.utc).isoformat()
                 logger.info(f"Данные по актерам не изменялись. Дата проверки {persons_last_extracting_time}")
-                self.state.save_state(
-                    {
-                        "persons_last_extracting_time": persons_last_extracting_time,
-                        "persons_offset": 0,
-                    }
-                )
+                yield [], {
+                    "persons_last_extracting_time": persons_last_extracting_time,
+                    "persons_offset": 0,
+                }
                 break
 
             modified_persons_batch_len = len(modified_persons_batch)
             persons_offset += modified_persons_batch_len
 
-            yield modified_persons_batch, persons_offset
+            yield modified_persons_batch, {"persons_offset": persons_offset}
 
-            if modified_persons_batch_len < self.batch_size:
+            if modified_persons_batch_len < limit:
                 break
 
     def get_genres_batch(self):
         """Получаем жанры, данные по которым изменились с момента genres_last_extracting_time,
-        батчами, по self.batch_size штук.
+        батчами размера self.batch_sizes["genres"].
         """
 
+        if self.pagination_mode == PaginationMode.keyset:
+            yield from self.get_keyset_batches(GENRES_KEYSET_QUERY, stream="genres")
+            return
+
         genres_offset = self.state.retrieve_state().get("genres_offset", 0)
+        # При первом переливе выставляем минимальную дату, для получения всех записей.
+        genres_last_extracting_time = self.state.retrieve_state().get(
+            "genres_last_extracting_time", datetime.min.replace(tzinfo=pytz.utc).isoformat()
+        )
 
         while True:
-            # При первом переливе выставляем минимальную дату, для получения всех записей.
-            genres_last_extracting_time = self.state.retrieve_state().get(
-                "genres_last_extracting_time", datetime.min.replace(tzinfo=pytz.utc).isoformat()
-            )
-
+            limit = self.batch_sizes["genres"].value
             query = f"""
                 SELECT id, name, description
                 FROM content.genre
                 WHERE modified > '{genres_last_extracting_time}'
                 OFFSET {genres_offset}
-                LIMIT {self.batch_size};
+                LIMIT {limit};
             """
 
             modified_genres_batch = self.execute_query(query)
@@ -198,18 +608,16 @@ class PGExtractor:
             if not modified_genres_batch:
                 genres_last_extracting_time = datetime.utcnow().replace(tzinfo=pytz.utc).isoformat()
                 logger.info(f"Данные по жанрам не изменялись. Дата проверки {genres_last_extracting_time}")
-                self.state.save_state(
-                    {
-                        "genres_last_extracting_time": genres_last_extracting_time,
-                        "genres_offset": 0,
-                    }
-                )
+                yield [], {
+                    "genres_last_extracting_time": genres_last_extracting_time,
+                    "genres_offset": 0,
+                }
                 break
 
             modified_genres_batch_len = len(modified_genres_batch)
             genres_offset += modified_genres_batch_len
 
-            yield modified_genres_batch, genres_offset
+            yield modified_genres_batch, {"genres_offset": genres_offset}
 
-            if modified_genres_batch_len < self.batch_size:
+            if modified_genres_batch_len < limit:
                 break
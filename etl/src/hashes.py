@@ -0,0 +1,50 @@
+import sqlite3
+from hashlib import blake2b
+from threading import Lock
+
+
+class DocumentHashes:
+    """Компактный индекс id документа -> хеш его содержимого, загруженного в elastic.
+
+    Хранится в sqlite рядом с состоянием ETL: по 8 байт хеша на документ каждого индекса.
+    Документ, хеш которого совпадает с сохранённым, в elastic повторно не отправляется.
+    """
+
+    def __init__(self, file_path: str):
+        self.connection = sqlite3.connect(file_path, timeout=30, check_same_thread=False)
+        self.lock = Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS document_hashes (
+                    index_name TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    hash BLOB NOT NULL,
+                    PRIMARY KEY (index_name, id)
+                ) WITHOUT ROWID;
+                """
+            )
+
+    @staticmethod
+    def hash(source: bytes) -> bytes:
+        return blake2b(source, digest_size=8).digest()
+
+    def is_unchanged(self, index: str, doc_id: str, doc_hash: bytes) -> bool:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT hash FROM document_hashes WHERE index_name = ? AND id = ?;", (index, doc_id)
+            ).fetchone()
+        return row is not None and row[0] == doc_hash
+
+    def save(self, index: str, hashes: dict[str, bytes]) -> None:
+        """Сохраняет хеши документов, запись которых подтвердил elastic."""
+
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO document_hashes (index_name, id, hash) VALUES (?, ?, ?);",
+                [(index, doc_id, doc_hash) for doc_id, doc_hash in hashes.items()],
+            )
+
+    def clear(self, index: str) -> None:
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM document_hashes WHERE index_name = ?;", (index,))
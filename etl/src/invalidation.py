@@ -0,0 +1,47 @@
+"""Публикация изменений для сброса кеша API.
+
+После того как elastic подтвердил запись документов, ESLoader публикует их id в Redis stream
+вместе с новым поколением индекса (INCR cache_generation::<алиас>). API удаляет закешированные
+объекты с этими id, а ключи списков и поиска строит с поколением индекса, поэтому после
+публикации они перестают использоваться. ids = None означает, что изменились неизвестные
+документы индекса (например, при переименовании через update_by_query).
+"""
+import orjson
+import redis
+from redis.exceptions import RedisError
+
+from logger import logger
+from models import EnvSettings
+
+GENERATION_KEY_PREFIX = "cache_generation::"
+
+
+class ChangePublisher:
+    def __init__(self, redis_url: str, stream: str, max_len: int):
+        self.redis = redis.Redis.from_url(redis_url)
+        self.stream = stream
+        self.max_len = max_len
+
+    @classmethod
+    def from_settings(cls, settings: EnvSettings) -> "ChangePublisher | None":
+        """Публикатор из настроек ETL или None, если публикация отключена (ETL_PUBLISH_CHANGES=False)."""
+
+        if not settings.etl_publish_changes:
+            return None
+        return cls(
+            settings.redis_url, settings.cache_invalidation_stream, settings.etl_cache_invalidation_stream_max_len
+        )
+
+    def publish(self, alias: str, ids: list[str] | None) -> None:
+        """Ошибки Redis не останавливают загрузку: устаревшие объекты API истекут по TTL."""
+
+        try:
+            generation = self.redis.incr(f"{GENERATION_KEY_PREFIX}{alias}")
+            self.redis.xadd(
+                self.stream,
+                {"index": alias, "generation": generation, "ids": orjson.dumps(ids)},
+                maxlen=self.max_len,
+                approximate=True,
+            )
+        except RedisError as exc:
+            logger.error(f"Не удалось опубликовать изменения индекса {alias} для сброса кеша API: {exc}")
@@ -1,92 +1,512 @@
 import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Iterable, Iterator
 
 import backoff
-from elasticsearch import Elasticsearch
+import orjson
+from elasticsearch import ApiError, Elasticsearch
 from elasticsearch.exceptions import ConnectionError, ConnectionTimeout, TransportError
-from elasticsearch.helpers import bulk
 
+from batching import AdaptiveBatchSize
+from create_indexes import INDEXES
+from dead_letters import DeadLetterFile
+from hashes import DocumentHashes
+from invalidation import ChangePublisher
 from logger import logger
-from models import EnvSettings, ElasticPersonsSchemaModel, ElasticMoviesSchemaModel
+from metrics import checkpoint_time, hooks
+from ratelimit import BulkRateLimiter
+from models import EnvSettings
 from state import BaseStorage
-from transform import BatchTransform
+from transform import BatchTransform, SerializedBatch
 
 settings = EnvSettings()
 
+# Алиасы индексов в порядке их обновления за один проход ETL.
+ETL_ALIASES = ("movies", "persons", "genres")
+
+# Переименование персон или жанров во вложенных полях документа фильма.
+# params.names: {id: новое имя}, params.fields: вложенные поля, в которых искать id,
+# params.names_fields: {поле со списком имён: вложенное поле, из которого оно строится}.
+RENAME_SCRIPT = """
+    boolean changed = false;
+    for (String field : params.fields) {
+        def nested = ctx._source[field];
+        if (nested != null) {
+            for (def item : nested) {
+                def name = params.names[item.id];
+                if (name != null && name != item.name) {
+                    item.name = name;
+                    changed = true;
+                }
+            }
+        }
+    }
+    if (changed) {
+        for (String names_field : params.names_fields.keySet()) {
+            def nested = ctx._source[params.names_fields[names_field]];
+            if (nested != null) {
+                List names = new ArrayList();
+                for (def item : nested) {
+                    names.add(item.name);
+                }
+                ctx._source[names_field] = names;
+            }
+        }
+    } else {
+        ctx.op = 'noop';
+    }
+"""
+
+# Advisory-блокировка postgres: проход загрузки фильмов держит её в общем режиме, перенос
+# переименований в фильмы - в монопольном.
+RENAMES_LOCK_KEY = 8131722
+# Сколько раз update_by_query переименования повторяется, если фильмы менялись одновременно с ним.
+RENAME_MAX_ATTEMPTS = 5
+
+# Статусы, с которыми elastic отклоняет документы из-за перегрузки: их отправка повторяется.
+RETRYABLE_STATUSES = {429, 503}
+MAX_RETRY_DELAY = 60
+
+es_backoff = backoff.on_exception(
+    exception=(ConnectionError, ConnectionTimeout, TransportError),
+    wait_gen=backoff.expo,
+    logger=logger,
+    backoff_log_level=logging.ERROR,
+)
+
+
+class RenamePropagationError(Exception):
+    """Переименование не удалось перенести во все документы фильмов."""
+
 
 class ESLoader:
     """Класс, содержащий метод загрузки в elastic."""
 
-    def __init__(self, transformer: BatchTransform, state: BaseStorage):
+    def __init__(
+        self,
+        transformer: BatchTransform,
+        state: BaseStorage,
+        thread_count: int = settings.etl_es_bulk_threads,
+        chunk_bytes: int = settings.etl_es_bulk_chunk_bytes,
+        max_inflight_bytes: int = settings.etl_es_bulk_max_inflight_bytes,
+        indexes: dict[str, str] | None = None,
+        propagate_renames: bool = settings.etl_propagate_renames,
+        skip_unchanged: bool = settings.etl_skip_unchanged,
+        rate_limiter: BulkRateLimiter | None = None,
+        publish_changes: bool = settings.etl_publish_changes,
+    ):
         self.transformer = transformer
         self.state = state
+        # Куда писать документы каждого алиаса: сам алиас или строящаяся новая версия индекса.
+        self.indexes = {alias: alias for alias in INDEXES} | (indexes or {})
+        self.aliases = {index: alias for alias, index in self.indexes.items()}
+        self.propagate_renames = propagate_renames
+        self.thread_count = thread_count
+        # В работе и в очереди находится не больше 2 * thread_count чанков, т.е. не больше max_inflight_bytes.
+        self.chunk_bytes = min(chunk_bytes, max_inflight_bytes // (2 * thread_count))
+        self.document_hashes = DocumentHashes(settings.etl_hashes_path) if skip_unchanged else None
+        self.dead_letters = DeadLetterFile(settings.etl_dead_letter_path)
+        # Ограничение нагрузки на elastic, общее с загрузчиками других потоков.
+        self.rate_limiter = rate_limiter or BulkRateLimiter(max_concurrent=thread_count)
+        # Изменения публикуются по алиасу: API не знает, в какую версию индекса шла запись.
+        self.change_publisher = ChangePublisher.from_settings(settings) if publish_changes else None
         self.elastic_connection = self.connect_to_es()
 
-    @backoff.on_exception(
-        exception=(ConnectionError, ConnectionTimeout, TransportError),
-        wait_gen=backoff.expo,
-        logger=logger,
-        backoff_log_level=logging.ERROR,
-    )
+    @es_backoff
     def connect_to_es(self) -> Elasticsearch:
         logger.info("Соединение с Elasticsearch...")
-        return Elasticsearch(hosts=settings.es_url, retry_on_timeout=False, max_retries=1)
-
-    @backoff.on_exception(
-        exception=(ConnectionError, ConnectionTimeout, TransportError),
-        wait_gen=backoff.expo,
-        on_backoff=connect_to_es,
-        logger=logger,
-        backoff_log_level=logging.ERROR,
-    )
+        return Elasticsearch(
+            hosts=settings.es_url, retry_on_timeout=False, max_retries=1, http_compress=settings.etl_es_http_compress
+        )
+
+    def initial_load_required(self) -> bool:
+        """Первый перелив: фильмы ещё ни разу не выгружались, либо прошлый первый перелив не завершился."""
+
+        state = self.state.retrieve_state()
+        if state.get("initial_load_index_settings"):
+            return True
+        return "films_last_extracting_time" not in state and "films_last_key" not in state
+
+    def start_initial_load(self, indexes: list[str] | None = None) -> None:
+        """Отключает refresh и реплики индексов на время первого перелива.
+
+        Исходные настройки сохраняются в состоянии, чтобы восстановить их и после перезапуска ETL.
+        """
+
+        index_settings = self.state.retrieve_state().get("initial_load_index_settings")
+        if not index_settings:
+            current_settings = self.elastic_connection.indices.get_settings(
+                index=indexes or list(self.indexes.values())
+            )
+            index_settings = {
+                index: {
+                    "refresh_interval": body["settings"]["index"].get("refresh_interval", "1s"),
+                    "number_of_replicas": body["settings"]["index"]["number_of_replicas"],
+                }
+                for index, body in current_settings.items()
+            }
+            self.state.save_state({"initial_load_index_settings": index_settings})
+            self.state.flush()
+            if self.document_hashes:
+                # Индексы заполняются заново: сохранённые хеши к ним больше не относятся.
+                for index in indexes or self.indexes.values():
+                    self.document_hashes.clear(index)
+
+        logger.info("Первый перелив: refresh и реплики индексов отключены")
+        self.elastic_connection.indices.put_settings(
+            index=list(index_settings),
+            settings={"index": {"refresh_interval": "-1", "number_of_replicas": 0}},
+        )
+
+    def finish_initial_load(self) -> None:
+        """Восстанавливает настройки индексов после первого перелива и сливает сегменты."""
+
+        index_settings = self.state.retrieve_state().get("initial_load_index_settings", {})
+        for index, settings_to_restore in index_settings.items():
+            self.elastic_connection.indices.put_settings(index=index, settings={"index": settings_to_restore})
+
+        logger.info("Первый перелив завершён, выполняется force merge индексов")
+        self.elastic_connection.options(request_timeout=3600).indices.forcemerge(
+            index=list(index_settings), max_num_segments=1
+        )
+        self.elastic_connection.indices.refresh(index=list(index_settings))
+        self.state.save_state({"initial_load_index_settings": None})
+        self.state.flush()
+        # Во время перелива изменения не публиковались: теперь документы видны поиску, кеш API сбрасывается целиком.
+        if self.change_publisher:
+            for index in index_settings:
+                self.change_publisher.publish(self.aliases.get(index, index), None)
+
+    def publish_searchable(self, index: str, ids: list[str]) -> None:
+        """Публикует изменения документов индекса, когда они уже видны поиску.
+
+        Иначе API успел бы закешировать прежние документы под новым поколением индекса. Во время
+        первого перелива refresh отключён, и изменения публикуются один раз в finish_initial_load.
+        """
+
+        if self.state.retrieve_state().get("initial_load_index_settings"):
+            return
+        self.elastic_connection.indices.refresh(index=index)
+        self.change_publisher.publish(self.aliases.get(index, index), ids)
+
+    def bulk_chunks(self, operations: Iterable[bytes]) -> Iterator[list[bytes]]:
+        """Делит поток строк bulk-запроса (действие и документ на элемент) на чанки не больше chunk_bytes."""
+
+        chunk, chunk_size = [], 0
+        for operation in operations:
+            if chunk and chunk_size + len(operation) > self.chunk_bytes:
+                yield chunk
+                chunk, chunk_size = [], 0
+            chunk.append(operation)
+            chunk_size += len(operation)
+        if chunk:
+            yield chunk
+
+    def send_bulk(self, chunk: list[bytes], batch_size: AdaptiveBatchSize | None = None) -> list[dict]:
+        """Отправляет чанк bulk-запросом и возвращает результаты по каждому документу в порядке чанка.
+
+        Документы, отклонённые из-за перегрузки elastic (429, 503), отправляются повторно с нарастающей
+        паузой. Остальные отклонённые документы записываются в dead letter файл и больше не повторяются.
+        Размер чанка, время ответа и число отклонений передаются в batch_size потока.
+        """
+
+        stream = batch_size.stream if batch_size else ""
+        items = [None] * len(chunk)
+        positions = range(len(chunk))
+        chunk_bytes = sum(len(operation) for operation in chunk)
+        rejected = 0
+        attempt = 0
+        while True:
+            payload = b"".join(chunk[position] for position in positions)
+            try:
+                with self.rate_limiter.request(len(payload)):
+                    started = time.perf_counter()
+                    response = self.elastic_connection.bulk(operations=payload)
+            except ApiError as exc:
+                if exc.status_code not in RETRYABLE_STATUSES:
+                    raise
+                latency = time.perf_counter() - started
+                retry = positions
+            else:
+                latency = time.perf_counter() - started
+                logger.info(
+                    f"Bulk-запрос: {len(positions)} документов, {len(payload)} байт, "
+                    f"{latency:.3f} с (в elastic {response['took']} мс)"
+                )
+                retry = []
+                for position, item in zip(positions, response["items"]):
+                    if item["index"]["status"] in RETRYABLE_STATUSES:
+                        retry.append(position)
+                    else:
+                        items[position] = item
+            if not retry:
+                break
+
+            rejected += len(retry)
+            hooks.retry(stream, len(retry))
+            delay = min(2**attempt, MAX_RETRY_DELAY)
+            attempt += 1
+            logger.warning(f"Elastic перегружен, повторная отправка {len(retry)} документов через {delay} с")
+            time.sleep(delay)
+            positions = retry
+
+        if batch_size:
+            batch_size.observe_load(len(chunk), chunk_bytes, latency, rejected)
+        hooks.load(stream, len(chunk), chunk_bytes, latency)
+
+        failed = [position for position, item in enumerate(items) if not 200 <= item["index"]["status"] < 300]
+        if failed:
+            logger.error(f"Elastic отклонил {len(failed)} документов, они записаны в {self.dead_letters.file_path}")
+            hooks.dead_letter(stream, len(failed))
+            self.dead_letters.write(
+                [items[position] for position in failed],
+                [chunk[position].split(b"\n", 1)[1] for position in failed],
+            )
+        return items
+
+    def bulk_results(self, operations: Iterable[bytes], batch_size: AdaptiveBatchSize | None = None) -> Iterator[dict]:
+        """Отправляет operations в elastic и отдаёт результаты по каждому документу в порядке operations.
+
+        При thread_count > 1 чанки отправляются параллельно, в работе находится не больше 2 * thread_count чанков.
+        """
+
+        chunks = self.bulk_chunks(operations)
+        if self.thread_count == 1:
+            for chunk in chunks:
+                yield from self.send_bulk(chunk, batch_size)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.thread_count, thread_name_prefix="bulk") as executor:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(executor.submit(self.send_bulk, chunk, batch_size))
+                if len(pending) >= 2 * self.thread_count:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
     def bulk_to_elastic(
         self,
         index: str,
-        elastic_schema_models_batch: ElasticPersonsSchemaModel | ElasticMoviesSchemaModel,
-        offset_name: str,
-        offset: int,
+        documents_batches: Iterable[tuple[SerializedBatch, dict]],
+        batch_size: AdaptiveBatchSize | None = None,
     ):
-        actions = [
-            {
-                "_index": index,
-                "_id": film.id,
-                "_source": film.json(),
-            }
-            for film in elastic_schema_models_batch
-        ]
+        """Загружает поток батчей в elastic, сохраняя checkpoint батча только после того,
+        как elastic подтвердил запись всех документов этого и предыдущих батчей.
+
+        Выгрузка и преобразование следующих батчей идут параллельно с индексацией предыдущих.
+        """
+
+        stream = batch_size.stream if batch_size else index
+        # (количество документов до конца батча включительно, checkpoint батча)
+        pending_checkpoints = deque()
+        # Хеши отправленных, но ещё не подтверждённых elastic документов, в порядке отправки.
+        pending_hashes = deque()
+        skipped = 0
+        total = 0
+
+        def operations() -> Iterator[bytes]:
+            nonlocal skipped, total
+            sent = 0
+            for documents_batch, checkpoint in documents_batches:
+                for doc_id, source in documents_batch:
+                    total += 1
+                    if self.document_hashes:
+                        doc_hash = self.document_hashes.hash(source)
+                        if self.document_hashes.is_unchanged(index, doc_id, doc_hash):
+                            skipped += 1
+                            continue
+                        pending_hashes.append(doc_hash)
+                    sent += 1
+                    action = orjson.dumps({"index": {"_index": index, "_id": doc_id}})
+                    yield b"".join((action, b"\n", source, b"\n"))
+                pending_checkpoints.append((sent, checkpoint))
+
+        acknowledged = 0
+        saved = 0
+        acknowledged_hashes = {}
+        # id документов, записанных elastic с прошлого сохранения checkpoint, для сброса кеша API.
+        changed_ids = []
+
+        def save_acknowledged_checkpoints():
+            nonlocal saved
+            if not (pending_checkpoints and pending_checkpoints[0][0] <= acknowledged):
+                return
+            if acknowledged_hashes:
+                self.document_hashes.save(index, acknowledged_hashes)
+                acknowledged_hashes.clear()
+            # Публикация до сохранения checkpoint: если ETL упадёт между ними, изменения опубликуются повторно.
+            if changed_ids:
+                self.publish_searchable(index, changed_ids.copy())
+                changed_ids.clear()
+            while pending_checkpoints and pending_checkpoints[0][0] <= acknowledged:
+                batch_end, checkpoint = pending_checkpoints.popleft()
+                self.state.save_state(checkpoint)
+                hooks.checkpoint(stream, checkpoint)
+                if batch_end > saved:
+                    logger.info(f"Записан batch длиной: {batch_end - saved}")
+                saved = batch_end
+
+        for item in self.bulk_results(operations(), batch_size):
+            acknowledged += 1
+            result = item["index"]
+            doc_hash = pending_hashes.popleft() if self.document_hashes else None
+            # Хеш документа из dead letter не сохраняется: исправленный документ должен загрузиться.
+            if doc_hash and 200 <= result["status"] < 300:
+                acknowledged_hashes[result["_id"]] = doc_hash
+            if self.change_publisher and 200 <= result["status"] < 300:
+                changed_ids.append(result["_id"])
+            save_acknowledged_checkpoints()
+        save_acknowledged_checkpoints()
+        self.state.flush()
+        hooks.pass_finished(stream)
+
+        if total:
+            logger.info(
+                f"Индекс {index}: пропущено неизменённых документов {skipped} из {total} ({skipped / total:.1%})"
+            )
+
+    def rename_in_films(self, names: dict[str, str], fields: list[str], names_fields: dict[str, str]) -> None:
+        """Частично обновляет имена во вложенных полях fields документов фильмов, где встречаются id из names.
 
-        self.state.save_state({offset_name: offset})
-        logger.info(f"Записан batch длиной: {len(actions)}")
-        bulk(self.elastic_connection, actions)
+        Фильмы, изменённые одновременно с update_by_query, пропускаются им из-за конфликта версий,
+        поэтому запрос повторяется, пока конфликты не исчезнут. Ошибки документов не пропускаются.
+        """
 
+        movies_index = self.indexes["movies"]
+        updated = 0
+        for attempt in range(1, RENAME_MAX_ATTEMPTS + 1):
+            # update_by_query видит только документы, уже попавшие в поиск.
+            self.elastic_connection.indices.refresh(index=movies_index)
+            response = self.elastic_connection.options(request_timeout=600).update_by_query(
+                index=movies_index,
+                query={
+                    "bool": {
+                        "should": [
+                            {"nested": {"path": field, "query": {"terms": {f"{field}.id": list(names)}}}}
+                            for field in fields
+                        ]
+                    }
+                },
+                script={
+                    "source": RENAME_SCRIPT,
+                    "lang": "painless",
+                    "params": {"names": names, "fields": fields, "names_fields": names_fields},
+                },
+                conflicts="proceed",
+                # Сброс кеша API публикуется, когда новые имена уже видны поиску.
+                refresh=True,
+            )
+            if response["failures"]:
+                raise RenamePropagationError(f"Ошибки обновления имён в фильмах: {response['failures'][:3]}")
+            updated += response["updated"]
+            if not response["version_conflicts"]:
+                break
+            logger.warning(
+                f"Конфликт версий в {response['version_conflicts']} фильмах при обновлении имён, попытка {attempt}"
+            )
+        else:
+            raise RenamePropagationError(f"Имена не обновлены в фильмах за {RENAME_MAX_ATTEMPTS} попыток")
+
+        if updated:
+            logger.info(f"Обновлены имена в {updated} фильмах")
+            # Какие фильмы обновил update_by_query, неизвестно: API сбрасывает кеш всего индекса.
+            if self.change_publisher:
+                self.change_publisher.publish("movies", None)
+
+    def renames_loaded_with_films(self, checkpoint: dict) -> bool:
+        """Все записи батча изменились до начала первого перелива фильмов, который ещё идёт.
+
+        Такие фильмы выгружаются уже с новыми именами, а update_by_query на каждый батч первого
+        перелива персон и жанров переписывал бы все фильмы заново.
+        """
+
+        state = self.state.retrieve_state()
+        if not state.get("initial_load_index_settings"):
+            return False
+        related_since = state.get("films_related_since")
+        if not related_since:
+            # Фильмы ещё не начали выгружаться и прочитают текущие имена.
+            return True
+        modified = checkpoint_time(checkpoint)
+        return modified is not None and modified < datetime.fromisoformat(related_since)
+
+    def propagate_renames_to_films(
+        self, batches: Iterable[tuple[list, dict]], name_field: str, **rename_options
+    ) -> Iterator[tuple[list, dict]]:
+        """Перед загрузкой каждого батча персон или жанров переносит их имена в документы фильмов.
+
+        Checkpoint батча сохраняется после его загрузки, т.е. уже после обновления фильмов. Перенос ждёт
+        окончания идущего прохода загрузки фильмов (RENAMES_LOCK_KEY): иначе фильм, выгруженный из postgres
+        до переименования, мог бы записаться в elastic уже после update_by_query и остаться со старым именем.
+        """
+
+        for batch, checkpoint in batches:
+            if batch and not self.renames_loaded_with_films(checkpoint):
+                names = {doc_id: orjson.loads(source)[name_field] for doc_id, source in batch}
+                with self.transformer.extractor.advisory_lock(RENAMES_LOCK_KEY):
+                    self.rename_in_films(names=names, **rename_options)
+            yield batch, checkpoint
+
+    def load_index(self, alias: str) -> None:
+        """Загружает в elastic батчи данных потока, соответствующего алиасу."""
+
+        load_methods = {
+            "movies": self.load_films_batch_to_elastic,
+            "persons": self.load_persons_batch_to_elastic,
+            "genres": self.load_genres_batch_to_elastic,
+        }
+        load_methods[alias]()
+
+    @es_backoff
     def load_films_batch_to_elastic(self) -> None:
-        """Метод загружает батчи данных по фильмам в elastic и сохраняет текущий offset."""
+        """Метод загружает батчи данных по фильмам в elastic и сохраняет текущий checkpoint."""
 
-        for elastic_movies_schema_models_batch, films_offset in self.transformer.transform_film_data_batches():
+        films_lock = nullcontext()
+        if self.propagate_renames:
+            films_lock = self.transformer.extractor.advisory_lock(RENAMES_LOCK_KEY, shared=True)
+        with films_lock:
             self.bulk_to_elastic(
-                index="movies",
-                elastic_schema_models_batch=elastic_movies_schema_models_batch,
-                offset_name="films_offset",
-                offset=films_offset,
+                index=self.indexes["movies"],
+                documents_batches=self.transformer.transform_film_data_batches(),
+                batch_size=self.transformer.extractor.batch_sizes["films"],
             )
 
+    @es_backoff
     def load_persons_batch_to_elastic(self) -> None:
-        """Метод загружает батчи данных по актёрам в elastic и сохраняет текущий offset."""
+        """Метод загружает батчи данных по актёрам в elastic и сохраняет текущий checkpoint."""
 
-        for transformed_persons_batch, persons_offset in self.transformer.transform_persons_data_batches():
-            self.bulk_to_elastic(
-                index="persons",
-                elastic_schema_models_batch=transformed_persons_batch,
-                offset_name="persons_offset",
-                offset=persons_offset,
+        persons_batches = self.transformer.transform_persons_data_batches()
+        if self.propagate_renames:
+            persons_batches = self.propagate_renames_to_films(
+                persons_batches,
+                name_field="full_name",
+                fields=["actors", "writers", "directors"],
+                names_fields={"actors_names": "actors", "writers_names": "writers"},
             )
 
+        self.bulk_to_elastic(
+            index=self.indexes["persons"],
+            documents_batches=persons_batches,
+            batch_size=self.transformer.extractor.batch_sizes["persons"],
+        )
+
+    @es_backoff
     def load_genres_batch_to_elastic(self) -> None:
-        """Метод загружает батчи данных по жанрам в elastic и сохраняет текущий offset."""
+        """Метод загружает батчи данных по жанрам в elastic и сохраняет текущий checkpoint."""
 
-        for transformed_genres_batch, genres_offset in self.transformer.transform_genre_data_batches():
-            self.bulk_to_elastic(
-                index="genres",
-                elastic_schema_models_batch=transformed_genres_batch,
-                offset_name="genres_offset",
-                offset=genres_offset,
+        genres_batches = self.transformer.transform_genre_data_batches()
+        if self.propagate_renames:
+            genres_batches = self.propagate_renames_to_films(
+                genres_batches, name_field="name", fields=["genres"], names_fields={}
             )
+
+        self.bulk_to_elastic(
+            index=self.indexes["genres"],
+            documents_batches=genres_batches,
+            batch_size=self.transformer.extractor.batch_sizes["genres"],
+        )
@@ -0,0 +1,323 @@
+"""Метрики ETL в текстовом формате Prometheus.
+
+Этапы ETL сообщают о своей работе через hooks: выгрузка (extract), сборка и сериализация
+документов (transform), bulk-запросы в elastic (load), повторные отправки, dead letters
+и сохранённые checkpoint. Пока не зарегистрирован ни один обработчик, вызовы hooks
+ничего не делают. etl_main регистрирует ETLMetrics, если задан ETL_METRICS_PORT
+(HTTP-эндпоинт /metrics) или ETL_METRICS_FILE (файл для textfile collector node_exporter).
+"""
+import os
+import time
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+from logger import logger
+
+# Границы корзин гистограммы длительности этапов, в секундах.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# За сколько последних секунд считаются docs/sec и bytes/sec.
+RATE_WINDOW = 60
+
+
+class StageHook:
+    """Обработчик событий этапов ETL. Методы вызываются из потоков загрузки и должны быть быстрыми."""
+
+    def extract(self, stream: str, rows: int, seconds: float) -> None:
+        pass
+
+    def transform(self, stream: str, docs: int, seconds: float) -> None:
+        pass
+
+    def load(self, stream: str, docs: int, payload_bytes: int, seconds: float | None = None) -> None:
+        pass
+
+    def retry(self, stream: str, docs: int) -> None:
+        pass
+
+    def dead_letter(self, stream: str, docs: int) -> None:
+        pass
+
+    def checkpoint(self, stream: str, checkpoint: dict) -> None:
+        pass
+
+    def pass_finished(self, stream: str) -> None:
+        pass
+
+
+class StageHooks(StageHook):
+    """Рассылает события этапов всем зарегистрированным обработчикам."""
+
+    def __init__(self):
+        self.hooks: list[StageHook] = []
+
+    def register(self, hook: StageHook) -> None:
+        self.hooks.append(hook)
+
+    def extract(self, stream: str, rows: int, seconds: float) -> None:
+        for hook in self.hooks:
+            hook.extract(stream, rows, seconds)
+
+    def transform(self, stream: str, docs: int, seconds: float) -> None:
+        for hook in self.hooks:
+            hook.transform(stream, docs, seconds)
+
+    def load(self, stream: str, docs: int, payload_bytes: int, seconds: float | None = None) -> None:
+        for hook in self.hooks:
+            hook.load(stream, docs, payload_bytes, seconds)
+
+    def retry(self, stream: str, docs: int) -> None:
+        for hook in self.hooks:
+            hook.retry(stream, docs)
+
+    def dead_letter(self, stream: str, docs: int) -> None:
+        for hook in self.hooks:
+            hook.dead_letter(stream, docs)
+
+    def checkpoint(self, stream: str, checkpoint: dict) -> None:
+        for hook in self.hooks:
+            hook.checkpoint(stream, checkpoint)
+
+    def pass_finished(self, stream: str) -> None:
+        for hook in self.hooks:
+            hook.pass_finished(stream)
+
+
+hooks = StageHooks()
+
+
+def checkpoint_time(checkpoint: dict) -> datetime | None:
+    """modified последней загруженной записи из checkpoint (keyset) или время проверки (offset)."""
+
+    for key, value in checkpoint.items():
+        if key.endswith("_last_key") and value:
+            return datetime.fromisoformat(value[0])
+        if key.endswith("_last_extracting_time") and value:
+            return datetime.fromisoformat(value)
+    return None
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class ETLMetrics(StageHook):
+    """Накапливает метрики этапов ETL и отдаёт их в текстовом формате Prometheus.
+
+    etl_checkpoint_lag_seconds - насколько последняя загруженная запись потока отстаёт от момента
+    сохранения её checkpoint; после прохода, выгрузившего все изменения, отставание равно нулю.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.started = time.monotonic()
+        # {(имя метрики, поток): значение}
+        self.counters: dict[tuple[str, str], float] = {}
+        self.gauges: dict[tuple[str, str], float] = {}
+        # {(поток, этап): гистограмма длительности}
+        self.durations: dict[tuple[str, str], Histogram] = {}
+        # {поток: deque[(monotonic, документы, байты)]} - загрузки за последние RATE_WINDOW секунд.
+        self.loaded: dict[str, deque] = {}
+
+    def add(self, name: str, stream: str, value: float) -> None:
+        self.counters[name, stream] = self.counters.get((name, stream), 0) + value
+
+    def observe_duration(self, stream: str, stage: str, seconds: float) -> None:
+        histogram = self.durations.get((stream, stage))
+        if histogram is None:
+            histogram = self.durations[stream, stage] = Histogram()
+        histogram.observe(seconds)
+
+    def extract(self, stream: str, rows: int, seconds: float) -> None:
+        with self.lock:
+            self.observe_duration(stream, "extract", seconds)
+            self.add("etl_rows_extracted_total", stream, rows)
+
+    def transform(self, stream: str, docs: int, seconds: float) -> None:
+        with self.lock:
+            self.observe_duration(stream, "transform", seconds)
+            self.add("etl_documents_transformed_total", stream, docs)
+
+    def load(self, stream: str, docs: int, payload_bytes: int, seconds: float | None = None) -> None:
+        with self.lock:
+            if seconds is not None:
+                self.observe_duration(stream, "load", seconds)
+            self.add("etl_documents_loaded_total", stream, docs)
+            self.add("etl_bytes_loaded_total", stream, payload_bytes)
+            loaded = self.loaded.setdefault(stream, deque())
+            now = time.monotonic()
+            loaded.append((now, docs, payload_bytes))
+            while loaded[0][0] < now - RATE_WINDOW:
+                loaded.popleft()
+
+    def retry(self, stream: str, docs: int) -> None:
+        with self.lock:
+            self.add("etl_bulk_retries_total", stream, docs)
+
+    def dead_letter(self, stream: str, docs: int) -> None:
+        with self.lock:
+            self.add("etl_dead_letters_total", stream, docs)
+
+    def checkpoint(self, stream: str, checkpoint: dict) -> None:
+        modified = checkpoint_time(checkpoint)
+        if modified is None:
+            return
+        now = time.time()
+        with self.lock:
+            self.gauges["etl_checkpoint_timestamp_seconds", stream] = modified.timestamp()
+            self.gauges["etl_checkpoint_lag_seconds", stream] = max(0.0, now - modified.timestamp())
+
+    def pass_finished(self, stream: str) -> None:
+        with self.lock:
+            self.gauges["etl_checkpoint_lag_seconds", stream] = 0.0
+            self.gauges["etl_last_pass_timestamp_seconds", stream] = time.time()
+
+    def rates(self) -> dict[str, tuple[float, float]]:
+        """docs/sec и bytes/sec каждого потока за последние RATE_WINDOW секунд."""
+
+        now = time.monotonic()
+        window = min(RATE_WINDOW, now - self.started) or 1
+        rates = {}
+        for stream, loaded in self.loaded.items():
+            while loaded and loaded[0][0] < now - RATE_WINDOW:
+                loaded.popleft()
+            rates[stream] = (
+                sum(docs for _, docs, _ in loaded) / window,
+                sum(payload_bytes for _, _, payload_bytes in loaded) / window,
+            )
+        return rates
+
+    def render(self) -> str:
+        lines = []
+
+        def family(name: str, metric_type: str, help_text: str, samples: dict[str, float]) -> None:
+            if not samples:
+                return
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples.items():
+                lines.append(f"{name}{{{labels}}} {value}")
+
+        def by_stream(metrics: dict[tuple[str, str], float], name: str) -> dict[str, float]:
+            return {f'stream="{stream}"': value for (metric, stream), value in metrics.items() if metric == name}
+
+        with self.lock:
+            for name, help_text in (
+                ("etl_rows_extracted_total", "Строки, выгруженные из postgres."),
+                ("etl_documents_transformed_total", "Собранные и сериализованные документы."),
+                ("etl_documents_loaded_total", "Документы, запись которых подтвердил elastic."),
+                ("etl_bytes_loaded_total", "Объём документов, запись которых подтвердил elastic, в байтах."),
+                ("etl_bulk_retries_total", "Повторные отправки документов, отклонённых elastic с 429 или 503."),
+                ("etl_dead_letters_total", "Документы, записанные в dead letter файл."),
+            ):
+                family(name, "counter", help_text, by_stream(self.counters, name))
+
+            rates = self.rates()
+            family(
+                "etl_documents_per_second",
+                "gauge",
+                f"Документов в секунду за последние {RATE_WINDOW} с.",
+                {f'stream="{stream}"': docs for stream, (docs, _) in rates.items()},
+            )
+            family(
+                "etl_bytes_per_second",
+                "gauge",
+                f"Байт в секунду за последние {RATE_WINDOW} с.",
+                {f'stream="{stream}"': payload_bytes for stream, (_, payload_bytes) in rates.items()},
+            )
+            for name, help_text in (
+                (
+                    "etl_checkpoint_lag_seconds",
+                    "Отставание последней загруженной записи от момента сохранения её checkpoint.",
+                ),
+                ("etl_checkpoint_timestamp_seconds", "modified последней загруженной записи."),
+                ("etl_last_pass_timestamp_seconds", "Когда поток в последний раз выгрузил все изменения."),
+            ):
+                family(name, "gauge", help_text, by_stream(self.gauges, name))
+
+            if self.durations:
+                name = "etl_stage_duration_seconds"
+                lines.append(f"# HELP {name} Длительность выгрузки и преобразования батча и bulk-запроса.")
+                lines.append(f"# TYPE {name} histogram")
+                for (stream, stage), histogram in self.durations.items():
+                    labels = f'stream="{stream}",stage="{stage}"'
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else bound
+                        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+                    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+                    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    metrics: ETLMetrics
+
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class MetricsFileWriter(Thread):
+    """Периодически атомарно перезаписывает файл метрик."""
+
+    def __init__(self, metrics: ETLMetrics, file_path: str, interval: float):
+        super().__init__(name="metrics-file", daemon=True)
+        self.metrics = metrics
+        self.file_path = file_path
+        self.interval = interval
+
+    def write(self) -> None:
+        tmp_path = f"{self.file_path}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(self.metrics.render())
+        os.replace(tmp_path, self.file_path)
+
+    def run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.write()
+            except OSError as exc:
+                logger.error(f"Не удалось записать метрики в {self.file_path}: {exc}")
+
+
+def start_metrics(port: int = 0, file_path: str = "", file_interval: float = 15) -> ETLMetrics | None:
+    """Регистрирует ETLMetrics и запускает HTTP-эндпоинт на port и/или запись в file_path."""
+
+    if not port and not file_path:
+        return None
+    metrics = ETLMetrics()
+    hooks.register(metrics)
+    if port:
+        handler = type("ETLMetricsHandler", (MetricsHandler,), {"metrics": metrics})
+        server = ThreadingHTTPServer(("", port), handler)
+        Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        logger.info(f"Метрики ETL доступны на :{port}/metrics")
+    if file_path:
+        MetricsFileWriter(metrics, file_path, file_interval).start()
+        logger.info(f"Метрики ETL записываются в {file_path}")
+    return metrics
@@ -1,3 +1,6 @@
+import os
+import socket
+from enum import Enum
 from typing import Optional
 
 from pydantic import BaseModel, BaseSettings
@@ -48,6 +51,27 @@ class ElasticGenresSchemaModel(BaseModel):
     description: Optional[str] = ""
 
 
+class PaginationMode(str, Enum):
+    """Способ постраничной выгрузки из postgres."""
+
+    offset = "offset"
+    keyset = "keyset"
+
+
+class StateBackend(str, Enum):
+    """Где хранится состояние ETL: в локальном файле или в postgres, общее для нескольких воркеров."""
+
+    file = "file"
+    postgres = "postgres"
+
+
+class EtlRunner(str, Enum):
+    """Вариант ETL: синхронный (psycopg2, Elasticsearch) или асинхронный (asyncpg, AsyncElasticsearch)."""
+
+    sync = "sync"
+    asyncio = "asyncio"
+
+
 class EnvSettings(BaseSettings):
     """Настройки из .env"""
 
@@ -60,9 +84,89 @@ class EnvSettings(BaseSettings):
     es_host: str = Field(env="ES_HOST")
     es_port: int = Field(env="ES_PORT")
 
+    # asyncio - выгрузка, преобразование и загрузка в одном цикле событий через asyncpg и AsyncElasticsearch.
+    etl_runner: EtlRunner = Field(env="ETL_RUNNER", default=EtlRunner.sync)
+    # Длина очередей между выгрузкой, преобразованием и загрузкой асинхронного ETL, в батчах.
+    etl_async_queue_size: int = Field(env="ETL_ASYNC_QUEUE_SIZE", default=4)
+    # Сколько раз асинхронный ETL повторяет отправку документов, отклонённых elastic с 429.
+    etl_async_bulk_max_retries: int = Field(env="ETL_ASYNC_BULK_MAX_RETRIES", default=8)
+
+    # Начальный размер батча выгрузки. При ETL_ADAPTIVE_BATCH_SIZE размер каждого потока подстраивается
+    # в пределах [ETL_BATCH_SIZE_MIN, ETL_BATCH_SIZE_MAX] так, чтобы батч занимал около ETL_ES_BULK_CHUNK_BYTES
+    # и выгружался и индексировался не дольше ETL_BATCH_TARGET_LATENCY секунд.
+    etl_batch_size: int = Field(env="ETL_BATCH_SIZE", default=500)
+    etl_adaptive_batch_size: bool = Field(env="ETL_ADAPTIVE_BATCH_SIZE", default=True)
+    etl_batch_size_min: int = Field(env="ETL_BATCH_SIZE_MIN", default=50)
+    etl_batch_size_max: int = Field(env="ETL_BATCH_SIZE_MAX", default=10000)
+    etl_batch_target_latency: float = Field(env="ETL_BATCH_TARGET_LATENCY", default=1.0)
+
+    etl_pagination_mode: PaginationMode = Field(env="ETL_PAGINATION_MODE", default=PaginationMode.keyset)
+    # Потоковая выгрузка одним запросом через server-side курсор, работает в режиме keyset.
+    etl_pg_streaming: bool = Field(env="ETL_PG_STREAMING", default=False)
+    etl_pg_itersize: int = Field(env="ETL_PG_ITERSIZE", default=2000)
+    # Двухфазная выгрузка фильмов (id изменившихся фильмов, затем их данные), работает в режиме keyset.
+    etl_films_two_phase: bool = Field(env="ETL_FILMS_TWO_PHASE", default=True)
+    # Переименования персон и жанров переносятся в документы фильмов частичным обновлением,
+    # а не повторной загрузкой фильмов целиком (в двухфазном режиме).
+    etl_propagate_renames: bool = Field(env="ETL_PROPAGATE_RENAMES", default=False)
+
+    # Как часто, в секундах, состояние ETL сбрасывается на диск (0 - при каждом сохранении).
+    etl_state_flush_interval: float = Field(env="ETL_STATE_FLUSH_INTERVAL", default=5.0)
+
+    etl_state_backend: StateBackend = Field(env="ETL_STATE_BACKEND", default=StateBackend.file)
+    etl_worker_id: str = Field(env="ETL_WORKER_ID", default_factory=lambda: f"{socket.gethostname()}-{os.getpid()}")
+    etl_lease_seconds: int = Field(env="ETL_LEASE_SECONDS", default=300)
+    # На сколько диапазонов id делится поток фильмов между воркерами при ETL_STATE_BACKEND=postgres.
+    etl_films_partitions: int = Field(env="ETL_FILMS_PARTITIONS", default=1)
+
+    # Загружать потоки movies, persons и genres параллельно, а не друг за другом.
+    etl_concurrent_streams: bool = Field(env="ETL_CONCURRENT_STREAMS", default=True)
+    etl_poll_interval: float = Field(env="ETL_POLL_INTERVAL", default=60)
+    # Захват изменений через LISTEN/NOTIFY: уведомления собираются в пачку, пока идут чаще,
+    # чем раз в ETL_CHANGE_DEBOUNCE секунд, но не дольше ETL_CHANGE_MAX_DELAY секунд.
+    etl_change_capture: bool = Field(env="ETL_CHANGE_CAPTURE", default=False)
+    etl_change_debounce: float = Field(env="ETL_CHANGE_DEBOUNCE", default=1.0)
+    etl_change_max_delay: float = Field(env="ETL_CHANGE_MAX_DELAY", default=10.0)
+
+    etl_es_bulk_threads: int = Field(env="ETL_ES_BULK_THREADS", default=4)
+    etl_es_bulk_chunk_bytes: int = Field(env="ETL_ES_BULK_CHUNK_BYTES", default=5 * 1024 * 1024)
+    etl_es_bulk_max_inflight_bytes: int = Field(env="ETL_ES_BULK_MAX_INFLIGHT_BYTES", default=100 * 1024 * 1024)
+    etl_es_http_compress: bool = Field(env="ETL_ES_HTTP_COMPRESS", default=True)
+    # Общий для всех потоков предел объёма bulk-запросов в elastic, байт в секунду (0 - без ограничения).
+    etl_es_max_bytes_per_second: int = Field(env="ETL_ES_MAX_BYTES_PER_SECOND", default=0)
+    etl_dead_letter_path: str = Field(env="ETL_DEAD_LETTER_PATH", default="state/dead_letters.jsonl")
+
+    # Не отправлять в elastic документы, содержимое которых не изменилось с прошлой загрузки.
+    etl_skip_unchanged: bool = Field(env="ETL_SKIP_UNCHANGED", default=True)
+    etl_hashes_path: str = Field(env="ETL_HASHES_PATH", default="state/document_hashes.sqlite")
+
+    # Отладка: проверять каждый документ pydantic-моделью индекса перед загрузкой.
+    etl_validate_documents: bool = Field(env="ETL_VALIDATE_DOCUMENTS", default=False)
+    # Число процессов для сборки и сериализации документов, 0 - в основном процессе ETL.
+    etl_transform_workers: int = Field(env="ETL_TRANSFORM_WORKERS", default=0)
+
+    # Метрики ETL в формате Prometheus: порт эндпоинта /metrics и/или файл, перезаписываемый
+    # каждые ETL_METRICS_FILE_INTERVAL секунд. 0 и пустая строка - не публиковать.
+    etl_metrics_port: int = Field(env="ETL_METRICS_PORT", default=0)
+    etl_metrics_file: str = Field(env="ETL_METRICS_FILE", default="")
+    etl_metrics_file_interval: float = Field(env="ETL_METRICS_FILE_INTERVAL", default=15)
+
+    # Redis API: после записи в elastic id изменённых документов публикуются в stream
+    # CACHE_INVALIDATION_STREAM, по которому API сбрасывает свой кеш.
+    redis_host: str = Field(env="REDIS_HOST", default="redis://127.0.0.1")
+    redis_port: int = Field(env="REDIS_PORT", default=6379)
+    etl_publish_changes: bool = Field(env="ETL_PUBLISH_CHANGES", default=True)
+    cache_invalidation_stream: str = Field(env="CACHE_INVALIDATION_STREAM", default="etl:changes")
+    # Примерная длина stream: старые события обрезаются, API читает только новые.
+    etl_cache_invalidation_stream_max_len: int = Field(env="ETL_CACHE_INVALIDATION_STREAM_MAX_LEN", default=10000)
+
     @property
     def es_url(self):
         return f"{self.es_host}:{self.es_port}"
 
+    @property
+    def redis_url(self):
+        return f"{self.redis_host}:{self.redis_port}"
+
     class Config:
         env_file = ".env"
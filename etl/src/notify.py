@@ -0,0 +1,124 @@
+"""Захват изменений через LISTEN/NOTIFY postgres вместо опроса раз в минуту.
+
+Триггеры на таблицах content отправляют в канал etl_changes имя изменённой таблицы.
+ChangeListener просыпается от первого уведомления, собирает уведомления пачкой, пока
+они идут чаще, чем раз в debounce секунд (но не дольше max_delay), и возвращает алиасы
+индексов, которые нужно обновить. Если уведомлений нет poll_interval секунд, ETL
+выполняет обычный опрос всех потоков.
+"""
+import logging
+import select
+from time import monotonic, sleep
+
+import backoff
+import psycopg2
+
+from extract import POSTGRES_CONNECTION
+from load import ETL_ALIASES
+from logger import logger
+from models import EnvSettings
+
+CHANNEL = "etl_changes"
+
+# Какие индексы затрагивает изменение каждой таблицы.
+TABLE_ALIASES = {
+    "film_work": {"movies"},
+    "person_film_work": {"movies"},
+    "genre_film_work": {"movies"},
+    "person": {"movies", "persons"},
+    "genre": {"movies", "genres"},
+}
+
+INSTALL_TRIGGERS_QUERY = f"""
+    CREATE OR REPLACE FUNCTION content.etl_notify_change() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('{CHANNEL}', TG_TABLE_NAME);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+""" + "".join(
+    f"""
+    CREATE OR REPLACE TRIGGER etl_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON content.{table}
+    FOR EACH STATEMENT EXECUTE FUNCTION content.etl_notify_change();
+    """
+    for table in TABLE_ALIASES
+)
+
+
+class Poller:
+    """Опрос всех потоков раз в poll_interval секунд."""
+
+    def __init__(self, poll_interval: float):
+        self.poll_interval = poll_interval
+
+    def wait_for_changes(self) -> list[str]:
+        """Блокируется до следующего прохода ETL и возвращает алиасы индексов, которые нужно обновить."""
+
+        sleep(self.poll_interval)
+        return list(ETL_ALIASES)
+
+
+class ChangeListener(Poller):
+    """Ожидание изменений в postgres с объединением частых уведомлений в микро-батчи."""
+
+    def __init__(self, poll_interval: float, debounce: float, max_delay: float):
+        super().__init__(poll_interval)
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.connection = self.listen()
+
+    @backoff.on_exception(
+        exception=psycopg2.OperationalError,
+        wait_gen=backoff.expo,
+        logger=logger,
+        backoff_log_level=logging.ERROR,
+    )
+    def listen(self) -> psycopg2.extensions.connection:
+        logger.info(f"Подписка на канал {CHANNEL} postgres...")
+        connection = psycopg2.connect(**POSTGRES_CONNECTION)
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(INSTALL_TRIGGERS_QUERY)
+            cursor.execute(f"LISTEN {CHANNEL};")
+        return connection
+
+    def wait_for_changes(self) -> list[str]:
+        try:
+            if not self.wait_for_notifies(self.poll_interval):
+                return list(ETL_ALIASES)
+
+            changed_aliases = self.drain_notifies()
+            deadline = monotonic() + self.max_delay
+            while (remaining := deadline - monotonic()) > 0 and self.wait_for_notifies(min(self.debounce, remaining)):
+                changed_aliases |= self.drain_notifies()
+        except psycopg2.OperationalError as exc:
+            logger.exception(f"Потеряно соединение LISTEN с postgres: {exc}")
+            self.connection = self.listen()
+            return list(ETL_ALIASES)
+
+        return [alias for alias in ETL_ALIASES if alias in changed_aliases]
+
+    def wait_for_notifies(self, timeout: float) -> bool:
+        if not self.connection.notifies:
+            ready, _, _ = select.select([self.connection], [], [], timeout)
+            if ready:
+                self.connection.poll()
+        return bool(self.connection.notifies)
+
+    def drain_notifies(self) -> set[str]:
+        changed_aliases = set()
+        while self.connection.notifies:
+            notify = self.connection.notifies.pop(0)
+            changed_aliases |= TABLE_ALIASES.get(notify.payload, set())
+        return changed_aliases
+
+
+def get_change_waiter(settings: EnvSettings) -> Poller:
+    if settings.etl_change_capture:
+        return ChangeListener(
+            poll_interval=settings.etl_poll_interval,
+            debounce=settings.etl_change_debounce,
+            max_delay=settings.etl_change_max_delay,
+        )
+    return Poller(poll_interval=settings.etl_poll_interval)
@@ -0,0 +1,40 @@
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
+from time import monotonic, sleep
+from typing import Iterator
+
+
+class BulkRateLimiter:
+    """Общее для нескольких ESLoader ограничение нагрузки на elastic.
+
+    Одновременно выполняется не больше max_concurrent bulk-запросов, а в среднем отправляется
+    не больше max_bytes_per_second байт в секунду (0 - без ограничения по объёму).
+    """
+
+    def __init__(self, max_concurrent: int, max_bytes_per_second: int = 0):
+        self.semaphore = BoundedSemaphore(max_concurrent)
+        self.max_bytes_per_second = max_bytes_per_second
+        # Сколько байт можно отправить без ожидания, не больше чем за одну секунду.
+        self.allowance = float(max_bytes_per_second)
+        self.last_check = monotonic()
+        self.lock = Lock()
+
+    def throttle(self, payload_bytes: int) -> None:
+        if not self.max_bytes_per_second:
+            return
+        with self.lock:
+            now = monotonic()
+            self.allowance = min(
+                self.max_bytes_per_second, self.allowance + (now - self.last_check) * self.max_bytes_per_second
+            )
+            self.last_check = now
+            self.allowance -= payload_bytes
+            delay = -self.allowance / self.max_bytes_per_second if self.allowance < 0 else 0
+        if delay:
+            sleep(delay)
+
+    @contextmanager
+    def request(self, payload_bytes: int) -> Iterator[None]:
+        self.throttle(payload_bytes)
+        with self.semaphore:
+            yield
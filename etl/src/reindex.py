@@ -0,0 +1,104 @@
+"""Фоновое построение новой версии индекса и атомарное переключение на неё алиаса.
+
+etl_main запускает перестроение для каждого алиаса, который указывает не на текущую
+версию из create_indexes.INDEX_VERSIONS. Запуск вручную: python reindex.py movies
+"""
+import sys
+import time
+from threading import Thread
+
+from elasticsearch import Elasticsearch
+
+from create_indexes import (
+    alias_indexes,
+    delete_previous_indexes,
+    indexes_to_rebuild,
+    swap_alias,
+    versioned_index_name,
+)
+from extract import PGExtractor, create_keyset_indexes
+from invalidation import ChangePublisher
+from load import ESLoader
+from logger import logger
+from models import EnvSettings
+from state import BufferedJsonFileStorage
+from transform import BatchTransform
+
+MAX_REBUILD_RETRY_DELAY = 300
+
+
+def rebuild_index(alias: str) -> None:
+    """Загружает все данные в новую версию индекса со своим состоянием и переключает на неё алиас.
+
+    Пока индекс строится, поиск и текущий ETL продолжают работать через алиас со старым индексом.
+    После переключения и догрузки прежние версии индекса удаляются.
+    """
+
+    index = versioned_index_name(alias)
+    storage = BufferedJsonFileStorage(f"state/{index}.json", flush_interval=EnvSettings().etl_state_flush_interval)
+    # Переименования, которые основной ETL переносит в фильмы, до нового индекса не доходят,
+    # поэтому строящийся индекс фильмов сам выгружает фильмы изменённых персон и жанров.
+    pg_extractor = PGExtractor(state=storage, films_detect_renames=True)
+    batch_transform = BatchTransform(extractor=pg_extractor)
+    # Пока алиас указывает на старый индекс, изменения нового индекса не видны API. Перестроение персон
+    # и жанров не переносит имена в фильмы: основной ETL уже перенёс их при загрузке в прежний индекс.
+    es_loader = ESLoader(
+        transformer=batch_transform,
+        state=storage,
+        indexes={alias: index},
+        propagate_renames=False,
+        publish_changes=False,
+    )
+
+    # После ошибки в догрузке алиас уже указывает на новый индекс: повторять первый перелив нельзя,
+    # он отключил бы refresh у индекса, с которым работает поиск.
+    if alias_indexes(es_loader.elastic_connection, alias) != [index]:
+        logger.info(f"Построение индекса {index} для алиаса {alias}")
+        es_loader.start_initial_load([index])
+        es_loader.load_index(alias)
+        es_loader.finish_initial_load()
+
+        swap_alias(es_loader.elastic_connection, alias)
+    # Догружаем изменения, появившиеся между окончанием выгрузки и переключением алиаса.
+    es_loader.load_index(alias)
+    # Откатиться на прежний индекс уже нельзя: новый получил изменения, которых в нём нет.
+    delete_previous_indexes(es_loader.elastic_connection, alias)
+    # Новый индекс мог разойтись со старым в любых документах: кеш API по алиасу сбрасывается целиком.
+    change_publisher = ChangePublisher.from_settings(EnvSettings())
+    if change_publisher:
+        change_publisher.publish(alias, None)
+
+
+def rebuild_index_until_done(alias: str) -> None:
+    """Повторяет перестроение после ошибок, продолжая его с сохранённого состояния.
+
+    Иначе упавшее перестроение оставило бы алиас на старой версии индекса до перезапуска ETL.
+    """
+
+    attempt = 0
+    while True:
+        try:
+            rebuild_index(alias)
+            return
+        except Exception as exc:
+            delay = min(2**attempt, MAX_REBUILD_RETRY_DELAY)
+            attempt += 1
+            logger.exception(f"Ошибка перестроения индекса для алиаса {alias}, повтор через {delay} с: {exc}")
+            time.sleep(delay)
+
+
+def start_rebuilds(client: Elasticsearch) -> list[Thread]:
+    """Запускает в фоновых потоках перестроение всех устаревших индексов."""
+
+    threads = []
+    for alias in indexes_to_rebuild(client):
+        thread = Thread(target=rebuild_index_until_done, args=(alias,), name=f"rebuild-{alias}", daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+if __name__ == "__main__":
+    create_keyset_indexes()
+    for alias_to_rebuild in sys.argv[1:]:
+        rebuild_index(alias_to_rebuild)
@@ -1,7 +1,14 @@
 import abc
+import atexit
 import json
+import os
+import time
+from threading import RLock
 from typing import Any, Optional
 
+from psycopg2.extensions import connection
+from psycopg2.extras import Json
+
 
 class BaseStorage:
     @abc.abstractmethod
@@ -14,6 +21,10 @@ class BaseStorage:
         """Загрузить состояние локально из постоянного хранилища"""
         pass
 
+    def flush(self) -> None:
+        """Записать в постоянное хранилище отложенные изменения состояния"""
+        pass
+
 
 class JsonFileStorage(BaseStorage):
     def __init__(self, file_path: Optional[str] = None):
@@ -42,6 +53,181 @@ class JsonFileStorage(BaseStorage):
             return {}
 
 
+class BufferedJsonFileStorage(BaseStorage):
+    """Хранит состояние в памяти и сбрасывает его в json-файл атомарно:
+    запись во временный файл, fsync и переименование поверх старого файла.
+
+    Сохранения объединяются: файл перезаписывается не чаще раза в flush_interval секунд,
+    оставшиеся изменения записываются при flush() и при завершении процесса.
+    """
+
+    def __init__(self, file_path: str, flush_interval: float = 0.0):
+        self.file_path = file_path
+        self.flush_interval = flush_interval
+        self._state = JsonFileStorage(file_path).retrieve_state()
+        self._dirty = False
+        self._last_flush_time = time.monotonic()
+        self._lock = RLock()
+        atexit.register(self.flush)
+
+    def save_state(self, state: dict) -> None:
+        with self._lock:
+            self._state.update(state)
+            self._dirty = True
+            if time.monotonic() - self._last_flush_time >= self.flush_interval:
+                self.flush()
+
+    def retrieve_state(self) -> dict:
+        with self._lock:
+            return dict(self._state)
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+
+            directory = os.path.dirname(os.path.abspath(self.file_path))
+            os.makedirs(directory, exist_ok=True)
+            tmp_file_path = f"{self.file_path}.tmp"
+            with open(tmp_file_path, "w") as f:
+                f.write(json.dumps(self._state))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file_path, self.file_path)
+
+            directory_fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(directory_fd)
+            finally:
+                os.close(directory_fd)
+
+            self._dirty = False
+            self._last_flush_time = time.monotonic()
+
+
+class LeaseLostError(Exception):
+    """Аренда партиции истекла или перехвачена другим воркером."""
+
+
+class PostgresStorage(BaseStorage):
+    """Состояние одной партиции ETL (потока или диапазона id потока) в таблице etl_state.
+
+    Партицией владеет один воркер, пока продлевает аренду (lease). Каждая запись состояния
+    выполняется как compare-and-set по версии строки: если партицию перехватил другой воркер,
+    запись не происходит и выбрасывается LeaseLostError.
+    """
+
+    CREATE_TABLE_QUERY = """
+        CREATE TABLE IF NOT EXISTS public.etl_state (
+            partition text PRIMARY KEY,
+            state jsonb NOT NULL DEFAULT '{}',
+            version bigint NOT NULL DEFAULT 0,
+            owner text,
+            lease_expires_at timestamp with time zone
+        );
+    """
+
+    def __init__(self, pg_connection: connection, partition: str, owner: str, lease_seconds: int = 300):
+        self.pg_connection = pg_connection
+        self.pg_connection.autocommit = True
+        self.partition = partition
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.version = None
+        # Аренду продлевает ещё и поток LeaseHeartbeat: версия читается и меняется под блокировкой.
+        self.lock = RLock()
+        with self.pg_connection.cursor() as cursor:
+            cursor.execute(self.CREATE_TABLE_QUERY)
+
+    def acquire(self) -> bool:
+        """Взять или продлить аренду партиции. False - партицией владеет другой воркер."""
+
+        with self.lock, self.pg_connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO public.etl_state (partition, owner, lease_expires_at)
+                VALUES (%(partition)s, %(owner)s, now() + %(lease_seconds)s * interval '1 second')
+                ON CONFLICT (partition) DO UPDATE
+                SET owner = EXCLUDED.owner,
+                    lease_expires_at = EXCLUDED.lease_expires_at,
+                    version = etl_state.version + 1
+                WHERE etl_state.owner = EXCLUDED.owner
+                      OR etl_state.owner IS NULL
+                      OR etl_state.lease_expires_at < now()
+                RETURNING version;
+                """,
+                {"partition": self.partition, "owner": self.owner, "lease_seconds": self.lease_seconds},
+            )
+            row = cursor.fetchone()
+            self.version = row[0] if row else None
+        return row is not None
+
+    def release(self) -> None:
+        """Освободить партицию, чтобы её мог взять любой воркер."""
+
+        with self.lock, self.pg_connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE public.etl_state SET owner = NULL, lease_expires_at = NULL
+                WHERE partition = %s AND owner = %s AND version = %s;
+                """,
+                (self.partition, self.owner, self.version),
+            )
+            self.version = None
+
+    def renew(self) -> bool:
+        """Продлить аренду без записи состояния. False - партицию перехватил другой воркер."""
+
+        with self.lock, self.pg_connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE public.etl_state
+                SET lease_expires_at = now() + %(lease_seconds)s * interval '1 second'
+                WHERE partition = %(partition)s AND owner = %(owner)s AND version = %(version)s
+                RETURNING version;
+                """,
+                {
+                    "lease_seconds": self.lease_seconds,
+                    "partition": self.partition,
+                    "owner": self.owner,
+                    "version": self.version,
+                },
+            )
+            return cursor.fetchone() is not None
+
+    def save_state(self, state: dict) -> None:
+        """Дописать состояние партиции и продлить аренду, если версия строки не изменилась."""
+
+        with self.lock, self.pg_connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE public.etl_state
+                SET state = state || %(state)s,
+                    version = version + 1,
+                    lease_expires_at = now() + %(lease_seconds)s * interval '1 second'
+                WHERE partition = %(partition)s AND owner = %(owner)s AND version = %(version)s
+                RETURNING version;
+                """,
+                {
+                    "state": Json(state),
+                    "lease_seconds": self.lease_seconds,
+                    "partition": self.partition,
+                    "owner": self.owner,
+                    "version": self.version,
+                },
+            )
+            row = cursor.fetchone()
+            if row is None:
+                raise LeaseLostError(f"Партиция {self.partition} больше не принадлежит воркеру {self.owner}")
+            self.version = row[0]
+
+    def retrieve_state(self) -> dict:
+        with self.pg_connection.cursor() as cursor:
+            cursor.execute("SELECT state FROM public.etl_state WHERE partition = %s;", (self.partition,))
+            row = cursor.fetchone()
+        return row[0] if row else {}
+
+
 class State:
     """
     Класс для хранения состояния при работе с данными,
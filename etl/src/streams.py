@@ -0,0 +1,89 @@
+"""Параллельная загрузка потоков movies, persons и genres.
+
+Каждый поток работает в своём потоке выполнения со своим соединением с postgres, своим
+клиентом elastic и своими checkpoint в общем хранилище состояния. Долгий перелив фильмов
+не задерживает обновление персон и жанров. Нагрузка всех потоков на elastic ограничена
+общим BulkRateLimiter.
+"""
+from threading import Event, Lock, Thread
+
+from extract import PGExtractor
+from load import ESLoader, ETL_ALIASES
+from logger import logger
+from models import EnvSettings
+from notify import get_change_waiter
+from ratelimit import BulkRateLimiter
+from reindex import start_rebuilds
+from state import BaseStorage
+from transform import BatchTransform
+
+
+class StreamThread(Thread):
+    """Загружает один алиас каждый раз, когда в его данных появляются изменения."""
+
+    def __init__(self, alias: str, es_loader: ESLoader, on_first_pass):
+        super().__init__(name=f"stream-{alias}", daemon=True)
+        self.alias = alias
+        self.es_loader = es_loader
+        self.on_first_pass = on_first_pass
+        self.changed = Event()
+        self.changed.set()
+
+    def run(self) -> None:
+        first_pass = True
+        while True:
+            self.changed.wait()
+            self.changed.clear()
+            try:
+                self.es_loader.load_index(self.alias)
+            except Exception as exc:
+                # Поток будет перезапущен при следующем изменении или опросе.
+                logger.exception(f"Ошибка загрузки потока {self.alias}: {exc}")
+                continue
+            if first_pass:
+                first_pass = False
+                self.on_first_pass(self.alias)
+
+
+class ConcurrentStreams:
+    """Запускает потоки всех алиасов и будит их по изменениям в postgres."""
+
+    def __init__(self, storage: BaseStorage, settings: EnvSettings):
+        self.settings = settings
+        rate_limiter = BulkRateLimiter(
+            max_concurrent=settings.etl_es_bulk_threads,
+            max_bytes_per_second=settings.etl_es_max_bytes_per_second,
+        )
+        self.loaders = {}
+        for alias in ETL_ALIASES:
+            batch_transform = BatchTransform(extractor=PGExtractor(state=storage))
+            self.loaders[alias] = ESLoader(transformer=batch_transform, state=storage, rate_limiter=rate_limiter)
+        self.pending_first_pass = set(ETL_ALIASES)
+        self.initial_load = False
+        self.lock = Lock()
+
+    def on_first_pass(self, alias: str) -> None:
+        """Первый перелив завершается, когда все потоки закончили свой первый проход."""
+
+        with self.lock:
+            self.pending_first_pass.discard(alias)
+            if self.initial_load and not self.pending_first_pass:
+                self.loaders[alias].finish_initial_load()
+                self.initial_load = False
+
+    def run(self) -> None:
+        es_loader = self.loaders["movies"]
+        start_rebuilds(es_loader.elastic_connection)
+
+        self.initial_load = es_loader.initial_load_required()
+        if self.initial_load:
+            es_loader.start_initial_load()
+
+        threads = {alias: StreamThread(alias, loader, self.on_first_pass) for alias, loader in self.loaders.items()}
+        for thread in threads.values():
+            thread.start()
+
+        change_waiter = get_change_waiter(self.settings)
+        while True:
+            for alias in change_waiter.wait_for_changes():
+                threads[alias].changed.set()
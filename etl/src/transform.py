@@ -1,88 +1,169 @@
-from extract import PGExtractor
-from models import ElasticMoviesSchemaModel, ElasticPersonsSchemaModel, ElasticGenresSchemaModel
-
-
-class BatchTransform:
-    """Преобразует данные из extractor, в формат, пригодный для загрузки в elastic."""
-
-    def __init__(self, extractor: PGExtractor):
-        self.extractor = extractor
-
-    def transform_film_data_batches(self) -> list[ElasticMoviesSchemaModel]:
-
-        for modified_films_batch, offset in self.extractor.get_modified_films_batch():
-
-            transformed_batch = []
-
-            for film in modified_films_batch:
-
-                unique_actors = []
-                if film.actors:
-                    unique_actors = [
-                        dict(actors_tuple) for actors_tuple in {tuple(actors.items()) for actors in film.actors}
-                    ]
-
-                unique_writers = []
-                if film.writers:
-                    unique_writers = [
-                        dict(writers_tuple) for writers_tuple in {tuple(writers.items()) for writers in film.writers}
-                    ]
+import multiprocessing
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from typing import Iterable, Iterator
 
-                unique_directors = []
-                if film.directors:
-                    unique_directors = [
-                        dict(directors_tuple)
-                        for directors_tuple in {tuple(directors.items()) for directors in film.directors}
-                    ]
+import orjson
 
-                genres = [dict(genres_tuple) for genres_tuple in {tuple(genres.items()) for genres in film.genres}]
-
-                transformed_batch.append(
-                    ElasticMoviesSchemaModel(
-                        id=film.fw_id,
-                        imdb_rating=film.rating,
-                        genres=genres,
-                        title=film.title,
-                        description=film.description,
-                        directors=unique_directors,
-                        actors_names=[actor["name"] for actor in unique_actors],
-                        writers_names=[writer["name"] for writer in unique_writers],
-                        actors=unique_actors,
-                        writers=unique_writers,
-                    )
-                )
-
-            yield transformed_batch, offset
-
-    def transform_persons_data_batches(self) -> list[ElasticPersonsSchemaModel]:
-
-        for modified_persons_batch, persons_offset in self.extractor.get_persons_batch():
-
-            transformed_persons_batch = []
-
-            for person in modified_persons_batch:
-                transformed_persons_batch.append(
-                    ElasticPersonsSchemaModel(
-                        id=person.id,
-                        full_name=person.full_name,
-                    )
-                )
-
-            yield transformed_persons_batch, persons_offset
-
-    def transform_genre_data_batches(self) -> list[ElasticGenresSchemaModel]:
+from extract import PGExtractor
+from metrics import hooks
+from models import EnvSettings, ElasticMoviesSchemaModel, ElasticPersonsSchemaModel, ElasticGenresSchemaModel
 
-        for modified_genres_batch, genres_offset in self.extractor.get_genres_batch():
+settings = EnvSettings()
 
-            transformed_genres_batch = []
+# Батч документов, готовый к загрузке: [(id документа, сериализованный _source)].
+SerializedBatch = list[tuple[str, bytes]]
 
-            for genre in modified_genres_batch:
-                transformed_genres_batch.append(
-                    ElasticGenresSchemaModel(
-                        id=genre.id,
-                        name=genre.name,
-                        description=genre.description,
-                    )
-                )
 
-            yield transformed_genres_batch, genres_offset
+class BatchTransform:
+    """Преобразует данные из extractor, в формат, пригодный для загрузки в elastic.
+
+    Документы собираются прямо из строк выгрузки в словари _source индекса: вложенные списки
+    уже приходят из postgres без дублей. Проверка документов pydantic-моделями индексов
+    включается только в режиме отладки (validate).
+
+    При workers > 0 сборка и сериализация документов выполняются в пуле процессов; батчи
+    отдаются в порядке выгрузки, каждый со своим checkpoint.
+    """
+
+    def __init__(
+        self,
+        extractor: PGExtractor,
+        validate: bool = settings.etl_validate_documents,
+        workers: int = settings.etl_transform_workers,
+    ):
+        self.extractor = extractor
+        self.validate = validate
+        self.workers = workers
+
+    @staticmethod
+    def film_document(film) -> dict:
+        actors = film.actors or []
+        writers = film.writers or []
+        return {
+            "id": film.fw_id,
+            "imdb_rating": film.rating,
+            "genres": film.genres or [],
+            "title": film.title,
+            "description": film.description,
+            "directors": film.directors or [],
+            "actors_names": [actor["name"] for actor in actors],
+            "writers_names": [writer["name"] for writer in writers],
+            "actors": actors,
+            "writers": writers,
+        }
+
+    @staticmethod
+    def person_document(person) -> dict:
+        return {"id": person.id, "full_name": person.full_name}
+
+    @staticmethod
+    def genre_document(genre) -> dict:
+        return {"id": genre.id, "name": genre.name, "description": genre.description}
+
+    def timed_batches(self, stream: str, batches: Iterable[tuple[list, dict]]) -> Iterator[tuple[list, dict]]:
+        """Передаёт время выгрузки каждого батча в размер батча потока и в hooks."""
+
+        batch_size = self.extractor.batch_sizes[stream]
+        batches = iter(batches)
+        while True:
+            started = time.perf_counter()
+            try:
+                rows_batch, checkpoint = next(batches)
+            except StopIteration:
+                return
+            elapsed = time.perf_counter() - started
+            batch_size.observe_extract(len(rows_batch), elapsed)
+            hooks.extract(stream, len(rows_batch), elapsed)
+            yield rows_batch, checkpoint
+
+    def transform_batches(
+        self, stream: str, batches: Iterable[tuple[list, dict]]
+    ) -> Iterator[tuple[SerializedBatch, dict]]:
+        batches = self.timed_batches(stream, batches)
+        if not self.workers:
+            for rows_batch, checkpoint in batches:
+                started = time.perf_counter()
+                documents_batch = serialize_documents(stream, rows_batch, self.validate)
+                hooks.transform(stream, len(documents_batch), time.perf_counter() - started)
+                yield documents_batch, checkpoint
+            return
+
+        # Ограничиваем число батчей в пуле, чтобы выгрузка не ушла далеко вперёд загрузки.
+        executor = transform_executor(self.workers)
+        pending = deque()
+        for rows_batch, checkpoint in batches:
+            fields = rows_batch[0]._fields if rows_batch else ()
+            values = [tuple(row) for row in rows_batch]
+            pending.append((executor.submit(timed_serialize_rows, stream, fields, values, self.validate), checkpoint))
+            if len(pending) > 2 * self.workers:
+                yield self.transformed(stream, *pending.popleft())
+        while pending:
+            yield self.transformed(stream, *pending.popleft())
+
+    @staticmethod
+    def transformed(stream: str, future: Future, checkpoint: dict) -> tuple[SerializedBatch, dict]:
+        """Результат батча из пула; в hooks передаётся время его преобразования в процессе пула."""
+
+        documents_batch, elapsed = future.result()
+        hooks.transform(stream, len(documents_batch), elapsed)
+        return documents_batch, checkpoint
+
+    def transform_film_data_batches(self) -> Iterator[tuple[SerializedBatch, dict]]:
+        return self.transform_batches("films", self.extractor.get_modified_films_batch())
+
+    def transform_persons_data_batches(self) -> Iterator[tuple[SerializedBatch, dict]]:
+        return self.transform_batches("persons", self.extractor.get_persons_batch())
+
+    def transform_genre_data_batches(self) -> Iterator[tuple[SerializedBatch, dict]]:
+        return self.transform_batches("genres", self.extractor.get_genres_batch())
+
+
+DOCUMENT_BUILDERS = {
+    "films": (BatchTransform.film_document, ElasticMoviesSchemaModel),
+    "persons": (BatchTransform.person_document, ElasticPersonsSchemaModel),
+    "genres": (BatchTransform.genre_document, ElasticGenresSchemaModel),
+}
+
+
+def serialize_documents(stream: str, rows: list, validate: bool) -> SerializedBatch:
+    to_document, schema_model = DOCUMENT_BUILDERS[stream]
+    documents = [to_document(row) for row in rows]
+    if validate:
+        documents = [schema_model(**document).dict() for document in documents]
+    return [(document["id"], orjson.dumps(document)) for document in documents]
+
+
+@lru_cache
+def row_type(fields: tuple[str, ...]) -> type:
+    return namedtuple("Row", fields)
+
+
+def serialize_rows(stream: str, fields: tuple[str, ...], values: list[tuple], validate: bool) -> SerializedBatch:
+    """serialize_documents в процессе пула: namedtuple строк курсора не передаются через pickle,
+    поэтому строки приходят кортежами значений с именами полей."""
+
+    make_row = row_type(fields)._make
+    return serialize_documents(stream, [make_row(row_values) for row_values in values], validate)
+
+
+def timed_serialize_rows(
+    stream: str, fields: tuple[str, ...], values: list[tuple], validate: bool
+) -> tuple[SerializedBatch, float]:
+    """serialize_rows, дополнительно возвращающая время преобразования в секундах."""
+
+    started = time.perf_counter()
+    documents_batch = serialize_rows(stream, fields, values, validate)
+    return documents_batch, time.perf_counter() - started
+
+
+@lru_cache
+def transform_executor(workers: int) -> ProcessPoolExecutor:
+    """Общий на процесс ETL пул, в том числе для потоков перестроения индексов.
+
+    Процессы запускаются через spawn: к моменту создания пула в ETL уже работают потоки.
+    """
+
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
@@ -0,0 +1,133 @@
+"""Запуск нескольких ETL-воркеров с общим состоянием в postgres.
+
+Работа делится на партиции: потоки movies, persons и genres, а поток movies дополнительно
+может быть разбит на ETL_FILMS_PARTITIONS диапазонов id. Каждую партицию в каждый момент
+обрабатывает только тот воркер, который взял на неё аренду в таблице etl_state.
+"""
+import uuid
+from threading import Event, Thread
+
+import psycopg2
+
+from extract import POSTGRES_CONNECTION, PGExtractor
+from load import ESLoader, ETL_ALIASES
+from logger import logger
+from models import EnvSettings, PaginationMode
+from notify import get_change_waiter
+from state import LeaseLostError, PostgresStorage
+from transform import BatchTransform
+
+
+def films_id_range(part: int, parts: int) -> tuple[str, str]:
+    """Границы part-го из parts равных диапазонов пространства uuid, включительно."""
+
+    lower = part * 2**128 // parts
+    upper = (part + 1) * 2**128 // parts - 1
+    return str(uuid.UUID(int=lower)), str(uuid.UUID(int=upper))
+
+
+def etl_partitions(films_partitions: int) -> dict[str, tuple[str, dict]]:
+    """Партиции ETL: имя партиции -> (алиас индекса, дополнительные параметры PGExtractor)."""
+
+    partitions = {"persons": ("persons", {}), "genres": ("genres", {})}
+    if films_partitions == 1:
+        partitions["movies"] = ("movies", {})
+    else:
+        for part in range(films_partitions):
+            partitions[f"movies:{part}/{films_partitions}"] = (
+                "movies",
+                {"films_id_range": films_id_range(part, films_partitions)},
+            )
+    return partitions
+
+
+class LeaseHeartbeat(Thread):
+    """Продлевает аренду партиции, пока воркер её загружает.
+
+    save_state продлевает аренду только при сохранении checkpoint, а батч или update_by_query
+    может выполняться дольше ETL_LEASE_SECONDS.
+    """
+
+    def __init__(self, storage: PostgresStorage, interval: float):
+        super().__init__(name=f"lease-{storage.partition}", daemon=True)
+        self.storage = storage
+        self.interval = interval
+        self.stopped = Event()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            try:
+                if not self.storage.renew():
+                    logger.error(f"Аренда партиции {self.storage.partition} перехвачена другим воркером")
+                    return
+            except psycopg2.Error as exc:
+                logger.error(f"Не удалось продлить аренду партиции {self.storage.partition}: {exc}")
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.join()
+
+
+class PartitionWorker:
+    """Воркер, обрабатывающий все партиции, аренду на которые ему удаётся взять."""
+
+    def __init__(self, settings: EnvSettings):
+        self.settings = settings
+        self.owner = settings.etl_worker_id
+        films_partitions = settings.etl_films_partitions
+        if films_partitions > 1 and not (
+            settings.etl_pagination_mode == PaginationMode.keyset and settings.etl_films_two_phase
+        ):
+            logger.warning("Разбиение фильмов по диапазонам id работает только в двухфазном режиме keyset")
+            films_partitions = 1
+        self.partitions = etl_partitions(films_partitions)
+        self.state_connection = psycopg2.connect(**POSTGRES_CONNECTION)
+        self.loaders: dict[str, tuple[PostgresStorage, ESLoader]] = {}
+
+    def get_loader(self, partition: str) -> tuple[PostgresStorage, ESLoader]:
+        if partition not in self.loaders:
+            alias, extractor_options = self.partitions[partition]
+            storage = PostgresStorage(
+                self.state_connection, partition, owner=self.owner, lease_seconds=self.settings.etl_lease_seconds
+            )
+            pg_extractor = PGExtractor(state=storage, **extractor_options)
+            batch_transform = BatchTransform(extractor=pg_extractor)
+            # Партиция может переходить между воркерами, поэтому локальные хеши документов здесь не годятся.
+            self.loaders[partition] = storage, ESLoader(
+                transformer=batch_transform, state=storage, skip_unchanged=False
+            )
+        return self.loaders[partition]
+
+    def run_once(self, aliases: tuple[str, ...] | list[str] = ETL_ALIASES) -> None:
+        """Один проход по партициям индексов aliases: занятые другими воркерами пропускаются."""
+
+        for partition, (alias, _) in self.partitions.items():
+            if alias not in aliases:
+                continue
+            try:
+                self.load_partition(partition, alias)
+            except LeaseLostError as exc:
+                logger.error(exc)
+            except Exception as exc:
+                # Партиция будет загружена снова при следующем изменении или опросе.
+                logger.exception(f"Ошибка загрузки партиции {partition}: {exc}")
+
+    def load_partition(self, partition: str, alias: str) -> None:
+        storage, es_loader = self.get_loader(partition)
+        if not storage.acquire():
+            return
+        heartbeat = LeaseHeartbeat(storage, interval=self.settings.etl_lease_seconds / 3)
+        heartbeat.start()
+        try:
+            es_loader.load_index(alias)
+        finally:
+            heartbeat.stop()
+            storage.release()
+
+    def run(self) -> None:
+        logger.info(f"Воркер {self.owner} обрабатывает партиции: {', '.join(self.partitions)}")
+        change_waiter = get_change_waiter(self.settings)
+        changed_aliases = ETL_ALIASES
+        while True:
+            self.run_once(changed_aliases)
+            changed_aliases = change_waiter.wait_for_changes()
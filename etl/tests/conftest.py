@@ -0,0 +1,60 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+# Настройки, без которых не импортируются модули ETL; соединения в тестах не открываются.
+for name, value in {
+    "POSTGRES_DB": "movies_database",
+    "POSTGRES_USER": "app",
+    "POSTGRES_PASSWORD": "123qwe",
+    "POSTGRES_DB_HOST": "127.0.0.1",
+    "POSTGRES_DB_PORT": "5432",
+    "ES_HOST": "http://127.0.0.1",
+    "ES_PORT": "9200",
+    "ETL_PUBLISH_CHANGES": "False",
+    "ETL_SKIP_UNCHANGED": "False",
+}.items():
+    os.environ.setdefault(name, value)
+
+
+class FakeElastic:
+    """Клиент elastic, отвечающий на bulk-запросы статусами из statuses: id документа -> статусы по попыткам."""
+
+    def __init__(self, statuses: dict[str, list[int]] | None = None):
+        self.statuses = statuses or {}
+        self.requests: list[list[str]] = []
+
+    def bulk(self, operations: bytes) -> dict:
+        import orjson
+
+        lines = operations.splitlines()
+        items, ids = [], []
+        for action in lines[::2]:
+            meta = orjson.loads(action)["index"]
+            ids.append(meta["_id"])
+            attempts = self.statuses.get(meta["_id"], [])
+            status = attempts.pop(0) if attempts else 201
+            items.append({"index": {"_index": meta["_index"], "_id": meta["_id"], "status": status}})
+        self.requests.append(ids)
+        return {"took": 1, "errors": any(item["index"]["status"] >= 300 for item in items), "items": items}
+
+
+@pytest.fixture
+def fake_elastic() -> FakeElastic:
+    return FakeElastic()
+
+
+@pytest.fixture
+def es_loader(tmp_path, fake_elastic, monkeypatch):
+    import load
+    from dead_letters import DeadLetterFile
+    from state import JsonFileStorage
+
+    monkeypatch.setattr(load.time, "sleep", lambda seconds: None)
+    loader = load.ESLoader(transformer=None, state=JsonFileStorage(str(tmp_path / "state.json")), thread_count=1)
+    loader.elastic_connection = fake_elastic
+    loader.dead_letters = DeadLetterFile(str(tmp_path / "dead_letters.jsonl"))
+    return loader
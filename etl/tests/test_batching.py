@@ -0,0 +1,58 @@
+from batching import AdaptiveBatchSize
+
+
+def make_batch_size(**options) -> AdaptiveBatchSize:
+    params = {"initial": 100, "min_size": 10, "max_size": 1000, "target_bytes": 100_000, "target_latency": 1.0}
+    return AdaptiveBatchSize("films", **(params | options))
+
+
+def test_grows_at_most_twice_per_step():
+    batch_size = make_batch_size()
+
+    batch_size.observe_load(docs=100, payload_bytes=1000, seconds=0.01)
+
+    assert batch_size.value == 200
+
+
+def test_shrinks_to_fit_target_bytes():
+    batch_size = make_batch_size()
+
+    batch_size.observe_load(docs=100, payload_bytes=150_000, seconds=0.01)
+
+    assert batch_size.value == 66
+
+
+def test_shrinks_to_fit_target_latency():
+    batch_size = make_batch_size()
+
+    batch_size.observe_extract(rows=100, seconds=1.5)
+
+    assert batch_size.value == 66
+
+
+def test_halves_on_rejections():
+    batch_size = make_batch_size()
+
+    batch_size.observe_load(docs=100, payload_bytes=1000, seconds=0.01, rejected=1)
+
+    assert batch_size.value == 50
+
+
+def test_stays_within_limits():
+    batch_size = make_batch_size(initial=800)
+    for _ in range(5):
+        batch_size.observe_load(docs=100, payload_bytes=100, seconds=0.001)
+    assert batch_size.value == 1000
+
+    for _ in range(10):
+        batch_size.observe_load(docs=1, payload_bytes=1, rejected=1)
+    assert batch_size.value == 10
+
+
+def test_not_adaptive_keeps_initial_size():
+    batch_size = make_batch_size(adaptive=False)
+
+    batch_size.observe_extract(rows=100, seconds=10.0)
+    batch_size.observe_load(docs=100, payload_bytes=10**7, seconds=10.0, rejected=1)
+
+    assert batch_size.value == 100
@@ -0,0 +1,90 @@
+import orjson
+import pytest
+
+from batching import AdaptiveBatchSize
+
+
+def operation(doc_id: str, index: str = "movies") -> bytes:
+    action = orjson.dumps({"index": {"_index": index, "_id": doc_id}})
+    return action + b"\n" + orjson.dumps({"id": doc_id}) + b"\n"
+
+
+def dead_letters(es_loader) -> list[dict]:
+    try:
+        with open(es_loader.dead_letters.file_path, "rb") as file:
+            return [orjson.loads(line) for line in file]
+    except FileNotFoundError:
+        return []
+
+
+def test_send_bulk_retries_overloaded_documents_only(es_loader, fake_elastic):
+    fake_elastic.statuses = {"2": [429, 503, 201]}
+
+    items = es_loader.send_bulk([operation("1"), operation("2"), operation("3")])
+
+    assert fake_elastic.requests == [["1", "2", "3"], ["2"], ["2"]]
+    assert [item["index"]["status"] for item in items] == [201, 201, 201]
+    assert dead_letters(es_loader) == []
+
+
+def test_send_bulk_dead_letters_rejected_documents(es_loader, fake_elastic):
+    fake_elastic.statuses = {"2": [400]}
+
+    items = es_loader.send_bulk([operation("1"), operation("2")])
+
+    assert fake_elastic.requests == [["1", "2"]]
+    assert [item["index"]["status"] for item in items] == [201, 400]
+    [record] = dead_letters(es_loader)
+    assert (record["id"], record["status"], record["document"]) == ("2", 400, {"id": "2"})
+
+
+def test_send_bulk_halves_batch_size_on_overload(es_loader, fake_elastic):
+    fake_elastic.statuses = {"1": [429]}
+    batch_size = AdaptiveBatchSize("films", 100, 10, 1000, target_bytes=10**6, target_latency=1.0)
+
+    es_loader.send_bulk([operation("1")], batch_size)
+
+    assert batch_size.value == 50
+
+
+def test_bulk_to_elastic_saves_checkpoints_in_order(es_loader, fake_elastic):
+    es_loader.chunk_bytes = 1
+    es_loader.thread_count = 2
+    saved = []
+    es_loader.state.save_state = saved.append
+    batches = [
+        ([("1", b'{"id": "1"}'), ("2", b'{"id": "2"}')], {"films_last_key": ["2022-01-01", "2"]}),
+        ([], {"films_last_key": ["2022-01-02", "2"]}),
+        ([("3", b'{"id": "3"}')], {"films_last_key": ["2022-01-03", "3"]}),
+    ]
+
+    es_loader.bulk_to_elastic("movies", iter(batches))
+
+    assert sum(fake_elastic.requests, []) == ["1", "2", "3"]
+    assert saved == [checkpoint for _, checkpoint in batches]
+
+
+def test_bulk_to_elastic_saves_checkpoint_after_dead_letter(es_loader, fake_elastic):
+    fake_elastic.statuses = {"1": [400]}
+    saved = []
+    es_loader.state.save_state = saved.append
+    batches = [([("1", b'{"id": "1"}'), ("2", b'{"id": "2"}')], {"films_last_key": ["2022-01-01", "2"]})]
+
+    es_loader.bulk_to_elastic("movies", iter(batches))
+
+    assert saved == [{"films_last_key": ["2022-01-01", "2"]}]
+    assert [record["id"] for record in dead_letters(es_loader)] == ["1"]
+
+
+def test_bulk_to_elastic_does_not_save_checkpoint_of_unsent_batch(es_loader, fake_elastic):
+    saved = []
+    es_loader.state.save_state = saved.append
+
+    def batches():
+        yield [("1", b'{"id": "1"}')], {"films_last_key": ["2022-01-01", "1"]}
+        raise ConnectionError("postgres is down")
+
+    with pytest.raises(ConnectionError):
+        es_loader.bulk_to_elastic("movies", batches())
+
+    assert saved == []
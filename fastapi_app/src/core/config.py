@@ -17,7 +17,29 @@ class Settings(BaseSettings):
 
     redis_host: str = Field(env="REDIS_HOST", default="redis://127.0.0.1")
     redis_port: int = Field(env="REDIS_PORT", default=6379)
+    # Кеш сбрасывается по изменениям, которые публикует ETL; TTL ограничивает устаревание, если событие потерялось.
     redis_cache_expire_in_seconds: int = Field(env="REDIS_CACHE_EXPIRE_IN_SECONDS", default=300)
+    # TTL в Redis по префиксам ключей, например {"genres": 3600}; остальные ключи - REDIS_CACHE_EXPIRE_IN_SECONDS.
+    redis_cache_prefix_ttls: dict[str, int] = Field(env="REDIS_CACHE_PREFIX_TTLS", default={})
+    # После этой доли TTL запись считается устаревшей: отдаётся сразу и обновляется в фоне (1 - без обновления).
+    redis_cache_soft_ttl_ratio: float = Field(env="REDIS_CACHE_SOFT_TTL_RATIO", default=0.5)
+    # Насколько заранее обновлять записи, загрузка которых занимает много времени (XFetch, 0 - ровно по soft TTL).
+    redis_cache_xfetch_beta: float = Field(env="REDIS_CACHE_XFETCH_BETA", default=1.0)
+    # Блокировка в Redis, под которой один воркер загружает ключ из elastic при промахе (0 - без блокировки),
+    # и как часто остальные воркеры проверяют, появился ли ключ в кеше.
+    redis_cache_lock_ms: int = Field(env="REDIS_CACHE_LOCK_MS", default=2000)
+    redis_cache_lock_poll_ms: int = Field(env="REDIS_CACHE_LOCK_POLL_MS", default=25)
+
+    # In-process кеш перед Redis. У каждого воркера своя копия, которую не обновляют ни фоновые обновления
+    # в других воркерах, ни потерянные события ETL, поэтому TTL короткий.
+    local_cache_max_size: int = Field(env="LOCAL_CACHE_MAX_SIZE", default=10000)
+    local_cache_expire_in_seconds: int = Field(env="LOCAL_CACHE_EXPIRE_IN_SECONDS", default=5)
+    local_cache_prefix_ttls: dict[str, int] = Field(env="LOCAL_CACHE_PREFIX_TTLS", default={})
+
+    # Redis stream, в который ETL публикует id записанных в elastic документов, и сколько ждать
+    # новых событий за один запрос.
+    cache_invalidation_stream: str = Field(env="CACHE_INVALIDATION_STREAM", default="etl:changes")
+    cache_invalidation_block_ms: int = Field(env="CACHE_INVALIDATION_BLOCK_MS", default=5000)
 
     @property
     def es_url(self):
@@ -0,0 +1,63 @@
+import time
+from collections import Counter, OrderedDict
+from typing import Any
+
+from core.config import config
+
+
+def prefix_ttl(ttls: dict[str, int], key: str, default: int) -> int:
+    """TTL ключа по самому длинному подходящему префиксу из ttls."""
+
+    matched = max((prefix for prefix in ttls if key.startswith(prefix)), key=len, default=None)
+    return ttls[matched] if matched is not None else default
+
+
+class LocalCache:
+    """In-process LRU-кеш с TTL перед Redis, общий для всех сервисов воркера."""
+
+    def __init__(self, max_size: int, ttl: int, prefix_ttls: dict[str, int]):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.prefix_ttls = prefix_ttls
+        self.items: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Any | None:
+        item = self.items.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self.items[key]
+            return None
+        self.items.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, max_ttl: float | None = None) -> None:
+        """Кладёт value на TTL по префиксу ключа, но не дольше max_ttl секунд."""
+
+        ttl = prefix_ttl(self.prefix_ttls, key, self.ttl)
+        if max_ttl is not None:
+            ttl = min(ttl, max_ttl)
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        self.items[key] = (time.monotonic() + ttl, value)
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self.items.pop(key, None)
+
+    def delete_prefix(self, prefix: str) -> None:
+        for key in [key for key in self.items if key.startswith(prefix)]:
+            del self.items[key]
+
+
+local_cache = LocalCache(
+    max_size=config.local_cache_max_size,
+    ttl=config.local_cache_expire_in_seconds,
+    prefix_ttls=config.local_cache_prefix_ttls,
+)
+
+# Попадания и промахи по уровням: ("local" | "redis", "hit" | "miss") -> количество.
+cache_stats: Counter[tuple[str, str]] = Counter()
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 
 import aioredis
@@ -10,6 +11,7 @@ from api.v1 import films, genres, persons
 from core.config import config
 from core.logger import LOGGING
 from db import elastic, redis
+from services.invalidation import CacheInvalidator
 
 app = FastAPI(
     title=config.project_name,
@@ -23,10 +25,12 @@ app = FastAPI(
 async def startup():
     redis.redis = await aioredis.from_url(config.redis_url)
     elastic.es = AsyncElasticsearch(hosts=[f"{config.es_host}:{config.es_port}"])
+    app.state.cache_invalidator = asyncio.create_task(CacheInvalidator(redis.redis).run())
 
 
 @app.on_event("shutdown")
 async def shutdown():
+    app.state.cache_invalidator.cancel()
     await redis.redis.close()
     await elastic.es.close()
 
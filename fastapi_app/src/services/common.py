@@ -1,25 +1,198 @@
-from typing import Type, TypeVar
+import asyncio
+import logging
+import math
+import random
+import time
+import uuid
+from typing import Awaitable, Callable, Type, TypeVar
 
 from aioredis import Redis
 
 from core.config import config
+from db.local_cache import cache_stats, local_cache, prefix_ttl
 from models.common import Base
 
 BaseTypeVar = TypeVar("BaseTypeVar", bound=Base)
 
+logger = logging.getLogger(__name__)
+
+# Снимает блокировку, только если она всё ещё принадлежит тому, кто её взял.
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# Загрузки из elastic, выполняемые в этом воркере: ключ кеша -> задача загрузки.
+in_flight: dict[str, asyncio.Task] = {}
+# Фоновые обновления устаревших ключей отдельно от загрузок при промахе: обновление, пропущенное из-за
+# блокировки другого воркера, возвращает None, и ожидающий его промах ответил бы 404.
+in_flight_refreshes: dict[str, asyncio.Task] = {}
+
 
 class RedisService:
+    """Двухуровневый кеш: in-process local_cache (L1) перед Redis (L2).
+
+    В L1 хранятся уже разобранные модели, поэтому горячие ключи не требуют ни запроса в Redis, ни parse_raw.
+    При промахе _get_or_load загружает ключ из elastic один раз: параллельные запросы того же ключа в воркере
+    ждут общую загрузку, а воркеры между собой договариваются через короткую блокировку в Redis.
+
+    Запись в Redis живёт hard TTL, а после soft TTL (доля redis_cache_soft_ttl_ratio от hard TTL) считается
+    устаревшей: она по-прежнему отдаётся сразу, а в фоне загружается заново. Момент обновления выбирается
+    вероятностно (XFetch): чем дольше загрузка и ближе soft TTL, тем вероятнее обновление, поэтому горячие
+    ключи обновляются заранее и не истекают одновременно. В L1 запись хранится не дольше soft TTL, чтобы
+    горячий ключ, который читается только из L1, тоже проверялся в Redis и обновлялся.
+    """
+
     def __init__(self, redis: Redis):
         self.redis = redis
+        self.local_cache = local_cache
         self.cache_expire_in_seconds = config.redis_cache_expire_in_seconds
+        self.cache_prefix_ttls = config.redis_cache_prefix_ttls
+        self.cache_soft_ttl_ratio = config.redis_cache_soft_ttl_ratio
+        self.cache_xfetch_beta = config.redis_cache_xfetch_beta
+        self.cache_lock_ms = config.redis_cache_lock_ms
+        self.cache_lock_poll_ms = config.redis_cache_lock_poll_ms
+
+    async def _put_to_cache(self, key: str, obj: BaseTypeVar, load_seconds: float = 0.0):
+        """Кладёт obj в оба уровня. В Redis перед json пишется строка "<окончание soft TTL> <время загрузки>"."""
 
-    async def _put_to_cache(self, key: str, obj: BaseTypeVar):
-        await self.redis.set(key, obj.json(), ex=self.cache_expire_in_seconds)
+        ttl = prefix_ttl(self.cache_prefix_ttls, key, self.cache_expire_in_seconds)
+        soft_ttl = ttl * self.cache_soft_ttl_ratio
+        soft_expires_at = time.time() + soft_ttl
+        # Из L1 объект отдаётся без проверки soft TTL, поэтому после него L1 должен обратиться к Redis.
+        self.local_cache.set(key, obj, max_ttl=soft_ttl)
+        header = f"{soft_expires_at:.3f} {load_seconds:.4f}\n".encode()
+        await self.redis.set(key, header + obj.json().encode(), ex=ttl)
 
     async def _get_from_cache(self, key: str, model: Type[BaseTypeVar]) -> BaseTypeVar | None:
+        obj = self._get_from_local_cache(key, model)
+        if obj:
+            return obj
+
+        obj, _ = await self._get_from_redis(key, model)
+        return obj
+
+    def _get_from_local_cache(self, key: str, model: Type[BaseTypeVar]) -> BaseTypeVar | None:
+        obj = self.local_cache.get(key)
+        if isinstance(obj, model):
+            cache_stats["local", "hit"] += 1
+            return obj
+        cache_stats["local", "miss"] += 1
+        return None
+
+    async def _get_from_redis(self, key: str, model: Type[BaseTypeVar]) -> tuple[BaseTypeVar | None, bool]:
+        """Объект из Redis и признак того, что его пора обновить в фоне."""
+
         data = await self.redis.get(key)
         if not data:
-            return None
+            cache_stats["redis", "miss"] += 1
+            return None, False
+        cache_stats["redis", "hit"] += 1
+
+        refresh = False
+        local_ttl = None
+        if not data.startswith(b"{"):
+            header, _, data = data.partition(b"\n")
+            soft_expires_at, load_seconds = map(float, header.split())
+            refresh = self._should_refresh(soft_expires_at, load_seconds)
+            local_ttl = soft_expires_at - time.time()
 
         parsed_data = model.parse_raw(data)
-        return parsed_data
+        self.local_cache.set(key, parsed_data, max_ttl=local_ttl)
+        return parsed_data, refresh
+
+    def _should_refresh(self, soft_expires_at: float, load_seconds: float) -> bool:
+        """XFetch: обновить, если now - load_seconds * beta * ln(rand) >= soft_expires_at."""
+
+        early = -load_seconds * self.cache_xfetch_beta * math.log(1 - random.random())
+        return time.time() + early >= soft_expires_at
+
+    async def _get_or_load(
+        self, key: str, model: Type[BaseTypeVar], load: Callable[[], Awaitable[BaseTypeVar | None]]
+    ) -> BaseTypeVar | None:
+        """Объект из кеша, а при промахе - из load(), выполняемой одновременно не больше одного раза на ключ.
+
+        Устаревший объект отдаётся сразу, а load() для него запускается в фоне.
+        """
+
+        obj = self._get_from_local_cache(key, model)
+        if obj:
+            return obj
+
+        obj, refresh = await self._get_from_redis(key, model)
+        if obj:
+            if refresh and key not in in_flight and key not in in_flight_refreshes:
+                self._start_load(key, model, load, refresh=True)
+            return obj
+
+        task = in_flight.get(key) or self._start_load(key, model, load)
+        # Отмена одного запроса не должна прерывать загрузку, которую ждут остальные.
+        return await asyncio.shield(task)
+
+    def _start_load(
+        self,
+        key: str,
+        model: Type[BaseTypeVar],
+        load: Callable[[], Awaitable[BaseTypeVar | None]],
+        refresh: bool = False,
+    ) -> asyncio.Task:
+        tasks = in_flight_refreshes if refresh else in_flight
+        task = asyncio.create_task(self._load_with_lock(key, model, load, refresh))
+        tasks[key] = task
+
+        def done(finished: asyncio.Task) -> None:
+            tasks.pop(key, None)
+            # Результат фонового обновления никто не ждёт: ошибку нужно хотя бы записать в лог.
+            if refresh and not finished.cancelled() and finished.exception():
+                logger.error(f"Не удалось обновить ключ кеша {key}", exc_info=finished.exception())
+
+        task.add_done_callback(done)
+        return task
+
+    async def _load_with_lock(
+        self,
+        key: str,
+        model: Type[BaseTypeVar],
+        load: Callable[[], Awaitable[BaseTypeVar | None]],
+        refresh: bool = False,
+    ) -> BaseTypeVar | None:
+        """Загружает ключ под блокировкой в Redis; пока её держит другой воркер, ждёт его результата в кеше.
+
+        Если блокировка не снята за redis_cache_lock_ms (воркер завис или упал), загружает ключ сам.
+        Фоновое обновление (refresh) при занятой блокировке пропускается: ключ уже обновляет другой воркер.
+        """
+
+        if not self.cache_lock_ms:
+            return await self._load_to_cache(key, load)
+
+        lock_key = f"lock::{key}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.cache_lock_ms / 1000
+        while True:
+            if await self.redis.set(lock_key, token, nx=True, px=self.cache_lock_ms):
+                try:
+                    return await self._load_to_cache(key, load)
+                finally:
+                    await self.redis.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+            if refresh:
+                return None
+
+            await asyncio.sleep(self.cache_lock_poll_ms / 1000)
+            obj, _ = await self._get_from_redis(key, model)
+            if obj:
+                return obj
+            if time.monotonic() > deadline:
+                return await self._load_to_cache(key, load)
+
+    async def _load_to_cache(self, key: str, load: Callable[[], Awaitable[BaseTypeVar | None]]) -> BaseTypeVar | None:
+        started = time.perf_counter()
+        obj = await load()
+        if obj:
+            await self._put_to_cache(key, obj, load_seconds=time.perf_counter() - started)
+        else:
+            # Объект удалён: устаревшая запись, которую обновляли в фоне, больше не должна отдаваться.
+            self.local_cache.delete(key)
+            await self.redis.delete(key)
+        return obj
@@ -9,6 +9,7 @@ from db.elastic import get_elastic
 from db.redis import get_redis
 from models.es_models import Film, Films
 from services.common import RedisService
+from services.invalidation import versioned_key
 
 
 class ApiSortOptions(str, Enum):
@@ -29,14 +30,7 @@ class FilmService(RedisService):
 
     async def get_film(self, film_id: str) -> Film | None:
         redis_key = f"movies::film_id::{film_id}"
-        film = await self._get_from_cache(redis_key, Film)
-        if not film:
-            film = await self._get_film_from_elastic(film_id)
-            if not film:
-                return None
-            await self._put_to_cache(redis_key, film)
-
-        return film
+        return await self._get_or_load(redis_key, Film, lambda: self._get_film_from_elastic(film_id))
 
     async def get_films(
         self,
@@ -49,16 +43,11 @@ class FilmService(RedisService):
     ) -> Films | None:
         redis_key = f"movies::search_str::{search_str}::sort::{sort}::filter_genre::{filter_genre}::filter_person" \
                     f"::{filter_person}::page_size::{page_size}::page_number::{page_number}"
-        films = await self._get_from_cache(redis_key, Films)
-        if not films:
-            films = await self._get_films_from_elastic(
-                search_str, sort, filter_genre, filter_person, page_size, page_number
-            )
-            if not films:
-                return None
-
-            await self._put_to_cache(redis_key, films)
-        return films
+        return await self._get_or_load(
+            versioned_key(redis_key, "movies"),
+            Films,
+            lambda: self._get_films_from_elastic(search_str, sort, filter_genre, filter_person, page_size, page_number),
+        )
 
     async def _get_film_from_elastic(self, film_id: str) -> Film | None:
         try:
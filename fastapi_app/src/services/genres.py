@@ -8,6 +8,7 @@ from db.elastic import get_elastic
 from db.redis import get_redis
 from models.api_models import GenreDescripted, GenresDescripted
 from services.common import RedisService
+from services.invalidation import versioned_key
 
 
 class GenresService(RedisService):
@@ -17,30 +18,24 @@ class GenresService(RedisService):
 
     async def get_by_id(self, genre_id: str) -> GenreDescripted | None:
         redis_key = f"genres::genre_id::{genre_id}"
-        genre = await self._get_from_cache(key=redis_key, model=GenreDescripted)
-        if not genre:
-            genre = await self._get_genre_from_elastic(genre_id)
-            if not genre:
-                return None
-            await self._put_to_cache(key=redis_key, obj=genre)
-
-        return genre
+        return await self._get_or_load(
+            key=redis_key, model=GenreDescripted, load=lambda: self._get_genre_from_elastic(genre_id)
+        )
 
     async def get_list(self) -> GenresDescripted | None:
-        genres = await self._get_from_cache(key="genres", model=GenresDescripted)
-
-        if not genres:
-            resp = await self.elastic.search(index="genres", size=999)
-            hits = resp.body.get("hits", {}).get("hits", [])
-            genres = [GenreDescripted(**hit["_source"]) for hit in hits]
+        return await self._get_or_load(
+            key=versioned_key("genres", "genres"), model=GenresDescripted, load=self._get_genres_from_elastic
+        )
 
-            if not genres:
-                return
+    async def _get_genres_from_elastic(self) -> GenresDescripted | None:
+        resp = await self.elastic.search(index="genres", size=999)
+        hits = resp.body.get("hits", {}).get("hits", [])
+        genres = [GenreDescripted(**hit["_source"]) for hit in hits]
 
-            genres = GenresDescripted(genres=genres)
-            await self._put_to_cache(key="genres", obj=genres)
+        if not genres:
+            return
 
-        return genres
+        return GenresDescripted(genres=genres)
 
     async def _get_genre_from_elastic(self, genre_id: str) -> GenreDescripted | None:
         try:
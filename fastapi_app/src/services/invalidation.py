@@ -0,0 +1,113 @@
+import asyncio
+import logging
+
+import orjson
+from aioredis import Redis
+
+from core.config import config
+from db.local_cache import local_cache
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY_PREFIX = "cache_generation::"
+
+# Поколения индексов: ETL увеличивает поколение индекса при каждой записи в него.
+generations: dict[str, int] = {}
+
+# Ключи объектов, которые сбрасываются по id изменённых документов индекса:
+# индекс -> [(шаблон ключа, индексы, от поколения которых зависит ключ)].
+PURGE_KEYS: dict[str, list[tuple[str, tuple[str, ...]]]] = {
+    "movies": [("movies::film_id::{id}", ())],
+    "persons": [("persons::person_id::{id}", ("movies",)), ("movies::person_id::{id}", ("movies",))],
+    "genres": [("genres::genre_id::{id}", ())],
+}
+
+UNLINK_CHUNK_SIZE = 1000
+
+
+def versioned_key(key: str, *indexes: str) -> str:
+    """Ключ кеша, зависящий от поколений indexes: после записи ETL в любой из них ключ меняется.
+
+    Так сбрасываются списки и поиск, состав которых по id изменённых документов не определить.
+    Записи прежних поколений больше не читаются и истекают по TTL.
+    """
+
+    return key + "".join(f"::{index}_gen::{generations.get(index, 0)}" for index in indexes)
+
+
+class CacheInvalidator:
+    """Сбрасывает кеш по изменениям, которые ETL публикует в Redis stream после записи в elastic.
+
+    Событие stream: index - алиас индекса, generation - новое поколение индекса, ids - json со списком
+    id записанных документов или null, если изменённые документы неизвестны (тогда сбрасываются все
+    объекты индекса). Запускается в каждом воркере: in-process кеш у каждого свой.
+    """
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self.stream = config.cache_invalidation_stream
+        self.block_ms = config.cache_invalidation_block_ms
+        self.last_id: str | bytes | None = None
+
+    async def run(self):
+        while True:
+            try:
+                if self.last_id is None:
+                    await self._load_generations()
+                await self._read_events()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка чтения изменений ETL, кеш сбрасывается только по TTL")
+                await asyncio.sleep(1)
+
+    async def _load_generations(self):
+        # Сначала последнее событие, затем поколения: события, опубликованные между ними, прочитаются из stream.
+        last_events = await self.redis.xrevrange(self.stream, count=1)
+        last_id = last_events[0][0] if last_events else "0-0"
+        values = await self.redis.mget([f"{GENERATION_KEY_PREFIX}{index}" for index in PURGE_KEYS])
+        for index, value in zip(PURGE_KEYS, values):
+            if value:
+                generations[index] = max(generations.get(index, 0), int(value))
+        self.last_id = last_id
+
+    async def _read_events(self):
+        while True:
+            response = await self.redis.xread({self.stream: self.last_id}, count=100, block=self.block_ms)
+            for _, events in response or []:
+                for event_id, fields in events:
+                    await self._apply(fields)
+                    self.last_id = event_id
+
+    async def _apply(self, fields: dict[bytes, bytes]):
+        index = fields[b"index"].decode()
+        generations[index] = max(generations.get(index, 0), int(fields[b"generation"]))
+        ids = orjson.loads(fields[b"ids"])
+        if ids is None:
+            await self._purge_index(index)
+        else:
+            await self._purge_ids(index, ids)
+
+    async def _purge_ids(self, index: str, ids: list[str]):
+        keys = [
+            versioned_key(template.format(id=object_id), *indexes)
+            for template, indexes in PURGE_KEYS.get(index, [])
+            for object_id in ids
+        ]
+        for key in keys:
+            local_cache.delete(key)
+        for start in range(0, len(keys), UNLINK_CHUNK_SIZE):
+            await self.redis.unlink(*keys[start : start + UNLINK_CHUNK_SIZE])
+
+    async def _purge_index(self, index: str):
+        for template, _ in PURGE_KEYS.get(index, []):
+            prefix = template.partition("{id}")[0]
+            local_cache.delete_prefix(prefix)
+            keys = []
+            async for key in self.redis.scan_iter(match=f"{prefix}*", count=UNLINK_CHUNK_SIZE):
+                keys.append(key)
+                if len(keys) >= UNLINK_CHUNK_SIZE:
+                    await self.redis.unlink(*keys)
+                    keys.clear()
+            if keys:
+                await self.redis.unlink(*keys)
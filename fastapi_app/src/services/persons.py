@@ -8,6 +8,7 @@ from db.elastic import get_elastic
 from db.redis import get_redis
 from models.api_models import PersonWithFilms, PersonRoleInFilms, PersonSearch, FilmRated, FilmsByPerson
 from services.common import RedisService
+from services.invalidation import versioned_key
 
 
 class PersonsService(RedisService):
@@ -16,23 +17,19 @@ class PersonsService(RedisService):
         self.elastic = elastic
 
     async def get_by_id(self, person_id: str) -> PersonWithFilms | None:
-        redis_key = f"persons::person_id::{person_id}"
-        person = await self._get_from_cache(key=redis_key, model=PersonWithFilms)
-        if not person:
-            person = await self._get_person_with_films_from_elastic(person_id)
-            if not person:
-                return None
-            await self._put_to_cache(key=redis_key, obj=person)
-
-        return person
+        # Персона сбрасывается по id, а вместе с фильмами - по поколению movies.
+        redis_key = versioned_key(f"persons::person_id::{person_id}", "movies")
+        return await self._get_or_load(
+            key=redis_key, model=PersonWithFilms, load=lambda: self._get_person_with_films_from_elastic(person_id)
+        )
 
     async def get_film_detail_by_person(self, person_id: str) -> FilmsByPerson | None:
-        redis_key = f"movies::person_id::{person_id}"
-        films_rated = await self._get_from_cache(key=redis_key, model=FilmsByPerson)
-
-        if films_rated:
-            return FilmsByPerson(films=films_rated.films)
+        redis_key = versioned_key(f"movies::person_id::{person_id}", "movies")
+        return await self._get_or_load(
+            key=redis_key, model=FilmsByPerson, load=lambda: self._get_films_by_person_from_elastic(person_id)
+        )
 
+    async def _get_films_by_person_from_elastic(self, person_id: str) -> FilmsByPerson | None:
         person_with_films = await self._get_film_details_by_person_id(person_id=person_id)
 
         if not person_with_films:
@@ -46,102 +43,84 @@ class PersonsService(RedisService):
         films_rated = [seen.add(film.id) or film for film in films if film.id not in seen]
 
         if films_rated:
-            films_rated_obj = FilmsByPerson(films=films_rated)
-            await self._put_to_cache(key=redis_key, obj=films_rated_obj)
-            return films_rated_obj
+            return FilmsByPerson(films=films_rated)
 
         return
 
     async def search(self, search_str: str, page_size: int = 50, page_number: int = 1) -> PersonSearch | None:
-        redis_key = f"persons::search_str::{search_str}::page_size::{page_size}::page_number::{page_number}"
-        person = await self._get_from_cache(key=redis_key, model=PersonSearch)
-        if not person:
-            person = await self._get_films_by_person_full_name_from_elastic(
+        redis_key = versioned_key(
+            f"persons::search_str::{search_str}::page_size::{page_size}::page_number::{page_number}",
+            "persons",
+            "movies",
+        )
+        return await self._get_or_load(
+            key=redis_key,
+            model=PersonSearch,
+            load=lambda: self._get_films_by_person_full_name_from_elastic(
                 search_str=search_str,
                 page_size=page_size,
                 page_number=page_number,
-            )
-            if not person:
-                return None
-            await self._put_to_cache(key=redis_key, obj=person)
-
-        return person
+            ),
+        )
 
     async def _get_person_role_in_films(self, person_id: str) -> list[PersonRoleInFilms]:
-        films_doc = await self.elastic.search(
-            index="movies",
-            body={
-                "query": {
-                    "bool": {
-                        "should": [
-                            {
-                                "nested": {
-                                    "path": "directors",
-                                    "query": {"bool": {"should": {"term": {"directors.id": person_id}}}},
-                                }
-                            },
-                            {
-                                "nested": {
-                                    "path": "writers",
-                                    "query": {"bool": {"should": {"term": {"writers.id": person_id}}}},
-                                }
-                            },
-                            {
-                                "nested": {
-                                    "path": "actors",
-                                    "query": {"bool": {"should": {"term": {"actors.id": person_id}}}},
-                                }
-                            },
-                        ]
-                    }
+        films_doc = await self.elastic.search(index="movies", body=self._person_films_search(person_id))
+        return self._person_roles_from_hits(person_id, films_doc.body.get("hits", {}).get("hits", []))
+
+    async def _get_persons_roles_in_films(self, person_ids: list[str]) -> dict[str, list[PersonRoleInFilms]]:
+        """Роли всех персон страницы одним msearch вместо отдельного запроса на каждую персону."""
+
+        if not person_ids:
+            return {}
+
+        searches = []
+        for person_id in person_ids:
+            searches.extend(({"index": "movies"}, self._person_films_search(person_id)))
+        films_docs = await self.elastic.msearch(searches=searches)
+
+        roles = {}
+        for person_id, response in zip(person_ids, films_docs.body["responses"]):
+            if "error" in response:
+                raise RuntimeError(f"Ошибка поиска фильмов персоны {person_id}: {response['error']}")
+            roles[person_id] = self._person_roles_from_hits(person_id, response.get("hits", {}).get("hits", []))
+        return roles
+
+    @staticmethod
+    def _person_films_search(person_id: str) -> dict:
+        return {
+            "query": {
+                "bool": {
+                    "should": [
+                        {
+                            "nested": {
+                                "path": role_field,
+                                "query": {"bool": {"should": {"term": {f"{role_field}.id": person_id}}}},
+                            }
+                        }
+                        for role_field in ("directors", "writers", "actors")
+                    ]
                 }
             },
-            size=999,
-        )
-
-        hits_list = films_doc.body.get("hits", {}).get("hits", [])
-        actor_films_details = []
-        writer_films_details = []
-        director_films_details = []
+            # Для ролей нужны только данные фильма и id персон, а не документ целиком.
+            "_source": ["id", "title", "imdb_rating", "actors.id", "writers.id", "directors.id"],
+            "size": 999,
+        }
+
+    @staticmethod
+    def _person_roles_from_hits(person_id: str, hits_list: list[dict]) -> list[PersonRoleInFilms]:
+        films_details = {"actor": [], "writer": [], "director": []}
         for hit in hits_list:
             source = hit["_source"]
-            for actor_in_film in source["actors"]:
-                if actor_in_film["id"] == person_id:
-                    actor_films_details.append(
-                        FilmRated(
-                            id=source["id"],
-                            title=source["title"],
-                            imdb_rating=source["imdb_rating"],
-                        )
-                    )
-            for writer_in_film in source["writers"]:
-                if writer_in_film["id"] == person_id:
-                    writer_films_details.append(
-                        FilmRated(
-                            id=source["id"],
-                            title=source["title"],
-                            imdb_rating=source["imdb_rating"],
-                        )
-                    )
-            for director_in_film in source["directors"]:
-                if director_in_film["id"] == person_id:
-                    director_films_details.append(
-                        FilmRated(
-                            id=source["id"],
-                            title=source["title"],
-                            imdb_rating=source["imdb_rating"],
-                        )
-                    )
-
-        roles = []
-        if actor_films_details:
-            roles.append(PersonRoleInFilms(role="actor", films_details=actor_films_details))
-        if writer_films_details:
-            roles.append(PersonRoleInFilms(role="writer", films_details=writer_films_details))
-        if director_films_details:
-            roles.append(PersonRoleInFilms(role="director", films_details=director_films_details))
+            film = FilmRated(id=source["id"], title=source["title"], imdb_rating=source.get("imdb_rating"))
+            for role, role_field in (("actor", "actors"), ("writer", "writers"), ("director", "directors")):
+                if any(person["id"] == person_id for person in source.get(role_field) or []):
+                    films_details[role].append(film)
 
-        return roles
+        return [
+            PersonRoleInFilms(role=role, films_details=role_films_details)
+            for role, role_films_details in films_details.items()
+            if role_films_details
+        ]
 
     async def _get_film_details_by_person_id(self, person_id: str) -> PersonWithFilms | None:
         person_name = await self._get_person_name_from_elastic(person_id=person_id)
@@ -166,13 +145,15 @@ class PersonsService(RedisService):
 
         persons_hit_list = persons_doc.body.get("hits", {}).get("hits", [])
         total = persons_doc.body.get("hits", {})["total"]["value"]
-        persons_with_films = []
-
-        for person_hit in persons_hit_list:
-            person_id = person_hit["_source"]["id"]
-            person_name = person_hit["_source"]["full_name"]
-            roles = await self._get_person_role_in_films(person_id=person_id)
-            persons_with_films.append(PersonWithFilms(id=person_id, roles=roles, full_name=person_name))
+        roles = await self._get_persons_roles_in_films([hit["_source"]["id"] for hit in persons_hit_list])
+        persons_with_films = [
+            PersonWithFilms(
+                id=person_hit["_source"]["id"],
+                roles=roles[person_hit["_source"]["id"]],
+                full_name=person_hit["_source"]["full_name"],
+            )
+            for person_hit in persons_hit_list
+        ]
 
         if not persons_with_films:
             return
@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+
+class FakeRedis:
+    """Redis в памяти с командами, которые использует кеш API."""
+
+    def __init__(self):
+        self.data: dict[str, tuple[bytes, float | None]] = {}
+
+    def _alive(self, key: str) -> bool:
+        item = self.data.get(key)
+        if item and item[1] is not None and item[1] <= time.monotonic():
+            del self.data[key]
+        return key in self.data
+
+    async def get(self, key: str) -> bytes | None:
+        return self.data[key][0] if self._alive(key) else None
+
+    async def set(self, key: str, value, ex: int | None = None, px: int | None = None, nx: bool = False) -> bool:
+        if nx and self._alive(key):
+            return False
+        if isinstance(value, str):
+            value = value.encode()
+        ttl = ex if ex is not None else px / 1000 if px is not None else None
+        self.data[key] = (value, time.monotonic() + ttl if ttl is not None else None)
+        return True
+
+    async def delete(self, *keys: str) -> int:
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    async def eval(self, script: str, numkeys: int, key: str, token: str) -> int:
+        # Единственный скрипт кеша - снятие своей блокировки.
+        if await self.get(key) == token.encode():
+            return await self.delete(key)
+        return 0
+
+
+@pytest.fixture
+def redis() -> FakeRedis:
+    return FakeRedis()
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    from db.local_cache import cache_stats, local_cache
+    from services import common
+
+    yield
+    local_cache.items.clear()
+    cache_stats.clear()
+    common.in_flight.clear()
+    common.in_flight_refreshes.clear()
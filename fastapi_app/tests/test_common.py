@@ -0,0 +1,206 @@
+import asyncio
+import math
+import time
+
+import pytest
+
+from db import local_cache as local_cache_module
+from models.common import IdModel
+from services import common
+from services.common import RedisService
+
+
+def make_service(redis, lock_ms: int = 200) -> RedisService:
+    service = RedisService(redis)
+    service.cache_lock_ms = lock_ms
+    service.cache_lock_poll_ms = 5
+    return service
+
+
+def counting_load(obj: IdModel | None, delay: float = 0.01):
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return obj
+
+    return load, calls
+
+
+def test_concurrent_misses_load_once(redis):
+    service = make_service(redis)
+    load, calls = counting_load(IdModel(id="1"))
+
+    async def scenario():
+        return await asyncio.gather(*(service._get_or_load("key", IdModel, load) for _ in range(10)))
+
+    results = asyncio.run(scenario())
+
+    assert calls == [1]
+    assert all(result == IdModel(id="1") for result in results)
+
+
+def test_miss_waits_for_other_worker_lock(redis):
+    service = make_service(redis)
+    load, calls = counting_load(IdModel(id="1"))
+
+    async def scenario():
+        await redis.set("lock::key", "other-worker", px=1000)
+        waiter = asyncio.create_task(service._get_or_load("key", IdModel, load))
+        await asyncio.sleep(0.02)
+        await RedisService(redis)._put_to_cache("key", IdModel(id="2"))
+        return await waiter
+
+    assert asyncio.run(scenario()) == IdModel(id="2")
+    assert calls == []
+
+
+def test_miss_loads_itself_after_lock_timeout(redis):
+    service = make_service(redis, lock_ms=30)
+    load, calls = counting_load(IdModel(id="1"))
+
+    async def scenario():
+        await redis.set("lock::key", "hung-worker", px=1000)
+        return await service._get_or_load("key", IdModel, load)
+
+    assert asyncio.run(scenario()) == IdModel(id="1")
+    assert calls == [1]
+
+
+def test_miss_does_not_wait_for_skipped_refresh(redis):
+    service = make_service(redis, lock_ms=30)
+    load, _ = counting_load(IdModel(id="1"))
+
+    async def scenario():
+        # Обновление пропускается, пока блокировку держит другой воркер, и возвращает None.
+        await redis.set("lock::key", "other-worker", px=1000)
+        refresh = service._start_load("key", IdModel, load, refresh=True)
+        result = await service._get_or_load("key", IdModel, load)
+        assert await refresh is None
+        return result
+
+    assert asyncio.run(scenario()) == IdModel(id="1")
+
+
+def test_failed_load_is_not_shared_with_later_requests(redis):
+    service = make_service(redis)
+    attempts = []
+
+    async def load():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("elastic is down")
+        return IdModel(id="1")
+
+    async def scenario():
+        with pytest.raises(ConnectionError):
+            await service._get_or_load("key", IdModel, load)
+        return await service._get_or_load("key", IdModel, load)
+
+    assert asyncio.run(scenario()) == IdModel(id="1")
+    assert len(attempts) == 2
+
+
+def test_should_refresh_only_after_soft_ttl_without_load_time(redis, monkeypatch):
+    service = make_service(redis)
+    monkeypatch.setattr(common.time, "time", lambda: 1000.0)
+
+    assert not service._should_refresh(soft_expires_at=1000.5, load_seconds=0.0)
+    assert service._should_refresh(soft_expires_at=1000.0, load_seconds=0.0)
+
+
+def test_should_refresh_earlier_for_slow_loads(redis, monkeypatch):
+    service = make_service(redis)
+    monkeypatch.setattr(common.time, "time", lambda: 1000.0)
+    # 1 - random() = 1 / e: обновление раньше soft TTL на load_seconds * beta.
+    monkeypatch.setattr(common.random, "random", lambda: 1 - math.exp(-1))
+
+    assert service._should_refresh(soft_expires_at=1001.9, load_seconds=2.0)
+    assert not service._should_refresh(soft_expires_at=1002.1, load_seconds=2.0)
+
+
+def test_stale_entry_is_served_and_refreshed_in_background(redis, monkeypatch):
+    service = make_service(redis)
+    now = [1000.0]
+    monkeypatch.setattr(common.time, "time", lambda: now[0])
+    load, calls = counting_load(IdModel(id="new"))
+
+    async def scenario():
+        await service._put_to_cache("key", IdModel(id="old"))
+        service.local_cache.items.clear()
+        now[0] += service.cache_expire_in_seconds * service.cache_soft_ttl_ratio
+        stale = await service._get_or_load("key", IdModel, load)
+        await asyncio.gather(*common.in_flight_refreshes.values())
+        service.local_cache.items.clear()
+        return stale, await service._get_from_cache("key", IdModel)
+
+    assert asyncio.run(scenario()) == (IdModel(id="old"), IdModel(id="new"))
+    assert calls == [1]
+
+
+def test_refresh_is_skipped_while_other_worker_loads(redis):
+    service = make_service(redis)
+    load, calls = counting_load(IdModel(id="new"))
+
+    async def scenario():
+        await redis.set("lock::key", "other-worker", px=1000)
+        return await service._start_load("key", IdModel, load, refresh=True)
+
+    assert asyncio.run(scenario()) is None
+    assert calls == []
+
+
+def test_refresh_of_deleted_object_drops_stale_entry(redis, monkeypatch):
+    service = make_service(redis)
+    now = [1000.0]
+    monkeypatch.setattr(common.time, "time", lambda: now[0])
+    load, _ = counting_load(None)
+
+    async def scenario():
+        await service._put_to_cache("key", IdModel(id="old"))
+        service.local_cache.items.clear()
+        now[0] += service.cache_expire_in_seconds * service.cache_soft_ttl_ratio
+        await service._get_or_load("key", IdModel, load)
+        await asyncio.gather(*common.in_flight_refreshes.values())
+
+    asyncio.run(scenario())
+
+    assert "key" not in redis.data
+    assert service.local_cache.get("key") is None
+
+
+def test_entries_without_header_are_not_refreshed(redis):
+    service = make_service(redis)
+
+    async def scenario():
+        await redis.set("key", IdModel(id="1").json())
+        return await service._get_from_redis("key", IdModel)
+
+    assert asyncio.run(scenario()) == (IdModel(id="1"), False)
+
+
+def test_hot_key_in_local_cache_is_refreshed_after_soft_ttl(redis, monkeypatch):
+    service = make_service(redis)
+    monkeypatch.setattr(service.local_cache, "ttl", service.cache_expire_in_seconds)
+    now = [1000.0]
+    monkeypatch.setattr(common.time, "time", lambda: now[0])
+    # Часы event loop тоже идут по monotonic: они сдвигаются вместе с now, но не останавливаются.
+    monotonic = time.monotonic
+    monkeypatch.setattr(local_cache_module.time, "monotonic", lambda: monotonic() + now[0] - 1000.0)
+    load, calls = counting_load(IdModel(id="new"))
+
+    async def scenario():
+        await service._put_to_cache("key", IdModel(id="old"))
+        # Ключ читается часто и до soft TTL отдаётся из L1.
+        for _ in range(14):
+            now[0] += 10
+            assert await service._get_or_load("key", IdModel, load) == IdModel(id="old")
+        assert calls == []
+        now[0] += 10
+        stale = await service._get_or_load("key", IdModel, load)
+        await asyncio.gather(*common.in_flight_refreshes.values())
+        return stale, await service._get_or_load("key", IdModel, load)
+
+    assert asyncio.run(scenario()) == (IdModel(id="old"), IdModel(id="new"))
+    assert calls == [1]
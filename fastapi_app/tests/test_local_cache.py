@@ -0,0 +1,95 @@
+import asyncio
+
+from db import local_cache as local_cache_module
+from db.local_cache import LocalCache, cache_stats, prefix_ttl
+from models.common import IdModel
+from services.common import RedisService
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_prefix_ttl_uses_longest_prefix():
+    ttls = {"movies": 60, "movies::film_id": 30}
+
+    assert prefix_ttl(ttls, "movies::film_id::1", 300) == 30
+    assert prefix_ttl(ttls, "movies::search_str::x", 300) == 60
+    assert prefix_ttl(ttls, "genres::genre_id::1", 300) == 300
+
+
+def test_local_cache_expires_by_prefix_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(local_cache_module.time, "monotonic", clock)
+    cache = LocalCache(max_size=10, ttl=60, prefix_ttls={"genres": 5})
+    cache.set("genres::all", "genres")
+    cache.set("movies::film_id::1", "film")
+
+    clock.now += 10
+
+    assert cache.get("genres::all") is None
+    assert cache.get("movies::film_id::1") == "film"
+
+
+def test_local_cache_evicts_least_recently_used():
+    cache = LocalCache(max_size=2, ttl=60, prefix_ttls={})
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+
+
+def test_local_cache_skips_prefixes_with_zero_ttl():
+    cache = LocalCache(max_size=10, ttl=60, prefix_ttls={"persons": 0})
+    cache.set("persons::person_id::1", "person")
+
+    assert cache.get("persons::person_id::1") is None
+
+
+def test_local_cache_delete_prefix():
+    cache = LocalCache(max_size=10, ttl=60, prefix_ttls={})
+    cache.set("movies::film_id::1", 1)
+    cache.set("movies::film_id::2", 2)
+    cache.set("genres::genre_id::1", 3)
+
+    cache.delete_prefix("movies::film_id::")
+
+    assert list(cache.items) == ["genres::genre_id::1"]
+
+
+def test_redis_hit_is_kept_in_local_cache(redis):
+    service = RedisService(redis)
+
+    async def scenario():
+        await service._put_to_cache("movies::film_id::1", IdModel(id="1"))
+        service.local_cache.items.clear()
+        first = await service._get_from_cache("movies::film_id::1", IdModel)
+        redis.data.clear()
+        second = await service._get_from_cache("movies::film_id::1", IdModel)
+        return first, second
+
+    assert asyncio.run(scenario()) == (IdModel(id="1"), IdModel(id="1"))
+    assert cache_stats["redis", "hit"] == 1
+    assert cache_stats["local", "hit"] == 1
+
+
+def test_redis_ttl_uses_prefix_ttl(redis):
+    service = RedisService(redis)
+    service.cache_expire_in_seconds = 300
+    service.cache_prefix_ttls = {"genres": 3600}
+
+    async def scenario():
+        await service._put_to_cache("genres::genre_id::1", IdModel(id="1"))
+        await service._put_to_cache("movies::film_id::1", IdModel(id="1"))
+
+    asyncio.run(scenario())
+
+    genre_expires_at = redis.data["genres::genre_id::1"][1]
+    film_expires_at = redis.data["movies::film_id::1"][1]
+    assert round(genre_expires_at - film_expires_at) == 3300
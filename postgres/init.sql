@@ -14234,6 +14234,48 @@ CREATE INDEX film_work_title_idx ON content.film_work USING btree (title);
 CREATE INDEX person_full_name_idx ON content.person USING btree (full_name);
 
 
+--
+-- Name: film_work_modified_id_idx; Type: INDEX; Schema: content; Owner: app
+--
+
+CREATE INDEX film_work_modified_id_idx ON content.film_work USING btree (modified, id);
+
+
+--
+-- Name: genre_film_work_created_idx; Type: INDEX; Schema: content; Owner: app
+--
+
+CREATE INDEX genre_film_work_created_idx ON content.genre_film_work USING btree (created);
+
+
+--
+-- Name: genre_film_work_genre_idx; Type: INDEX; Schema: content; Owner: app
+--
+
+CREATE INDEX genre_film_work_genre_idx ON content.genre_film_work USING btree (genre_id);
+
+
+--
+-- Name: genre_modified_id_idx; Type: INDEX; Schema: content; Owner: app
+--
+
+CREATE INDEX genre_modified_id_idx ON content.genre USING btree (modified, id);
+
+
+--
+-- Name: person_film_work_created_idx; Type: INDEX; Schema: content; Owner: app
+--
+
+CREATE INDEX person_film_work_created_idx ON content.person_film_work USING btree (created);
+
+
+--
+-- Name: person_modified_id_idx; Type: INDEX; Schema: content; Owner: app
+--
+
+CREATE INDEX person_modified_id_idx ON content.person USING btree (modified, id);
+
+
 --
 -- Name: auth_group_name_a6ea08ec_like; Type: INDEX; Schema: public; Owner: app
 --